@@ -0,0 +1,165 @@
+import hashlib
+from datetime import datetime
+from flask import Blueprint, jsonify, request, make_response
+from flask_login import login_required
+import budget as budget_logic
+import savings_goals as savings_goals_logic
+
+# Read-only JSON API, versioned by URL prefix.
+#
+# Every response carries a strong ETag built from the ledger change counter
+# (budget.get_ledger_version) and whatever else selects the representation (query
+# arguments, the resolved report date range). The counter is read first, so when
+# If-None-Match matches, a 304 goes back without running the report or page queries.
+# Reading it before the data also means an ETag can only be older than the body it comes
+# with, never newer: a client may refetch once too often but never keeps stale data.
+#
+# That guarantee needs the counter to move in the same commit as the writes. It is bumped
+# once per writing transaction, at commit time (migrate.py, migration 13). A nextval()
+# sequence would avoid even that brief lock, but it moves before the commit is visible, so
+# an ETag could end up newer than its body. The trade-offs: committing ledger writers queue
+# for a moment on the counter row, and any ledger write changes every ETag, so clients
+# refetch resources that did not change.
+
+API_VERSION = 'v1'
+api = Blueprint('api', __name__, url_prefix=f'/api/{API_VERSION}')
+
+
+def _etag(ledger_version, *parts):
+    key = '|'.join(str(part) for part in (API_VERSION, request.path, ledger_version) + parts)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+def _not_modified(etag):
+    """A 304 response if the client already holds `etag`, else None."""
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    return None
+
+def _json(payload, etag):
+    response = jsonify(payload)
+    response.set_etag(etag)
+    # Cache, but revalidate every time: with a matching ETag that costs a single-row lookup
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def _sorted_args():
+    return tuple(sorted(request.args.items(multi=True)))
+
+def _transaction_json(t):
+    return {
+        'id': t.id,
+        'transaction_id': t.transaction_id,
+        'date': t.date.isoformat(),
+        'type': t.type,
+        'category': t.category,
+        'item': t.item,
+        'amount': float(t.amount),
+        'description': t.description,
+        'savings_goal_id': t.savings_goal_id
+    }
+
+def _cursor_arg(prefix):
+    """Reads a (date, id) keyset cursor such as after_date/after_id from the query string."""
+    cursor_date = request.args.get(f'{prefix}_date')
+    cursor_id = request.args.get(f'{prefix}_id', type=int)
+    if not cursor_date or cursor_id is None:
+        return None
+    try:
+        return (datetime.strptime(cursor_date, '%Y-%m-%d').date(), cursor_id)
+    except ValueError:
+        return None
+
+@api.route('/report')
+@login_required
+def report_summary():
+    """Report totals and breakdowns (no transaction rows; page through /transactions for those)."""
+    period = request.args.get('period', 'monthly')
+    start_date_str = request.args.get('start_date')
+    end_date_str = request.args.get('end_date')
+    if start_date_str and end_date_str:
+        period = 'custom'
+
+    ledger_version = budget_logic.get_ledger_version()
+    # Relative periods ("monthly") move with the calendar, so the resolved range is part of the tag
+    range_start, range_end = budget_logic.resolve_report_bounds(period, start_date_str, end_date_str)
+    etag = _etag(ledger_version, period, range_start, range_end)
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
+
+    report = budget_logic.generate_report_data(period, start_date_str, end_date_str)
+    return _json({
+        'period': report['period'],
+        'start_date': report['start_date'],
+        'end_date': report['end_date'],
+        'total_income': report['total_income'],
+        'total_expense': report['total_expense'],
+        'total_savings': report['total_savings'],
+        'total_goal_savings': report['total_goal_savings'],
+        'total_general_savings': report['total_general_savings'],
+        'balance': report['balance'],
+        'transaction_count': len(report['transactions']),
+        # Lists rather than objects so the order survives JSON key sorting
+        'income_breakdown_by_item': [
+            {'item': item, 'amount': amount} for item, amount in report['income_breakdown_by_item'].items()
+        ],
+        'expense_breakdown_by_category': report['expense_breakdown_by_category'],
+        'monthly_summaries': report['monthly_summaries'],
+        'ledger_version': ledger_version
+    }, etag)
+
+@api.route('/transactions')
+@login_required
+def transactions_page():
+    """One page of transactions, newest first, or of search results when `q` is given."""
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 10, type=int), 1), 100)
+    search_query = request.args.get('q', '').strip()
+
+    ledger_version = budget_logic.get_ledger_version()
+    etag = _etag(ledger_version, _sorted_args())
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
+
+    next_cursor = None
+    if search_query:
+        rows, total, _ = budget_logic.search_transactions(search_query, page, per_page)
+    else:
+        rows, total = budget_logic.get_transactions_page(
+            page, per_page, after=_cursor_arg('after'), before=_cursor_arg('before'))
+        if rows:
+            next_cursor = {'after_date': rows[-1].date.isoformat(), 'after_id': rows[-1].id}
+
+    return _json({
+        'page': page,
+        'per_page': per_page,
+        'total': total,
+        'total_pages': (total + per_page - 1) // per_page,
+        'next_cursor': next_cursor,
+        'transactions': [_transaction_json(t) for t in rows],
+        'ledger_version': ledger_version
+    }, etag)
+
+@api.route('/savings_goals')
+@login_required
+def savings_goals():
+    ledger_version = budget_logic.get_ledger_version()
+    etag = _etag(ledger_version)
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
+
+    goals = [
+        {
+            'id': int(goal['id']),
+            'name': goal['name'],
+            'target_amount': goal['target_amount'],
+            'saved_amount': goal['saved_amount']
+        }
+        for goal in savings_goals_logic.get_savings_goals()
+    ]
+    return _json({'savings_goals': goals, 'ledger_version': ledger_version}, etag)
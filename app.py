@@ -1,17 +1,24 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session
-from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
-from flask_mail import Mail, Message
+from flask import Flask, render_template, request, redirect, url_for, flash, session, Response, jsonify, make_response
+from flask_login import LoginManager, login_user, login_required, logout_user, current_user
 from itsdangerous import URLSafeTimedSerializer, SignatureExpired, BadTimeSignature
 import os # Added os import
 from functools import wraps # Added wraps import
 import pyotp # Added pyotp import
 import budget as budget_logic
 import settings_manager
+from users import User, get_user_by_username, get_user_by_id, get_user_by_email, current_users_version
 import savings_goals as savings_goals_logic
 from datetime import datetime
 import db  # Import the new db module
-import migrate # New import
+import cache
+import bulk_import
+import export
+import report_export
+import report_cache
+import passwords
+import mail_outbox
+from api import api as api_blueprint
+import click
 
 app = Flask(__name__)
 app.secret_key = os.urandom(24)
@@ -23,24 +30,57 @@ app.config['MAIL_USERNAME'] = os.environ.get('MAIL_USERNAME')
 app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD')
 app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('MAIL_DEFAULT_SENDER')
 
-# Initialize the database
+# Initialize the database (creates tables and applies pending schema migrations)
 with app.app_context():
     db.init_db()
+# One pooled connection and one commit per request (see db.get_db_connection)
+db.init_app(app)
+app.register_blueprint(api_blueprint)
 
-    # --- ONE-TIME MIGRATION EXECUTION ---
-    if os.environ.get('RUN_MIGRATION') == 'True':
-        print("Running one-time database migration...")
-        migrate.run_migration()
-        print("One-time database migration complete.")
-    # --- END ONE-TIME MIGRATION EXECUTION ---
-
-mail = Mail(app)
+# Delivers queued mail (mail_outbox.enqueue) from a background thread, started with the first request
+mail_outbox.init_app(app)
 s = URLSafeTimedSerializer(app.secret_key)
 
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
+# load_user runs on every authenticated request; cache the User objects it builds.
+# Writes in this process invalidate immediately. Each entry also carries the shared
+# users_version it was read under, and is reloaded once that moves on. So a demotion, a
+# deletion or a password reset made in another worker applies here within
+# USER_VERSION_CHECK_INTERVAL seconds, not after the TTL.
+user_cache = cache.TTLCache(
+    maxsize=int(os.environ.get('USER_CACHE_SIZE', 1024)),
+    ttl=float(os.environ.get('USER_CACHE_TTL', 60))
+)
+
+def invalidate_cached_user(conn, user_id):
+    """Drops a user from user_cache once the change made on `conn` is committed."""
+    db.on_commit(conn, lambda: user_cache.invalidate(str(user_id)))
+
+# Behind one reverse proxy (e.g. the Heroku router), rate limit on the address it appended to
+# X-Forwarded-For; earlier entries come from the client and can be forged
+TRUST_PROXY = os.environ.get('TRUST_PROXY', 'False').lower() == 'true'
+
+def _client_ip():
+    if TRUST_PROXY and request.access_route:
+        return request.access_route[-1]
+    return request.remote_addr
+
+def _password_attempt_refused(template, retry_after=None, **context):
+    """
+    Re-renders a password form with a 429 (rate limited, `retry_after` seconds) or,
+    without retry_after, a 503 (every hashing slot busy).
+    """
+    if retry_after:
+        flash('Too many attempts. Please wait a minute and try again.', 'danger')
+    else:
+        flash('The server is busy. Please try again in a moment.', 'danger')
+    response = make_response(render_template(template, **context), 429 if retry_after else 503)
+    response.headers['Retry-After'] = str(int(retry_after or 1) + 1)
+    return response
+
 def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -51,56 +91,18 @@ def admin_required(f):
     return decorated_function
 
 
-
-class User(UserMixin):
-    def __init__(self, id, username, email, password_hash, role='user', totp_secret=None):
-        self.id = id
-        self.username = username
-        self.email = email
-        self.password_hash = password_hash
-        self.role = role
-        self.totp_secret = totp_secret
-
-def get_user_by_username(username):
-    conn = db.get_db_connection()
-    try:
-        with conn.cursor() as cur:
-            cur.execute("SELECT * FROM users WHERE username = %s;", (username,))
-            user_data = cur.fetchone()
-            if user_data:
-                return User(id=user_data[0], username=user_data[1], email=user_data[2], password_hash=user_data[3], role=user_data[4], totp_secret=user_data[5])
-    finally:
-        db.release_db_connection(conn)
-    return None
-
-def get_user_by_id(user_id):
-    conn = db.get_db_connection()
-    try:
-        with conn.cursor() as cur:
-            cur.execute("SELECT * FROM users WHERE id = %s;", (user_id,))
-            user_data = cur.fetchone()
-            if user_data:
-                return User(id=user_data[0], username=user_data[1], email=user_data[2], password_hash=user_data[3], role=user_data[4], totp_secret=user_data[5])
-    finally:
-        db.release_db_connection(conn)
-    return None
-
-def get_user_by_email(email):
-    conn = db.get_db_connection()
-    try:
-        with conn.cursor() as cur:
-            cur.execute("SELECT * FROM users WHERE email = %s;", (email,))
-            user_data = cur.fetchone()
-            if user_data:
-                return User(id=user_data[0], username=user_data[1], email=user_data[2], password_hash=user_data[3], role=user_data[4], totp_secret=user_data[5])
-    finally:
-        db.release_db_connection(conn)
-    return None
-
-
 @login_manager.user_loader
 def load_user(user_id):
-    return get_user_by_id(user_id)
+    user_id = str(user_id)
+    # Read before the user: an entry may end up stamped older than its data, never newer
+    users_version = current_users_version()
+    entry = user_cache.get(user_id)
+    if entry is not cache.MISSING and entry[0] == users_version:
+        return entry[1]
+    user = get_user_by_id(user_id)
+    if user:
+        user_cache.set(user_id, (users_version, user))
+    return user
 
 
 def get_all_users():
@@ -120,7 +122,8 @@ def update_user_totp_secret(user_id, totp_secret):
     try:
         with conn.cursor() as cur:
             cur.execute("UPDATE users SET totp_secret = %s WHERE id = %s;", (totp_secret, user_id))
-            conn.commit()
+            db.commit(conn)
+            invalidate_cached_user(conn, user_id)
     finally:
         db.release_db_connection(conn)
 
@@ -129,7 +132,8 @@ def update_user_password(user_id, new_password_hash):
     try:
         with conn.cursor() as cur:
             cur.execute("UPDATE users SET password_hash = %s WHERE id = %s;", (new_password_hash, user_id))
-            conn.commit()
+            db.commit(conn)
+            invalidate_cached_user(conn, user_id)
     finally:
         db.release_db_connection(conn)
 
@@ -152,7 +156,8 @@ def delete_user(user_id):
     try:
         with conn.cursor() as cur:
             cur.execute("DELETE FROM users WHERE id = %s;", (user_id,))
-            conn.commit()
+            db.commit(conn)
+            invalidate_cached_user(conn, user_id)
     finally:
         db.release_db_connection(conn)
 
@@ -171,7 +176,8 @@ def promote_user(user_id):
     try:
         with conn.cursor() as cur:
             cur.execute("UPDATE users SET role = 'admin' WHERE id = %s;", (user_id,))
-            conn.commit()
+            db.commit(conn)
+            invalidate_cached_user(conn, user_id)
     finally:
         db.release_db_connection(conn)
 
@@ -190,13 +196,53 @@ def demote_user(user_id):
     try:
         with conn.cursor() as cur:
             cur.execute("UPDATE users SET role = 'user' WHERE id = %s;", (user_id,))
-            conn.commit()
+            db.commit(conn)
+            invalidate_cached_user(conn, user_id)
     finally:
         db.release_db_connection(conn)
 
     flash('User demoted to user.', 'success')
     return redirect(url_for('admin_users'))
 
+@app.route('/admin/reconcile_savings_goals', methods=['POST'])
+@login_required
+@admin_required
+def reconcile_savings_goals():
+    corrected = savings_goals_logic.recalculate_saved_amounts()
+    flash(f'Savings goals reconciled. {corrected} goal(s) corrected.', 'success')
+    return redirect(url_for('admin_users'))
+
+@app.route('/admin/metrics')
+@login_required
+@admin_required
+def admin_metrics():
+    return jsonify({
+        'db_pool': db.pool_metrics(),
+        'user_cache': user_cache.stats(),
+        'report_cache': report_cache.stats(),
+        'passwords': passwords.stats(),
+        'outbox': mail_outbox.stats()
+    })
+
+@app.cli.command('reconcile-savings-goals')
+def reconcile_savings_goals_command():
+    """Rebuilds every savings goal's saved_amount from the transactions table."""
+    corrected = savings_goals_logic.recalculate_saved_amounts()
+    print(f"Savings goals reconciled. {corrected} goal(s) corrected.")
+
+@app.cli.command('rebuild-monthly-rollups')
+def rebuild_monthly_rollups_command():
+    """Rebuilds the monthly_rollups table used by yearly reports from the transactions table."""
+    written = budget_logic.rebuild_monthly_rollups()
+    print(f"Monthly rollups rebuilt. {written} row(s) written.")
+
+@app.cli.command('send-mail')
+@click.option('--once', is_flag=True, help='Send what is due now and exit instead of running until stopped.')
+def send_mail_command(once):
+    """Delivers queued mail from the outbox (for MAIL_OUTBOX_SENDER=worker, or to drain it by hand)."""
+    mail_outbox.run_sender(app.config, once=once)
+    print("Outbox sender finished.")
+
 @app.route('/logout')
 @login_required
 def logout():
@@ -212,9 +258,15 @@ def change_password():
         new_password = request.form.get('new_password')
         confirm_password = request.form.get('confirm_password')
 
-        if not check_password_hash(current_user.password_hash, current_password):
-            flash('Incorrect current password.', 'danger')
-            return redirect(url_for('change_password'))
+        retry_after = passwords.check_rate_limit(_client_ip(), current_user.username)
+        if retry_after:
+            return _password_attempt_refused('change_password.html', retry_after)
+        try:
+            if not passwords.verify_password(current_user.password_hash, current_password):
+                flash('Incorrect current password.', 'danger')
+                return redirect(url_for('change_password'))
+        except passwords.HashingBusy:
+            return _password_attempt_refused('change_password.html')
 
         if new_password != confirm_password:
             flash('New password and confirmation do not match.', 'danger')
@@ -224,7 +276,10 @@ def change_password():
             flash('New password must be at least 6 characters long.', 'danger')
             return redirect(url_for('change_password'))
 
-        new_password_hash = generate_password_hash(new_password, method='pbkdf2:sha256')
+        try:
+            new_password_hash = passwords.hash_password(new_password)
+        except passwords.HashingBusy:
+            return _password_attempt_refused('change_password.html')
         update_user_password(current_user.id, new_password_hash)
         
         flash('Your password has been changed successfully.', 'success')
@@ -240,9 +295,22 @@ def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
+        retry_after = passwords.check_rate_limit(_client_ip(), username)
+        if retry_after:
+            return _password_attempt_refused('login.html', retry_after)
         user = get_user_by_username(username)
 
-        if user and check_password_hash(user.password_hash, password):
+        valid = False
+        if user:
+            try:
+                valid, new_password_hash = passwords.verify_and_update(user.password_hash, password)
+            except passwords.HashingBusy:
+                return _password_attempt_refused('login.html')
+            if new_password_hash:
+                # Stored with older hashing parameters: upgrade it while the password is at hand
+                update_user_password(user.id, new_password_hash)
+
+        if valid:
             if user.totp_secret:
                 session['temp_user_id'] = user.id
                 return redirect(url_for('verify_2fa'))
@@ -269,14 +337,15 @@ def forgot_password():
         if user and user.email:
             token = s.dumps(user.id, salt='password-reset-salt')
             reset_url = url_for('reset_password', token=token, _external=True)
-            msg = Message('Password Reset Request', sender=app.config['MAIL_DEFAULT_SENDER'], recipients=[user.email])
-            msg.body = f'To reset your password, visit the following link: {reset_url}\n\n' \
-                       f'If you did not request a password reset, please ignore this email.'
-            try:
-                mail.send(msg)
-                flash('A password reset link has been sent to your email address.', 'info')
-            except Exception as e:
-                flash(f'Error sending email: {e}. Please check your mail server configuration.', 'danger')
+            # Queued with this request's commit and sent in the background (see mail_outbox)
+            mail_outbox.enqueue(
+                'Password Reset Request',
+                [user.email],
+                f'To reset your password, visit the following link: {reset_url}\n\n'
+                f'If you did not request a password reset, please ignore this email.',
+                sender=app.config['MAIL_DEFAULT_SENDER']
+            )
+            flash('A password reset link has been sent to your email address.', 'info')
             return redirect(url_for('login'))
         else:
             flash('Username or email not found, or no email associated with this account.', 'danger')
@@ -316,7 +385,13 @@ def reset_password(token):
             flash('New password must be at least 6 characters long.', 'danger')
             return render_template('reset_password.html', token=token)
         
-        hashed_password = generate_password_hash(new_password, method='pbkdf2:sha256')
+        retry_after = passwords.check_rate_limit(_client_ip())
+        if retry_after:
+            return _password_attempt_refused('reset_password.html', retry_after, token=token)
+        try:
+            hashed_password = passwords.hash_password(new_password)
+        except passwords.HashingBusy:
+            return _password_attempt_refused('reset_password.html', token=token)
         update_user_password(user.id, hashed_password)
         flash('Your password has been reset successfully. Please log in.', 'success')
         return redirect(url_for('login'))
@@ -365,11 +440,18 @@ def register():
         email = request.form['email']
         password = request.form['password']
         
+        retry_after = passwords.check_rate_limit(_client_ip())
+        if retry_after:
+            return _password_attempt_refused('register.html', retry_after)
+
         if get_user_by_username(username):
             flash('Username already exists.', 'warning')
             return redirect(url_for('register'))
             
-        password_hash = generate_password_hash(password, method='pbkdf2:sha256')
+        try:
+            password_hash = passwords.hash_password(password)
+        except passwords.HashingBusy:
+            return _password_attempt_refused('register.html')
         
         conn = db.get_db_connection()
         try:
@@ -382,7 +464,7 @@ def register():
                     "INSERT INTO users (username, email, password_hash, role) VALUES (%s, %s, %s, %s);",
                     (username, email, password_hash, role)
                 )
-                conn.commit()
+                db.commit(conn)
         finally:
             db.release_db_connection(conn)
             
@@ -411,77 +493,78 @@ def index():
         description = request.form.get('description', '')
         savings_goal_id = request.form.get('savings_goal_id')
 
-        if transaction_type == 'income' and item and amount > 0:
-            category = request.form.get('category')
-            if category in current_income_categories:
-                budget_logic.add_transaction('income', category, item, amount, date, description)
-        elif transaction_type == 'expense' and item and amount > 0:
-            category = request.form.get('category')
-            # Ensure savings_goal_id is only processed if category is "Goal Savings"
-            transaction_savings_goal_id = request.form.get('savings_goal_id') if category == 'Goal Savings' else ''
-
-            if category in current_expense_categories:
-                if category == 'Goal Savings':
-                    if not transaction_savings_goal_id:
-                        flash('Please select a savings goal for "Goal Savings" category.', 'danger')
-                        return redirect(url_for('index'))
-                    budget_logic.add_transaction('expense', category, item, amount, date, description, transaction_savings_goal_id)
-                    savings_goals_logic.update_saved_amount(transaction_savings_goal_id, amount)
-                elif category == 'General Savings':
-                    # General Savings should not be linked to a specific goal
-                    budget_logic.add_transaction('expense', category, item, amount, date, description, '')
-                else:
-                    # Other categories (non-saving related)
-                    budget_logic.add_transaction('expense', category, item, amount, date, description, '')
+        try: # add_transaction rejects a category deleted meanwhile (the settings cache may lag)
+            if transaction_type == 'income' and item and amount > 0:
+                category = request.form.get('category')
+                if category in current_income_categories:
+                    budget_logic.add_transaction('income', category, item, amount, date, description)
+            elif transaction_type == 'expense' and item and amount > 0:
+                category = request.form.get('category')
+                # Ensure savings_goal_id is only processed if category is "Goal Savings"
+                transaction_savings_goal_id = request.form.get('savings_goal_id') if category == 'Goal Savings' else ''
+
+                if category in current_expense_categories:
+                    if category == 'Goal Savings':
+                        if not transaction_savings_goal_id:
+                            flash('Please select a savings goal for "Goal Savings" category.', 'danger')
+                            return redirect(url_for('index'))
+                        # add_transaction also credits the goal's saved_amount
+                        budget_logic.add_transaction('expense', category, item, amount, date, description, transaction_savings_goal_id)
+                    elif category == 'General Savings':
+                        # General Savings should not be linked to a specific goal
+                        budget_logic.add_transaction('expense', category, item, amount, date, description, '')
+                    else:
+                        # Other categories (non-saving related)
+                        budget_logic.add_transaction('expense', category, item, amount, date, description, '')
+        except ValueError as e:
+            flash(str(e), 'danger')
         
         return redirect(url_for('index'))
 
-    all_transactions = budget_logic.get_transactions()
-    savings_goals_logic.recalculate_saved_amounts(all_transactions) # Recalculate saved amounts for goals
     return render_template('index.html', 
                            categories=current_expense_categories, 
-                           transactions=all_transactions, 
                            category_icons=current_category_icons, 
                            income_categories=current_income_categories,
                            income_category_icons=current_income_category_icons,
                            savings_goals=savings_goals,
                            today_date=datetime.now().strftime('%Y-%m-%d'))
 
+def _page_cursor(prefix):
+    """Reads a (date, id) keyset cursor such as after_date/after_id from the query string."""
+    cursor_date = request.args.get(f'{prefix}_date')
+    cursor_id = request.args.get(f'{prefix}_id', type=int)
+    if not cursor_date or cursor_id is None:
+        return None
+    try:
+        return (datetime.strptime(cursor_date, '%Y-%m-%d').date(), cursor_id)
+    except ValueError:
+        return None
+
 @app.route('/transactions')
 @login_required
 def transactions():
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 10, type=int)
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 10, type=int), 1), 100)
     search_query = request.args.get('search_query', '').strip()
 
-    all_transactions = budget_logic.get_transactions()
-    
     app_settings = settings_manager.get_settings()
     current_category_icons = app_settings['category_icons']
     income_category_icons = app_settings['income_category_icons']
     
+    next_cursor = {}
+    prev_cursor = {}
     if search_query:
-        filtered_transactions = [
-            t for t in all_transactions
-            if search_query.lower() in str(t.get('item', '')).lower() or \
-               search_query.lower() in str(t.get('category', '')).lower() or \
-               search_query.lower() in str(t.get('description', '')).lower() or \
-               search_query.lower() in str(t.get('amount', '')).lower() or \
-               search_query.lower() in str(t.get('date', '')).lower() or \
-               search_query.lower() in str(t.get('type', '')).lower() or \
-               search_query.lower() in str(t.get('transaction_id', '')).lower()
-        ]
-        transactions_to_paginate = filtered_transactions
+        paginated_transactions, total_transactions, _ = budget_logic.search_transactions(search_query, page, per_page)
     else:
-        transactions_to_paginate = all_transactions
+        # Only one page is read from the database; deep pages follow the (date, id) cursor
+        paginated_transactions, total_transactions = budget_logic.get_transactions_page(
+            page, per_page, after=_page_cursor('after'), before=_page_cursor('before'))
+        if paginated_transactions:
+            next_cursor = {'after_date': paginated_transactions[-1].date.isoformat(), 'after_id': paginated_transactions[-1].id}
+            prev_cursor = {'before_date': paginated_transactions[0].date.isoformat(), 'before_id': paginated_transactions[0].id}
 
-    total_transactions = len(transactions_to_paginate)
     total_pages = (total_transactions + per_page - 1) // per_page
 
-    start_index = (page - 1) * per_page
-    end_index = start_index + per_page
-    paginated_transactions = transactions_to_paginate[start_index:end_index]
-
     return render_template('transactions.html', 
                            transactions=paginated_transactions, 
                            category_icons=current_category_icons,
@@ -490,6 +573,8 @@ def transactions():
                            per_page=per_page,
                            total_pages=total_pages,
                            total_transactions=total_transactions,
+                           next_cursor=next_cursor,
+                           prev_cursor=prev_cursor,
                            search_query=search_query)
 
 @app.route('/report')
@@ -531,43 +616,33 @@ def report():
     current_category_icons = app_settings['category_icons']
     income_category_icons = app_settings['income_category_icons']
     
-    all_transactions = budget_logic.get_transactions()
-    savings_goals_logic.recalculate_saved_amounts(all_transactions)
     savings_goals = savings_goals_logic.get_savings_goals()
     # total_general_savings = savings_goals_logic.get_general_savings_total(all_transactions) # Get total general savings
     total_general_savings = report_data.get('total_general_savings', 0) # Get total general savings
-    original_total_income = report_data['total_income'] if report_data else 0
-
-    transactions_to_paginate = report_data['transactions'] # This is the list of all transactions for the period
 
     if search_query:
-        transactions_to_paginate = [
-            t for t in transactions_to_paginate
-            if search_query.lower() in str(t.get('item', '')).lower() or \
-               search_query.lower() in str(t.get('category', '')).lower() or \
-               search_query.lower() in str(t.get('description', '')).lower() or \
-               search_query.lower() in str(t.get('amount', '')).lower() or \
-               search_query.lower() in str(t.get('date', '')).lower() or \
-               search_query.lower() in str(t.get('type', '')).lower() or \
-               search_query.lower() in str(t.get('transaction_id', '')).lower()
-        ]
-    
-    # Calculate totals AFTER search filter
-    displayed_total_expense = sum(t['amount'] for t in transactions_to_paginate if t['type'] == 'expense')
-    
-    # Pagination logic
-    total_transactions_in_period = len(transactions_to_paginate)
-    total_pages_in_period = (total_transactions_in_period + per_page - 1) // per_page
+        # Search runs in the database, limited to the report's date range
+        range_start, range_end = budget_logic.resolve_report_bounds(period, start_date_str, end_date_str)
+        paginated_transactions_for_report, total_transactions_in_period, displayed_total_expense = \
+            budget_logic.search_transactions(search_query, page, per_page, range_start, range_end)
+    else:
+        transactions_to_paginate = report_data['transactions'] # This is the list of all transactions for the period
+        displayed_total_expense = report_data['total_expense']
+        total_transactions_in_period = len(transactions_to_paginate)
+
+        start_index = (page - 1) * per_page
+        end_index = start_index + per_page
+        paginated_transactions_for_report = transactions_to_paginate[start_index:end_index]
 
-    start_index = (page - 1) * per_page
-    end_index = start_index + per_page
-    paginated_transactions_for_report = transactions_to_paginate[start_index:end_index]
+    total_pages_in_period = (total_transactions_in_period + per_page - 1) // per_page
 
     if report_data and report_data['period'] == 'monthly':
-        settings = settings_manager.get_settings()
-        report_data['total_budget'] = original_total_income
-        report_data['savings_goal'] = settings.get('monthly_savings_goal', 0)
-        report_data['remaining_spending'] = report_data['total_budget'] - report_data['savings_goal'] - displayed_total_expense
+        _add_monthly_budget(report_data, app_settings, displayed_total_expense)
+
+    # The server-side PDF/CSV export of the same report (custom ranges carry their dates along)
+    export_args = {'period': period}
+    if period == 'custom' and start_date_str and end_date_str:
+        export_args.update(start_date=start_date_str, end_date=end_date_str)
         
     return render_template('report.html', 
                            report=report_data, 
@@ -587,16 +662,116 @@ def report():
                            page=page,
                            per_page=per_page,
                            total_pages=total_pages_in_period,
-                           total_transactions=total_transactions_in_period)
+                           total_transactions=total_transactions_in_period,
+                           export_args=export_args)
+
+def _add_monthly_budget(report_data, app_settings, total_expense):
+    """Adds the monthly budget figures (income as budget, savings goal, what is left to spend) to a monthly report."""
+    report_data['total_budget'] = report_data['total_income']
+    report_data['savings_goal'] = app_settings.get('monthly_savings_goal', 0)
+    report_data['remaining_spending'] = report_data['total_budget'] - report_data['savings_goal'] - total_expense
+
+@app.route('/report/export')
+@login_required
+def export_report():
+    fmt = request.args.get('format', 'pdf')
+    period = request.args.get('period')
+    start_date_str = request.args.get('start_date')
+    end_date_str = request.args.get('end_date')
+    if fmt not in report_export.REPORT_EXPORT_FORMATS:
+        flash(f"Unknown export format '{fmt}'.", 'danger')
+        return redirect(url_for('report'))
+
+    # The version is read before the report, so a cached file can only be keyed older than its data, never newer
+    ledger_version = budget_logic.get_ledger_version()
+    range_start, range_end = budget_logic.resolve_report_bounds(period, start_date_str, end_date_str)
+    key = report_export.cache_key(fmt, period, range_start, range_end, ledger_version)
+
+    artifact = report_export.cached_artifact(key)
+    if artifact is None:
+        report_data = budget_logic.generate_report_data(period=period, start_date_str=start_date_str, end_date_str=end_date_str)
+        if report_data['period'] == 'monthly':
+            _add_monthly_budget(report_data, settings_manager.get_settings(), report_data['total_expense'])
+        # Pages are sent as they are laid out; the finished file is cached for the next download
+        artifact = report_export.iter_report(report_data, fmt, key)
+
+    return Response(
+        artifact,
+        mimetype=report_export.REPORT_EXPORT_FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename={report_export.export_filename(range_start, range_end, fmt)}'}
+    )
+
+@app.route('/import', methods=['GET', 'POST'])
+@login_required
+@admin_required # Writes to the whole ledger, like reconcile and rebuild
+def import_transactions():
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            flash('Please choose a CSV file to import.', 'danger')
+            return redirect(url_for('import_transactions'))
+
+        try:
+            # The upload is streamed straight into COPY, never read fully into memory
+            result = bulk_import.import_transactions_csv(upload.stream)
+        except ValueError as e:
+            flash(str(e), 'danger')
+            return redirect(url_for('import_transactions'))
+
+        flash(f"Imported {result['imported']} transaction(s) in {result['seconds']:.1f}s "
+              f"({result['skipped']} already present and skipped).", 'success')
+        return redirect(url_for('transactions'))
+
+    return render_template('import.html', columns=bulk_import.CSV_COLUMNS)
+
+@app.cli.command('import-transactions')
+@click.argument('csv_path', type=click.Path(exists=True, dir_okay=False))
+def import_transactions_command(csv_path):
+    """Bulk-imports a CSV file laid out like transactions.csv."""
+    try:
+        result = bulk_import.import_transactions_file(csv_path)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    print(f"Imported {result['imported']} of {result['staged']} row(s) in {result['seconds']:.2f}s "
+          f"({result['skipped']} already present and skipped).")
+
+@app.route('/export')
+@login_required
+def export_data():
+    table = request.args.get('table', 'transactions')
+    fmt = request.args.get('format', 'csv')
+    compress = request.args.get('gzip') == '1'
+    try:
+        chunks = export.iter_export(table, fmt, compress)
+    except ValueError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('settings'))
+
+    # Rows are sent as they are read from a server-side cursor; nothing is built up in memory
+    return Response(
+        chunks,
+        mimetype=export.export_mimetype(fmt, compress),
+        headers={'Content-Disposition': f'attachment; filename={export.export_filename(table, fmt, compress)}'}
+    )
+
+@app.cli.command('export-data')
+@click.option('--table', default='transactions', type=click.Choice(list(export.EXPORT_TABLES)), help='Table to export.')
+@click.option('--format', 'fmt', default='ndjson', type=click.Choice(list(export.EXPORT_FORMATS)), help='Output format.')
+@click.option('--gzip', 'compress', is_flag=True, help='Gzip-compress the output.')
+@click.option('--output', type=click.Path(dir_okay=False), help='File to write (default: <table>.<format>[.gz]).')
+def export_data_command(table, fmt, compress, output):
+    """Streams a table of the live database to a newline-delimited JSON or CSV file."""
+    output = output or export.export_filename(table, fmt, compress)
+    written = export.export_to_file(table, output, fmt, compress)
+    print(f"Exported {table} to {output} ({written} bytes).")
 
 @app.route('/settings', methods=['GET', 'POST'])
 @login_required
 def settings():
     if request.method == 'POST':
         monthly_savings_goal = float(request.form.get('monthly_savings_goal'))
-        settings_data = settings_manager.get_settings()
-        settings_data['monthly_savings_goal'] = monthly_savings_goal
-        settings_manager.save_settings(settings_data)
+        # Categories are left out, so only the goal is compared and written
+        settings_manager.save_settings({'monthly_savings_goal': monthly_savings_goal})
         flash('Settings saved successfully!', 'success')
         return redirect(url_for('settings'))
 
@@ -620,12 +795,8 @@ def manage_categories():
                 flash(f'Category "{new_category_name}" already exists!', 'warning')
                 return redirect(url_for('manage_categories'))
 
-            expense_categories.append(new_category_name)
-            category_icons[new_category_name] = new_category_icon if new_category_icon else category_icons.get('_default')
-            
-            current_settings['expense_categories'] = expense_categories
-            current_settings['category_icons'] = category_icons
-            settings_manager.save_settings(current_settings)
+            icon = new_category_icon if new_category_icon else category_icons.get('_default')
+            settings_manager.add_category('expense', new_category_name, icon)
             flash(f'Category "{new_category_name}" added successfully!', 'success')
         else:
             flash('Category name cannot be empty.', 'danger')
@@ -641,18 +812,12 @@ def manage_categories():
 @app.route('/settings/categories/delete/<category_name>')
 @login_required
 def delete_category(category_name):
-    current_settings = settings_manager.get_settings()
-    expense_categories = current_settings.get('expense_categories', [])
-    category_icons = current_settings.get('category_icons', {})
-
-    if category_name in expense_categories:
-        expense_categories.remove(category_name)
-        if category_name in category_icons:
-            del category_icons[category_name]
-        
-        current_settings['expense_categories'] = expense_categories
-        current_settings['category_icons'] = category_icons
-        settings_manager.save_settings(current_settings)
+    try:
+        deleted = settings_manager.delete_category('expense', category_name)
+    except ValueError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('manage_categories'))
+    if deleted:
         flash(f'Category "{category_name}" deleted successfully!', 'success')
     else:
         flash(f'Category "{category_name}" not found.', 'danger')
@@ -681,16 +846,12 @@ def edit_category(old_category_name):
             return redirect(url_for('edit_category', old_category_name=old_category_name))
 
         if old_category_name in expense_categories:
-            idx = expense_categories.index(old_category_name)
-            expense_categories[idx] = new_category_name
-            
-            if old_category_name in category_icons:
-                del category_icons[old_category_name]
-            category_icons[new_category_name] = new_category_icon if new_category_icon else category_icons.get('_default')
-
-            current_settings['expense_categories'] = expense_categories
-            current_settings['category_icons'] = category_icons
-            settings_manager.save_settings(current_settings)
+            icon = new_category_icon if new_category_icon else category_icons.get('_default')
+            try:
+                settings_manager.rename_category('expense', old_category_name, new_category_name, icon)
+            except ValueError as e:
+                flash(str(e), 'danger')
+                return redirect(url_for('manage_categories'))
             flash(f'Category "{old_category_name}" updated to "{new_category_name}" successfully!', 'success')
             return redirect(url_for('manage_categories'))
         else:
@@ -723,12 +884,8 @@ def manage_income_categories():
                 flash(f'Income Category "{new_category_name}" already exists!', 'warning')
                 return redirect(url_for('manage_income_categories'))
 
-            income_categories.append(new_category_name)
-            income_category_icons[new_category_name] = new_category_icon if new_category_icon else income_category_icons.get('_default')
-            
-            current_settings['income_categories'] = income_categories
-            current_settings['income_category_icons'] = income_category_icons
-            settings_manager.save_settings(current_settings)
+            icon = new_category_icon if new_category_icon else income_category_icons.get('_default')
+            settings_manager.add_category('income', new_category_name, icon)
             flash(f'Income Category "{new_category_name}" added successfully!', 'success')
         else:
             flash('Income Category name cannot be empty.', 'danger')
@@ -744,18 +901,12 @@ def manage_income_categories():
 @app.route('/settings/income_categories/delete/<category_name>')
 @login_required
 def delete_income_category(category_name):
-    current_settings = settings_manager.get_settings()
-    income_categories = current_settings.get('income_categories', [])
-    income_category_icons = current_settings.get('income_category_icons', {})
-
-    if category_name in income_categories:
-        income_categories.remove(category_name)
-        if category_name in income_category_icons:
-            del income_category_icons[category_name]
-        
-        current_settings['income_categories'] = income_categories
-        current_settings['income_category_icons'] = income_category_icons
-        settings_manager.save_settings(current_settings)
+    try:
+        deleted = settings_manager.delete_category('income', category_name)
+    except ValueError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('manage_income_categories'))
+    if deleted:
         flash(f'Income Category "{category_name}" deleted successfully!', 'success')
     else:
         flash(f'Income Category "{category_name}" not found.', 'danger')
@@ -784,16 +935,12 @@ def edit_income_category(old_category_name):
             return redirect(url_for('edit_income_category', old_category_name=old_category_name))
 
         if old_category_name in income_categories:
-            idx = income_categories.index(old_category_name)
-            income_categories[idx] = new_category_name
-            
-            if old_category_name in income_category_icons:
-                del income_category_icons[old_category_name]
-            income_category_icons[new_category_name] = new_category_icon if new_category_icon else income_category_icons.get('_default')
-
-            current_settings['income_categories'] = income_categories
-            current_settings['income_category_icons'] = income_category_icons
-            settings_manager.save_settings(current_settings)
+            icon = new_category_icon if new_category_icon else income_category_icons.get('_default')
+            try:
+                settings_manager.rename_category('income', old_category_name, new_category_name, icon)
+            except ValueError as e:
+                flash(str(e), 'danger')
+                return redirect(url_for('manage_income_categories'))
             flash(f'Income Category "{old_category_name}" updated to "{new_category_name}" successfully!', 'success')
             return redirect(url_for('manage_income_categories'))
         else:
@@ -911,13 +1058,7 @@ def disable_2fa():
 @app.route('/delete/<int:transaction_id>')
 @login_required
 def delete(transaction_id):
-    # Before deleting the transaction, if it's a Saving expense,
-    # we need to deduct the amount from the corresponding savings goal.
-    transaction = budget_logic.get_transaction(transaction_id)
-    if transaction and transaction.get('type') == 'expense' and \
-       transaction.get('category') == 'Saving' and transaction.get('savings_goal_id'):
-        savings_goals_logic.update_saved_amount(transaction['savings_goal_id'], -transaction['amount'])
-
+    # delete_transaction also deducts the amount from the linked savings goal, if any
     budget_logic.delete_transaction(transaction_id)
     flash('Transaction deleted successfully.', 'success')
     return redirect(request.referrer or url_for('index'))
@@ -937,9 +1078,6 @@ def edit(transaction_id):
         return redirect(url_for('index'))
 
     if request.method == 'POST':
-        old_amount = transaction.get('amount', 0.0)
-        old_savings_goal_id = transaction.get('savings_goal_id')
-
         updated_data = {
             'transaction_id': transaction_id,
             'date': request.form.get('date'),
@@ -950,29 +1088,26 @@ def edit(transaction_id):
             'description': request.form.get('description', '')
         }
         
-        new_amount = updated_data['amount']
         new_category = updated_data['category']
         new_savings_goal_id_raw = request.form.get('savings_goal_id') # Get raw value
         # Convert to int or None, handling empty string safely
         new_savings_goal_id = int(new_savings_goal_id_raw) if new_savings_goal_id_raw and new_savings_goal_id_raw.isdigit() else None
 
-        # Handle savings goal amount updates
-        # 1. Undo effect of original transaction on its savings goal (if applicable)
-        if transaction.get('type') == 'expense' and transaction.get('category') == 'Goal Savings' and old_savings_goal_id:
-            savings_goals_logic.update_saved_amount(old_savings_goal_id, -old_amount)
-
-        # 2. Apply effect of new transaction on its savings goal (if applicable)
+        # update_transaction moves the amount between savings goals as needed
         if updated_data['type'] == 'expense' and new_category == 'Goal Savings':
             if new_savings_goal_id is None: # Check if a goal was actually selected
                 flash('Please select a savings goal for "Goal Savings" category.', 'danger')
                 return redirect(url_for('edit', transaction_id=transaction_id))
             
-            savings_goals_logic.update_saved_amount(new_savings_goal_id, new_amount)
             updated_data['savings_goal_id'] = new_savings_goal_id # Set the ID in the updated data
         else: # For General Savings or any other non-Goal Saving category, ensure it's None
             updated_data['savings_goal_id'] = None
         
-        budget_logic.update_transaction(transaction_id, updated_data)
+        try:
+            budget_logic.update_transaction(transaction_id, updated_data)
+        except ValueError as e: # Unknown category
+            flash(str(e), 'danger')
+            return redirect(url_for('edit', transaction_id=transaction_id))
         flash('Transaction updated successfully.', 'success')
         return redirect(url_for('transactions'))
         
@@ -0,0 +1,151 @@
+"""
+Before/after EXPLAIN ANALYZE for the hot transaction queries and the indexes added by
+migrate.MIGRATIONS (versions 2, 5, 6 and 11).
+
+Everything runs inside one transaction that is rolled back at the end, so the database is
+left untouched: optional synthetic rows are seeded, the queries are explained with the
+indexes in place ("after"), the indexes are dropped (DROP INDEX is transactional) and the
+same queries are explained again ("before").
+
+    DATABASE_URL=postgres://... python benchmarks/explain_indexes.py --seed 200000 --output bench_output.txt
+
+Recorded results are in explain_indexes_results.txt next to this script.
+"""
+import argparse
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+
+INDEXES = [
+    "DROP INDEX IF EXISTS idx_transactions_date_id;",
+    "DROP INDEX IF EXISTS idx_transactions_expense_category_date;",
+    "DROP INDEX IF EXISTS idx_transactions_goal_savings;",
+    "ALTER TABLE transactions DROP CONSTRAINT IF EXISTS transactions_transaction_id_key;",
+]
+
+QUERIES = [
+    ("latest page", """
+        SELECT id, transaction_id, date, type, category, item, amount, description, savings_goal_id
+        FROM transactions_with_category ORDER BY date DESC, id DESC LIMIT 10;
+    """),
+    ("monthly report window", """
+        SELECT id, transaction_id, date, type, category, item, amount, description, savings_goal_id
+        FROM transactions_with_category
+        WHERE date >= date_trunc('month', CURRENT_DATE) AND date < date_trunc('month', CURRENT_DATE) + interval '1 month'
+        ORDER BY date DESC, id DESC;
+    """),
+    ("category filter", """
+        SELECT SUM(amount) FROM transactions
+        WHERE expense_category_id = (SELECT id FROM expense_categories WHERE name = 'Food')
+          AND date >= CURRENT_DATE - 90;
+    """),
+    ("savings goal recompute", """
+        SELECT savings_goal_id, SUM(amount) FROM transactions
+        WHERE expense_category_id = (SELECT id FROM expense_categories WHERE name = 'Goal Savings')
+          AND savings_goal_id IS NOT NULL
+        GROUP BY savings_goal_id;
+    """),
+    ("one goal's total", """
+        SELECT SUM(amount) FROM transactions
+        WHERE savings_goal_id = (SELECT MAX(id) FROM savings_goals);
+    """),
+    ("transaction_id lookup", """
+        SELECT id FROM transactions WHERE transaction_id = (SELECT transaction_id FROM transactions ORDER BY id DESC LIMIT 1);
+    """),
+]
+
+# Transactions reference their category by id, so the seeded categories are created first.
+# About one row in 19 is a Goal Savings deposit into one of SEED_GOALS seeded goals, so the
+# partial goal-savings index (migration 11) holds a realistic share of the table.
+SEED_GOALS = 20
+SEED_SQL = """
+    INSERT INTO expense_categories (name)
+    SELECT unnest(ARRAY['Food', 'Drink', 'Coffee', 'Transportation', 'Rent', 'Shopping', 'Goal Savings'])
+    ON CONFLICT (name) DO NOTHING;
+    INSERT INTO income_categories (name) VALUES ('Salary') ON CONFLICT (name) DO NOTHING;
+    WITH goals AS (
+        INSERT INTO savings_goals (name, target_amount)
+        SELECT 'benchmark goal ' || g, 5000 FROM generate_series(1, %(goals)s) AS g
+        RETURNING id
+    ), goal_ids AS (
+        SELECT array_agg(id ORDER BY id) AS ids FROM goals
+    )
+    INSERT INTO transactions (transaction_id, type, expense_category_id, income_category_id,
+                              item, amount, date, description, savings_goal_id)
+    SELECT s.transaction_id, s.type, ec.id, ic.id, s.item, s.amount, s.date, s.description,
+           CASE WHEN s.category = 'Goal Savings' THEN goal_ids.ids[1 + (s.g / 170) %% %(goals)s] END
+    FROM goal_ids, (
+        SELECT g, 'bench-' || g AS transaction_id,
+               CASE WHEN g %% 10 = 0 THEN 'income' ELSE 'expense' END AS type,
+               CASE WHEN g %% 10 = 0 THEN 'Salary'
+                    WHEN g %% 17 = 0 THEN 'Goal Savings'
+                    ELSE (ARRAY['Food', 'Drink', 'Coffee', 'Transportation', 'Rent', 'Shopping'])[1 + g %% 6] END AS category,
+               'item ' || (g %% 500) AS item,
+               round((random() * 200)::numeric, 2) AS amount,
+               CURRENT_DATE - (g %% 1825) AS date,
+               'benchmark row' AS description
+        FROM generate_series(1, %(rows)s) AS g
+    ) AS s
+    LEFT JOIN expense_categories ec ON s.type = 'expense' AND ec.name = s.category
+    LEFT JOIN income_categories ic ON s.type = 'income' AND ic.name = s.category;
+"""
+
+def explain(cur, sql):
+    cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + sql)
+    plan = [row[0] for row in cur.fetchall()]
+    execution = next((line for line in plan if line.startswith('Execution Time')), '')
+    match = re.search(r'([\d.]+) ms', execution)
+    return (float(match.group(1)) if match else None), plan
+
+def _ms(value):
+    """Formats an execution time, or 'n/a' when the plan did not report one."""
+    return 'n/a' if value is None else f"{value:.3f}"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--seed', type=int, default=0, help='synthetic rows to add (rolled back afterwards)')
+    parser.add_argument('--output', help='also write the report to this file')
+    parser.add_argument('--plans', action='store_true', help='include full query plans')
+    args = parser.parse_args()
+
+    conn = db.get_db_connection()
+    lines = []
+    try:
+        with conn.cursor() as cur:
+            if args.seed:
+                cur.execute(SEED_SQL, {'rows': args.seed, 'goals': SEED_GOALS})
+            cur.execute("ANALYZE transactions;")
+            cur.execute("SELECT COUNT(*), COUNT(savings_goal_id) FROM transactions;")
+            lines.append("transactions rows: {}, with a savings goal: {}".format(*cur.fetchone()))
+
+            after = {name: explain(cur, sql) for name, sql in QUERIES}
+            for statement in INDEXES:
+                cur.execute(statement)
+            cur.execute("ANALYZE transactions;")
+            before = {name: explain(cur, sql) for name, sql in QUERIES}
+
+            lines.append(f"{'query':<28}{'before (ms)':>14}{'after (ms)':>14}")
+            for name, _ in QUERIES:
+                lines.append(f"{name:<28}{_ms(before[name][0]):>14}{_ms(after[name][0]):>14}")
+            if args.plans:
+                for name, _ in QUERIES:
+                    lines.append(f"\n== {name} (before) ==")
+                    lines.extend(before[name][1])
+                    lines.append(f"== {name} (after) ==")
+                    lines.extend(after[name][1])
+    finally:
+        conn.rollback()
+        db.release_db_connection(conn)
+
+    report = "\n".join(lines)
+    print(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + "\n")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Login throughput under concurrency: password checks inline vs. through the passwords pool.
+
+A batch of check_password_hash calls (what every login costs) is run from `--threads`
+concurrent request threads, first inline on those threads, then through
+passwords.verify_password. While each batch runs, a probe thread does a small piece of
+pure-Python work in a loop (a stand-in for rendering another page) and its latency is
+reported, so the table shows both login throughput and what a login burst does to
+everything else. Checks the pool turns away (passwords.HashingBusy, e.g. more threads than
+PASSWORD_HASH_MAX_PENDING) are counted as rejected, as the app would answer them with a 503.
+No database is needed.
+
+    PASSWORD_HASH_WORKERS=2 python benchmarks/password_hashing.py --logins 64 --threads 1,4,16 --output bench_output.txt
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.security import check_password_hash, generate_password_hash  # noqa: E402
+import passwords  # noqa: E402
+
+PASSWORD = 'correct horse battery staple'
+
+def probe_work():
+    return sum(i * i for i in range(2000))
+
+def run_batch(check, logins, threads):
+    """
+    Runs `logins` checks on `threads` threads. Returns (logins/s, p50 ms, p95 ms, probe p95 ms,
+    rejected); the rate and latencies only count the checks that were not rejected.
+    """
+    stop = threading.Event()
+    probe_samples = []
+
+    def probe():
+        while not stop.is_set():
+            started = time.perf_counter()
+            probe_work()
+            probe_samples.append(time.perf_counter() - started)
+            time.sleep(0.005)
+
+    def login(_):
+        started = time.perf_counter()
+        try:
+            if not check():
+                raise RuntimeError("password check failed")
+        except passwords.HashingBusy:
+            return None
+        return time.perf_counter() - started
+
+    prober = threading.Thread(target=probe, daemon=True)
+    prober.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(executor.map(login, range(logins)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    prober.join()
+
+    latencies = sorted(result for result in results if result is not None)
+
+    def p95(samples):
+        return samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000 if samples else 0.0
+
+    return (
+        len(latencies) / elapsed,
+        statistics.median(latencies) * 1000 if latencies else 0.0,
+        p95(latencies),
+        p95(sorted(probe_samples)),
+        len(results) - len(latencies)
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--logins', type=int, default=32, help='password checks per batch')
+    parser.add_argument('--threads', default='1,4,16', help='comma-separated request thread counts')
+    parser.add_argument('--output', help='also write the report to this file')
+    args = parser.parse_args()
+
+    password_hash = generate_password_hash(PASSWORD, passwords.PASSWORD_HASH_METHOD)
+    modes = [
+        ('inline', lambda: check_password_hash(password_hash, PASSWORD)),
+        ('pool', lambda: passwords.verify_password(password_hash, PASSWORD)),
+    ]
+    passwords.verify_password(password_hash, PASSWORD) # Start the pool outside the timings
+
+    lines = [
+        f"method {passwords.PASSWORD_HASH_METHOD}, pool workers {passwords.PASSWORD_HASH_WORKERS}, "
+        f"max pending {passwords.PASSWORD_HASH_MAX_PENDING}, {os.cpu_count()} CPUs",
+        f"{'mode':<8}{'threads':>8}{'logins/s':>12}{'p50 (ms)':>12}{'p95 (ms)':>12}{'probe p95 (ms)':>16}{'rejected':>10}"
+    ]
+    for threads in [int(value) for value in args.threads.split(',')]:
+        for mode, check in modes:
+            rate, p50, p95, probe_p95, rejected = run_batch(check, args.logins, threads)
+            lines.append(f"{mode:<8}{threads:>8}{rate:>12.1f}{p50:>12.1f}{p95:>12.1f}{probe_p95:>16.2f}{rejected:>10}")
+
+    report = "\n".join(lines)
+    print(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + "\n")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Per-call latency of the hot single-row lookups, plain vs. server-side prepared.
+
+Each lookup registered in queries.py (user_by_id is what load_user runs on every
+authenticated request) is timed on one pooled connection: first as a plain parameterised
+query (parsed and planned by the server on every call), then through queries.execute
+(PREPARE once, EXECUTE afterwards). Ids are taken from the newest row of each table.
+Nothing is written.
+
+    DATABASE_URL=postgres://... python benchmarks/prepared_statements.py --iterations 5000 --output bench_output.txt
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+import queries  # noqa: E402
+# Imported for the statements they register; none of them creates the Flask app
+import users  # noqa: E402,F401  (user_by_id, user_by_username)
+import budget  # noqa: E402,F401  (transaction_by_id)
+import savings_goals  # noqa: E402,F401  (savings_goal_by_id)
+
+# statement name -> query that picks an argument for it
+LOOKUPS = [
+    ('user_by_id', "SELECT id FROM users ORDER BY id DESC LIMIT 1;"),
+    ('user_by_username', "SELECT username FROM users ORDER BY id DESC LIMIT 1;"),
+    ('transaction_by_id', "SELECT id FROM transactions ORDER BY id DESC LIMIT 1;"),
+    ('savings_goal_by_id', "SELECT id FROM savings_goals ORDER BY id DESC LIMIT 1;"),
+]
+
+def time_calls(run, iterations):
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        run()
+        samples.append(time.perf_counter() - started)
+    return statistics.mean(samples) * 1e6, statistics.median(samples) * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=2000, help='calls per lookup and mode')
+    parser.add_argument('--output', help='also write the report to this file')
+    args = parser.parse_args()
+
+    conn = db.get_db_connection()
+    lines = [f"{'lookup':<22}{'plain mean/median (us)':>26}{'prepared mean/median (us)':>28}{'saved':>9}"]
+    try:
+        with conn.cursor() as cur:
+            for name, pick_sql in LOOKUPS:
+                cur.execute(pick_sql)
+                row = cur.fetchone()
+                if row is None:
+                    lines.append(f"{name:<22}  (table is empty, skipped)")
+                    continue
+                params = (row[0],)
+                sql = queries._as_format_sql(queries._statements[name][0], 1)
+                plain_params = {'1': row[0]}
+
+                def plain():
+                    cur.execute(sql, plain_params)
+                    cur.fetchone()
+
+                def prepared():
+                    queries.execute(cur, name, params)
+                    cur.fetchone()
+
+                # Warm up both paths (and PREPARE) before measuring
+                plain()
+                prepared()
+                plain_mean, plain_median = time_calls(plain, args.iterations)
+                prepared_mean, prepared_median = time_calls(prepared, args.iterations)
+                saved = (plain_mean - prepared_mean) / plain_mean * 100 if plain_mean else 0
+                lines.append(f"{name:<22}{plain_mean:>14.1f} / {plain_median:<9.1f}"
+                             f"{prepared_mean:>16.1f} / {prepared_median:<9.1f}{saved:>8.1f}%")
+    finally:
+        conn.rollback()
+        db.release_db_connection(conn)
+
+    report = "\n".join(lines)
+    print(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + "\n")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+Checks that REPORT_ENGINE=numpy produces the same report as the SQL path, and times both.
+
+For each report period, budget.generate_report_data is run with engine='sql' and
+engine='numpy' against the live database. The outputs are compared field by field
+(money to within a thousandth of a cent, since the two paths add in a different order)
+and each engine is timed over several runs. Optional synthetic rows are added inside a
+transaction that is rolled back at the end, so nothing is written. Needs NumPy installed.
+
+    DATABASE_URL=postgres://... python benchmarks/report_engine.py --seed 200000 --runs 5 --output bench_output.txt
+"""
+import argparse
+import math
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+import budget  # noqa: E402
+import report_engine  # noqa: E402
+from explain_indexes import SEED_SQL  # noqa: E402
+
+PERIODS = ['daily', 'weekly', 'monthly', 'yearly', 'last_year_to_date']
+MONEY_TOLERANCE = 1e-5
+
+def money_equal(a, b):
+    return math.isclose(a, b, rel_tol=1e-12, abs_tol=MONEY_TOLERANCE)
+
+def compare(sql_report, numpy_report):
+    """Returns a list of differences between two generate_report_data results."""
+    problems = []
+    if sql_report.keys() != numpy_report.keys():
+        problems.append(f"keys differ: {sorted(sql_report.keys() ^ numpy_report.keys())}")
+    for key in ('period', 'start_date', 'end_date'):
+        if sql_report[key] != numpy_report[key]:
+            problems.append(f"{key}: {sql_report[key]!r} != {numpy_report[key]!r}")
+    for key in ('total_income', 'total_expense', 'total_savings', 'total_goal_savings', 'total_general_savings', 'balance'):
+        if not money_equal(sql_report[key], numpy_report[key]):
+            problems.append(f"{key}: {sql_report[key]!r} != {numpy_report[key]!r}")
+    if [t.id for t in sql_report['transactions']] != [t.id for t in numpy_report['transactions']]:
+        problems.append("transactions differ")
+
+    sql_items, numpy_items = sql_report['income_breakdown_by_item'], numpy_report['income_breakdown_by_item']
+    if sql_items.keys() != numpy_items.keys():
+        problems.append("income_breakdown_by_item items differ")
+    else:
+        problems.extend(f"income_breakdown_by_item[{item!r}]: {sql_items[item]!r} != {numpy_items[item]!r}"
+                        for item in sql_items if not money_equal(sql_items[item], numpy_items[item]))
+
+    sql_slices, numpy_slices = sql_report['expense_breakdown_by_category'], numpy_report['expense_breakdown_by_category']
+    if sorted(s['category'] for s in sql_slices) != sorted(s['category'] for s in numpy_slices):
+        problems.append("expense_breakdown_by_category categories differ")
+    else:
+        numpy_amounts = {s['category']: s['amount'] for s in numpy_slices}
+        problems.extend(f"expense_breakdown_by_category[{s['category']!r}]: {s['amount']!r} != {numpy_amounts[s['category']]!r}"
+                        for s in sql_slices if not money_equal(s['amount'], numpy_amounts[s['category']]))
+
+    sql_months, numpy_months = sql_report['monthly_summaries'], numpy_report['monthly_summaries']
+    if [m['month'] for m in sql_months] != [m['month'] for m in numpy_months]:
+        problems.append("monthly_summaries months differ")
+    else:
+        for sql_month, numpy_month in zip(sql_months, numpy_months):
+            problems.extend(f"monthly_summaries[{sql_month['month']}].{key}: {sql_month[key]!r} != {numpy_month[key]!r}"
+                            for key in ('total_income', 'total_expense', 'total_savings', 'balance')
+                            if not money_equal(sql_month[key], numpy_month[key]))
+    return problems
+
+def time_report(period, engine, runs):
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        budget.generate_report_data(period, engine=engine, use_cache=False)
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--seed', type=int, default=0, help='synthetic rows to add (rolled back afterwards)')
+    parser.add_argument('--runs', type=int, default=5, help='timed runs per period and engine (median is reported)')
+    parser.add_argument('--output', help='also write the report to this file')
+    args = parser.parse_args()
+    if not report_engine.available():
+        sys.exit("NumPy is not installed; nothing to compare.")
+
+    # Every budget call below checks out this same connection, so seeded rows stay visible until the rollback
+    conn = db.get_db_connection()
+    original_get, original_release = db.get_db_connection, db.release_db_connection
+    db.get_db_connection = lambda request_scoped=True: conn
+    db.release_db_connection = lambda c: None
+    lines = []
+    failed = False
+    try:
+        with conn.cursor() as cur:
+            if args.seed:
+                cur.execute(SEED_SQL, (args.seed,))
+            cur.execute("SELECT COUNT(*) FROM transactions;")
+            lines.append(f"transactions rows: {cur.fetchone()[0]}")
+        lines.append(f"{'period':<20}{'rows':>9}{'sql (ms)':>11}{'numpy (ms)':>12}  result")
+        for period in PERIODS:
+            sql_report = budget.generate_report_data(period, engine='sql', use_cache=False)
+            numpy_report = budget.generate_report_data(period, engine='numpy', use_cache=False)
+            problems = compare(sql_report, numpy_report)
+            failed = failed or bool(problems)
+            lines.append(f"{period:<20}{len(sql_report['transactions']):>9}"
+                         f"{time_report(period, 'sql', args.runs):>11.1f}{time_report(period, 'numpy', args.runs):>12.1f}"
+                         f"  {'equal' if not problems else 'DIFFERENT'}")
+            lines.extend(f"    {problem}" for problem in problems)
+    finally:
+        db.get_db_connection, db.release_db_connection = original_get, original_release
+        conn.rollback()
+        db.release_db_connection(conn)
+
+    report = "\n".join(lines)
+    print(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + "\n")
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Memory and build time of 100k transaction rows: the old per-row dict vs budget.Transaction.
+
+Rows are synthesised in the shape psycopg2 returns for TRANSACTION_COLUMNS (int id, text
+transaction_id, date, Decimal amount, int or None savings_goal_id), so no database is
+needed. Each representation is built from the same raw rows under tracemalloc; the
+report is the time to build the list, the memory it holds, and the time to render every
+row's date and amount the way the transaction templates do.
+
+    python benchmarks/transaction_rows.py --rows 100000 --output bench_output.txt
+"""
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+import uuid
+from datetime import date, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from budget import Transaction  # noqa: E402
+
+
+def legacy_row_to_dict(row):
+    """The per-row conversion budget._row_to_transaction did before Transaction existed."""
+    return {
+        'id': str(row[0]),
+        'transaction_id': str(row[1]),
+        'date': str(row[2]),
+        'type': row[3],
+        'category': row[4],
+        'item': row[5],
+        'amount': float(row[6]),
+        'description': row[7],
+        'savings_goal_id': str(row[8]) if row[8] else ''
+    }
+
+def make_rows(count):
+    categories = ['Food', 'Drink', 'Coffee', 'Transportation', 'Rent', 'Shopping', 'Goal Savings']
+    today = date.today()
+    return [
+        (
+            i,
+            str(uuid.uuid4()),
+            today - timedelta(days=i % 1825),
+            'income' if i % 10 == 0 else 'expense',
+            'Salary' if i % 10 == 0 else categories[i % len(categories)],
+            f"item {i % 500}",
+            Decimal(f"{(i * 37) % 20000 / 100:.2f}"),
+            'benchmark row',
+            (i % 5) + 1 if i % 7 == 0 else None,
+        )
+        for i in range(1, count + 1)
+    ]
+
+def measure(rows, build, render):
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    built = [build(row) for row in rows]
+    build_seconds = time.perf_counter() - started
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    started = time.perf_counter()
+    for item in built:
+        render(item)
+    render_seconds = time.perf_counter() - started
+    return build_seconds, memory, render_seconds
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000, help='rows to build')
+    parser.add_argument('--output', help='also write the report to this file')
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    results = {
+        'dict (old)': measure(rows, legacy_row_to_dict, lambda t: (t['date'], "%.2f" % t['amount'])),
+        'Transaction': measure(rows, lambda row: Transaction(*row), lambda t: (str(t.date), "%.2f" % t.amount)),
+    }
+
+    lines = [f"rows: {args.rows}",
+             f"{'representation':<16}{'build (ms)':>12}{'memory (MiB)':>14}{'bytes/row':>11}{'render (ms)':>13}"]
+    for name, (build_seconds, memory, render_seconds) in results.items():
+        lines.append(f"{name:<16}{build_seconds * 1000:>12.1f}{memory / 2**20:>14.1f}"
+                     f"{memory / args.rows:>11.0f}{render_seconds * 1000:>13.1f}")
+    report = "\n".join(lines)
+    print(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + "\n")
+
+if __name__ == '__main__':
+    main()
@@ -1,93 +1,341 @@
 from datetime import datetime, timedelta
 import db # Import the db module for database interaction
 import uuid # Import uuid for generating unique transaction IDs
+import os
+import search
+import queries
+import report_engine
+import report_cache
+import cache
 
+# Column order shared by every query that feeds _row_to_transaction. transactions stores
+# expense_category_id / income_category_id; these are read from the transactions_with_category
+# view, which adds the category name back.
+TRANSACTION_COLUMNS = "id, transaction_id, date, type, category, item, amount, description, savings_goal_id"
+TRANSACTION_FIELDS = tuple(column.strip() for column in TRANSACTION_COLUMNS.split(','))
 
+# A transactions row's category name, for statements that cannot go through the view (RETURNING, FOR UPDATE)
+CATEGORY_NAME_SQL = (
+    "COALESCE((SELECT name FROM expense_categories WHERE id = expense_category_id),"
+    " (SELECT name FROM income_categories WHERE id = income_category_id))"
+)
 
+queries.register('transaction_by_id', f"SELECT {TRANSACTION_COLUMNS} FROM transactions_with_category WHERE id = $1")
+queries.register('expense_category_id', "SELECT id FROM expense_categories WHERE name = $1")
+queries.register('income_category_id', "SELECT id FROM income_categories WHERE name = $1")
+queries.register('ledger_version', "SELECT version FROM ledger_version", arg_count=0)
+# Also says whether this transaction has written anything yet (no xid assigned = nothing written)
+queries.register(
+    'ledger_version_if_clean',
+    "SELECT version, txid_current_if_assigned() IS NULL FROM ledger_version",
+    arg_count=0
+)
+
+SAVINGS_CATEGORIES = ('Goal Savings', 'General Savings')
+
+# Periods long enough that their totals are read from the monthly_rollups table
+ROLLUP_PERIODS = ('yearly', 'last_year_to_date')
+
+# Offsets from this point on are served by keyset paging when the caller has a cursor
+KEYSET_MIN_OFFSET = 1000
+# Transaction row counts for the page links, by ledger version (see _count_transactions)
+_transaction_counts = cache.TTLCache(maxsize=8, ttl=3600)
+
+# Expense categories shown individually in a report's breakdown; the rest are summed into "Other"
+EXPENSE_BREAKDOWN_TOP_N = 10
+
+# How report totals are computed: 'sql' (aggregate queries) or 'numpy' (report_engine, optional dependency)
+REPORT_ENGINE = os.environ.get('REPORT_ENGINE', 'sql')
+
+
+def _apply_goal_savings(cur, type, category, savings_goal_id, amount):
+    """Adds `amount` to the linked goal's saved_amount when the transaction counts towards a savings goal."""
+    if type == 'expense' and category == 'Goal Savings' and savings_goal_id:
+        cur.execute(
+            "UPDATE savings_goals SET saved_amount = saved_amount + %s WHERE id = %s;",
+            (amount, savings_goal_id)
+        )
+
+def _category_ids(cur, type, category):
+    """
+    Resolves a category name for a transaction of `type` into its
+    (expense_category_id, income_category_id) pair. Raises ValueError for an unknown category.
+    """
+    if type not in ('expense', 'income'):
+        raise ValueError(f"Unknown transaction type '{type}'.")
+    queries.execute(cur, f'{type}_category_id', (category,))
+    row = cur.fetchone()
+    if row is None:
+        raise ValueError(f"Unknown {type} category '{category}'.")
+    return (row[0], None) if type == 'expense' else (None, row[0])
 
 def add_transaction(type, category, item, amount, date, description, savings_goal_id=None):
-    """Adds a single transaction to the database."""
+    """Adds a single transaction to the database. Raises ValueError for an unknown category."""
     conn = db.get_db_connection()
     try:
         with conn.cursor() as cur:
+            expense_category_id, income_category_id = _category_ids(cur, type, category)
             # Generate a unique transaction_id using UUID
             transaction_id = str(uuid.uuid4())
             cur.execute(
                 """
-                INSERT INTO transactions (transaction_id, type, category, item, amount, date, description, savings_goal_id)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s);
+                INSERT INTO transactions (transaction_id, type, expense_category_id, income_category_id, item, amount, date, description, savings_goal_id)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s);
                 """,
-                (transaction_id, type, category, item, amount, date, description, savings_goal_id if savings_goal_id else None)
+                (transaction_id, type, expense_category_id, income_category_id, item, amount, date, description,
+                 savings_goal_id if savings_goal_id else None)
             )
-            conn.commit()
+            # Keep the goal's saved_amount in step within the same database transaction
+            _apply_goal_savings(cur, type, category, savings_goal_id, amount)
+            db.commit(conn)
     finally:
         db.release_db_connection(conn)
+class Transaction:
+    """
+    One transactions row, kept in the types the database returns: int id, datetime.date
+    date, Decimal amount and int (or None) savings_goal_id.
+
+    Attribute access (t.date, t.amount in templates) gives those native values, which
+    render as before in Jinja: a date prints as YYYY-MM-DD and "%.2f"|format takes a Decimal.
+    Item access (t['amount'], t.get('id')) gives the values of the old per-row dict,
+    converted on demand: string id/transaction_id/date, float amount and '' for no goal.
+    """
+    __slots__ = TRANSACTION_FIELDS
+
+    def __init__(self, id, transaction_id, date, type, category, item, amount, description, savings_goal_id):
+        self.id = id
+        self.transaction_id = transaction_id
+        self.date = date
+        self.type = type
+        self.category = category
+        self.item = item
+        self.amount = amount
+        self.description = description
+        self.savings_goal_id = savings_goal_id
+
+    def __getitem__(self, key):
+        if key not in TRANSACTION_FIELDS:
+            raise KeyError(key)
+        value = getattr(self, key)
+        if key in ('id', 'transaction_id', 'date'):
+            return str(value)
+        if key == 'amount':
+            return float(value)
+        if key == 'savings_goal_id':
+            return str(value) if value else ''
+        return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return TRANSACTION_FIELDS
+
+    def to_dict(self):
+        """The old dict shape (see __getitem__), e.g. for JSON responses."""
+        return {key: self[key] for key in TRANSACTION_FIELDS}
+
+    def __repr__(self):
+        return f"Transaction(id={self.id!r}, date={self.date!r}, type={self.type!r}, category={self.category!r}, amount={self.amount!r})"
+
+def _row_to_transaction(row):
+    """Wraps a transactions row (selected as TRANSACTION_COLUMNS) in a Transaction."""
+    return Transaction(*row)
+
 def get_transactions(sort_by_date=True):
     """Reads all transactions from the database."""
     transactions = []
     conn = db.get_db_connection()
     try:
         with conn.cursor() as cur:
-            cur.execute("SELECT id, transaction_id, date, type, category, item, amount, description, savings_goal_id FROM transactions ORDER BY date DESC;")
-            # Convert rows to a list of dictionaries for consistency with original CSV output
-            # Also convert Decimal to float for JSON serialization later
+            cur.execute(f"SELECT {TRANSACTION_COLUMNS} FROM transactions_with_category ORDER BY date DESC;")
             for row in cur.fetchall():
-                transaction_dict = {
-                    'id': str(row[0]), # The new auto-generated ID
-                    'transaction_id': str(row[1]), # The UUID
-                    'date': str(row[2]),
-                    'type': row[3],
-                    'category': row[4],
-                    'item': row[5],
-                    'amount': float(row[6]), # Convert Decimal to float
-                    'description': row[7],
-                    'savings_goal_id': str(row[8]) if row[8] else '' # Ensure ID is string
-                }
-                transactions.append(transaction_dict)
+                transactions.append(_row_to_transaction(row))
     finally:
         db.release_db_connection(conn)
     return transactions
 
-def get_transaction(transaction_id): # Renaming parameter to 'id' would be clearer but keeping original for minimal change
-    """Retrieves a single transaction by its ID from the database."""
+def _count_transactions(cur):
+    """
+    The number of transactions. COUNT(*) reads the whole table, so the result is kept per
+    ledger version and only counted again after a write.
+    """
+    # Read before counting: a count may end up keyed older than its data, never newer
+    ledger_version = _cacheable_ledger_version()
+    if ledger_version is not None:
+        total = _transaction_counts.get(ledger_version)
+        if total is not cache.MISSING:
+            return total
+    cur.execute("SELECT COUNT(*) FROM transactions;")
+    total = cur.fetchone()[0]
+    if ledger_version is not None:
+        _transaction_counts.set(ledger_version, total)
+    return total
+
+def get_transactions_page(page=1, per_page=10, after=None, before=None):
+    """
+    Reads one page of transactions (newest first) plus the total row count.
+    Shallow pages use LIMIT/OFFSET. Once the offset reaches KEYSET_MIN_OFFSET, a
+    (date, id) cursor taken from the neighbouring page (`after` = last row of the
+    previous page, `before` = first row of the next page) switches to keyset paging
+    on idx_transactions_date_id, so deep pages cost the same as the first one.
+    The total is only counted once per ledger version (_count_transactions).
+    Deep pages without a cursor that sit closer to the oldest end are read from that end.
+    Returns (transactions, total_transactions).
+    """
+    offset = (page - 1) * per_page
+    use_keyset = offset >= KEYSET_MIN_OFFSET
+    conn = db.get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            total_transactions = _count_transactions(cur)
+
+            if use_keyset and after:
+                cur.execute(
+                    f"""
+                    SELECT {TRANSACTION_COLUMNS} FROM transactions_with_category
+                    WHERE (date, id) < (%s, %s)
+                    ORDER BY date DESC, id DESC
+                    LIMIT %s;
+                    """,
+                    (after[0], after[1], per_page)
+                )
+                rows = cur.fetchall()
+            elif use_keyset and before:
+                # Walk backwards from the cursor, then restore newest-first order
+                cur.execute(
+                    f"""
+                    SELECT {TRANSACTION_COLUMNS} FROM transactions_with_category
+                    WHERE (date, id) > (%s, %s)
+                    ORDER BY date ASC, id ASC
+                    LIMIT %s;
+                    """,
+                    (before[0], before[1], per_page)
+                )
+                rows = cur.fetchall()[::-1]
+            else:
+                remaining = total_transactions - offset
+                if use_keyset and 0 < remaining < offset:
+                    # No cursor (e.g. a jump to one of the last pages): offset from the oldest end instead
+                    limit = min(per_page, remaining)
+                    cur.execute(
+                        f"""
+                        SELECT {TRANSACTION_COLUMNS} FROM transactions_with_category
+                        ORDER BY date ASC, id ASC
+                        LIMIT %s OFFSET %s;
+                        """,
+                        (limit, remaining - limit)
+                    )
+                    rows = cur.fetchall()[::-1]
+                else:
+                    cur.execute(
+                        f"""
+                        SELECT {TRANSACTION_COLUMNS} FROM transactions_with_category
+                        ORDER BY date DESC, id DESC
+                        LIMIT %s OFFSET %s;
+                        """,
+                        (per_page, offset)
+                    )
+                    rows = cur.fetchall()
+    finally:
+        db.release_db_connection(conn)
+    return [_row_to_transaction(row) for row in rows], total_transactions
+
+def search_transactions(search_query, page=1, per_page=10, start_date=None, end_date=None):
+    """
+    Runs a search (see search.py for the syntax) in the database, optionally limited to the
+    half-open date range [start_date, end_date). Results are ranked by text relevance, then newest first.
+    Returns (transactions for the page, total matches, total expense amount across all matches).
+    """
+    where_sql, where_params, rank_sql, rank_params = search.build_search_filter(search_query)
+    if start_date is not None and end_date is not None:
+        where_sql = f"{where_sql} AND date >= %s AND date < %s"
+        where_params = where_params + [start_date, end_date]
+
     conn = db.get_db_connection()
     try:
         with conn.cursor() as cur:
             cur.execute(
-                "SELECT id, transaction_id, date, type, category, item, amount, description, savings_goal_id FROM transactions WHERE id = %s;",
-                (transaction_id,) # Assuming transaction_id parameter is actually the new 'id'
+                f"""
+                SELECT COUNT(*), COALESCE(SUM(amount) FILTER (WHERE type = 'expense'), 0)
+                FROM transactions
+                WHERE {where_sql};
+                """,
+                where_params
             )
-            row = cur.fetchone()
-            if row:
-                transaction_dict = {
-                    'id': str(row[0]),
-                    'transaction_id': str(row[1]),
-                    'date': str(row[2]),
-                    'type': row[3],
-                    'category': row[4],
-                    'item': row[5],
-                    'amount': float(row[6]),
-                    'description': row[7],
-                    'savings_goal_id': str(row[8]) if row[8] else ''
-                }
-                return transaction_dict
+            total_matches, total_expense = cur.fetchone()
+
+            cur.execute(
+                f"""
+                SELECT {TRANSACTION_COLUMNS} FROM transactions_with_category
+                WHERE {where_sql}
+                ORDER BY {rank_sql} DESC, date DESC, id DESC
+                LIMIT %s OFFSET %s;
+                """,
+                where_params + rank_params + [per_page, (page - 1) * per_page]
+            )
+            rows = cur.fetchall()
     finally:
         db.release_db_connection(conn)
+    return [_row_to_transaction(row) for row in rows], total_matches, float(total_expense)
+
+def get_ledger_version():
+    """
+    Returns the ledger change counter: it goes up (on commit) with every write to transactions,
+    savings goals, categories or settings, so anything derived from them can be keyed on it.
+    """
+    row = queries.fetch_one('ledger_version')
+    return row[0] if row else 0
+
+def get_transaction(transaction_id): # Renaming parameter to 'id' would be clearer but keeping original for minimal change
+    """Retrieves a single transaction by its ID from the database."""
+    row = queries.fetch_one('transaction_by_id', transaction_id) # Assuming transaction_id parameter is actually the new 'id'
+    if row:
+        return _row_to_transaction(row)
     return None
 def delete_transaction(transaction_id): # Renaming parameter to 'id' would be clearer but keeping original for minimal change
     """Deletes a transaction by its ID from the database."""
     conn = db.get_db_connection()
     try:
         with conn.cursor() as cur:
-            cur.execute("DELETE FROM transactions WHERE id = %s;", (transaction_id,))
-            conn.commit()
+            cur.execute(
+                f"DELETE FROM transactions WHERE id = %s RETURNING type, {CATEGORY_NAME_SQL}, amount, savings_goal_id;",
+                (transaction_id,)
+            )
+            row = cur.fetchone()
+            if row:
+                old_type, old_category, old_amount, old_goal_id = row
+                _apply_goal_savings(cur, old_type, old_category, old_goal_id, -old_amount)
+            db.commit(conn)
     finally:
         db.release_db_connection(conn)
 def update_transaction(transaction_id, data): # Renaming parameter to 'id' would be clearer but keeping original for minimal change
-    """Updates a transaction by its ID in the database."""
+    """
+    Updates a transaction by its ID in the database.
+    A 'category' in `data` is given by name. Raises ValueError for an unknown category.
+    """
     conn = db.get_db_connection()
     try:
         with conn.cursor() as cur:
+            # Lock the row and remember what it contributed to its savings goal before the update
+            cur.execute(
+                f"SELECT type, {CATEGORY_NAME_SQL}, amount, savings_goal_id FROM transactions WHERE id = %s FOR UPDATE;",
+                (transaction_id,)
+            )
+            old_row = cur.fetchone()
+            if not old_row:
+                return
+
+            data = dict(data)
+            if 'category' in data or 'type' in data:
+                # Stored as the id from the category table that matches the (possibly new) type
+                new_type = data.get('type', old_row[0])
+                new_category = data.pop('category', old_row[1])
+                data['expense_category_id'], data['income_category_id'] = _category_ids(cur, new_type, new_category)
+
             # Construct the SET part of the SQL query dynamically
             set_clauses = []
             values = []
@@ -102,17 +350,31 @@ def update_transaction(transaction_id, data): # Renaming parameter to 'id' would
                 f"""
                 UPDATE transactions
                 SET {', '.join(set_clauses)}
-                WHERE id = %s;
+                WHERE id = %s
+                RETURNING type, {CATEGORY_NAME_SQL}, amount, savings_goal_id;
                 """,
                 tuple(values)
             )
-            conn.commit()
+            new_row = cur.fetchone()
+
+            # Move the contribution from the old goal (if any) to the new one (if any)
+            old_type, old_category, old_amount, old_goal_id = old_row
+            _apply_goal_savings(cur, old_type, old_category, old_goal_id, -old_amount)
+            new_type, new_category, new_amount, new_goal_id = new_row
+            _apply_goal_savings(cur, new_type, new_category, new_goal_id, new_amount)
+            db.commit(conn)
     finally:
         db.release_db_connection(conn)
-def generate_report_data(period=None, start_date_str=None, end_date_str=None):
-    """Generates budget report data for a given period or custom date range."""
-    transactions = get_transactions(sort_by_date=False)
+
+def _month_start(value, months_ahead=0):
+    """Returns the first day of the month `months_ahead` months after `value`'s month."""
+    month_index = value.year * 12 + value.month - 1 + months_ahead
+    return value.replace(year=month_index // 12, month=month_index % 12 + 1, day=1)
+
+def resolve_report_range(period=None, start_date_str=None, end_date_str=None):
+    """Resolves a report period (or custom date strings) into (period, start_date, end_date) datetimes."""
     today = datetime.now()
+    start_date = end_date = None
 
     if start_date_str and end_date_str:
         try:
@@ -122,7 +384,7 @@ def generate_report_data(period=None, start_date_str=None, end_date_str=None):
             # period is already correctly set by app.py, so no need to overwrite to "custom" here
         except ValueError:
             period = 'monthly'
-    
+
     if period == 'daily':
         start_date = today.replace(hour=0, minute=0, second=0, microsecond=0)
         end_date = start_date + timedelta(days=1)
@@ -132,83 +394,291 @@ def generate_report_data(period=None, start_date_str=None, end_date_str=None):
         end_date = start_date + timedelta(weeks=1)
     elif period == 'monthly':
         start_date = today.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        if today.month == 12:
-            end_date = start_date.replace(year=today.year + 1, month=1)
-        else:
-            end_date = start_date.replace(month=today.month + 1)
+        end_date = _month_start(start_date, 1)
     elif period == 'yearly':
         start_date = today.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
         end_date = start_date.replace(year=today.year + 1)
-    elif period == 'last_year_to_date': # Added this line for last_year_to_date
-        last_year = today.year - 1
-        start_date = datetime(last_year, 1, 1, 0, 0, 0, 0)
+    elif period == 'last_year_to_date':
+        start_date = datetime(today.year - 1, 1, 1, 0, 0, 0, 0)
         end_date = today.replace(hour=23, minute=59, second=59, microsecond=999999)
-    elif not (start_date_str and end_date_str):
-        period = 'monthly'
-        start_date = today.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        if today.month == 12:
-            end_date = start_date.replace(year=today.year + 1, month=1)
-        else:
-            end_date = start_date.replace(month=today.month + 1)
-    
-    if 'start_date' not in locals() or 'end_date' not in locals():
+
+    if start_date is None or end_date is None:
         # Default to monthly if no period and no custom dates or if custom dates were invalid
         period = 'monthly'
         start_date = today.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        if today.month == 12:
-            end_date = start_date.replace(year=today.year + 1, month=1)
-        else:
-            end_date = start_date.replace(month=today.month + 1)
+        end_date = _month_start(start_date, 1)
 
+    return period, start_date, end_date
 
-    filtered_transactions = [
-        t for t in transactions 
-        if 'date' in t and t['date'] and start_date <= datetime.strptime(t['date'], '%Y-%m-%d') < end_date
-    ]
-    
-    filtered_transactions.sort(key=lambda x: datetime.strptime(x['date'], '%Y-%m-%d'), reverse=True)
+def _date_bounds(start_date, end_date):
+    """Converts a report's datetime range into a half-open [start, end) pair of dates for SQL."""
+    range_end = end_date.date()
+    if end_date.time() != datetime.min.time():
+        # Custom and year-to-date ranges end at 23:59:59 on their last day, which is still included
+        range_end += timedelta(days=1)
+    return start_date.date(), range_end
 
-    total_income = sum(t['amount'] for t in filtered_transactions if t['type'] == 'income')
-    total_expense = sum(t['amount'] for t in filtered_transactions if t['type'] == 'expense')
-    total_goal_savings = sum(t['amount'] for t in filtered_transactions if t['type'] == 'expense' and t['category'] == 'Goal Savings')
-    total_general_savings = sum(t['amount'] for t in filtered_transactions if t['type'] == 'expense' and t['category'] == 'General Savings')
-    total_savings = total_goal_savings + total_general_savings
-    balance = total_income - total_expense
+def resolve_report_bounds(period=None, start_date_str=None, end_date_str=None):
+    """Resolves a report period into the half-open [start, end) date range its transactions are read from."""
+    _, start_date, end_date = resolve_report_range(period, start_date_str, end_date_str)
+    return _date_bounds(start_date, end_date)
+
+def _whole_months(range_start, range_end):
+    """The [start, end) span of whole calendar months inside a date range (empty, at range_start, if there are none)."""
+    full_start = range_start if range_start.day == 1 else _month_start(range_start, 1)
+    full_end = range_end.replace(day=1)
+    if full_start >= full_end:
+        # No whole month in range: aggregate everything from transactions
+        full_start = full_end = range_start
+    return full_start, full_end
 
+def _expense_totals_by_category(cur, range_start, range_end):
+    """Expense total per category for [range_start, range_end), from monthly_rollups plus the partial edge months."""
+    full_start, full_end = _whole_months(range_start, range_end)
+    cur.execute(
+        """
+        SELECT ec.name, SUM(categories.total)
+        FROM (
+            SELECT category_id, SUM(total_amount) AS total
+            FROM monthly_rollups
+            WHERE type = 'expense' AND month >= %s AND month < %s
+            GROUP BY category_id
+            UNION ALL
+            SELECT expense_category_id, SUM(amount)
+            FROM transactions
+            WHERE type = 'expense' AND ((date >= %s AND date < %s) OR (date >= %s AND date < %s))
+            GROUP BY expense_category_id
+        ) AS categories
+        JOIN expense_categories ec ON ec.id = categories.category_id
+        GROUP BY ec.name;
+        """,
+        (full_start, full_end, range_start, full_start, full_end, range_end)
+    )
+    return {category: float(total) for category, total in cur.fetchall()}
+
+def expense_breakdown(expense_by_category, top_n=EXPENSE_BREAKDOWN_TOP_N):
+    """
+    Turns {category: total} into a list of {'category', 'amount'} sorted by amount (largest first),
+    keeping the top_n categories and summing the rest into "Other" (merged with a real "Other" category in the top_n).
+    """
+    ranked = sorted(expense_by_category.items(), key=lambda entry: (-entry[1], entry[0]))
+    breakdown = [{'category': category, 'amount': amount} for category, amount in ranked[:top_n]]
+    rest = sum(amount for _, amount in ranked[top_n:])
+    if rest:
+        other = next((entry for entry in breakdown if entry['category'] == 'Other'), None)
+        if other:
+            other['amount'] += rest
+            breakdown.sort(key=lambda entry: (-entry['amount'], entry['category']))
+        else:
+            breakdown.append({'category': 'Other', 'amount': rest})
+    return breakdown
+
+def _monthly_totals(cur, range_start, range_end):
+    """
+    Per-month income, expense and savings totals for [range_start, range_end), keyed by month start.
+    Whole months are read from monthly_rollups; partial months at either edge are aggregated from
+    transactions, so a two-year range costs at most 24 pre-aggregated rows plus the edge days.
+    """
+    full_start, full_end = _whole_months(range_start, range_end)
+    cur.execute(
+        """
+        WITH ids AS (
+            SELECT (SELECT id FROM expense_categories WHERE name = 'Goal Savings') AS goal_savings,
+                   (SELECT id FROM expense_categories WHERE name = 'General Savings') AS general_savings
+        )
+        SELECT month, SUM(income), SUM(expense), SUM(goal_savings), SUM(general_savings)
+        FROM (
+            SELECT month,
+                   SUM(total_amount) FILTER (WHERE type = 'income') AS income,
+                   SUM(total_amount) FILTER (WHERE type = 'expense') AS expense,
+                   SUM(total_amount) FILTER (WHERE type = 'expense' AND category_id = ids.goal_savings) AS goal_savings,
+                   SUM(total_amount) FILTER (WHERE type = 'expense' AND category_id = ids.general_savings) AS general_savings
+            FROM monthly_rollups, ids
+            WHERE month >= %s AND month < %s
+            GROUP BY month
+            UNION ALL
+            SELECT date_trunc('month', date)::date AS month,
+                   SUM(amount) FILTER (WHERE type = 'income'),
+                   SUM(amount) FILTER (WHERE type = 'expense'),
+                   SUM(amount) FILTER (WHERE expense_category_id = ids.goal_savings),
+                   SUM(amount) FILTER (WHERE expense_category_id = ids.general_savings)
+            FROM transactions, ids
+            WHERE (date >= %s AND date < %s) OR (date >= %s AND date < %s)
+            GROUP BY 1
+        ) AS months
+        GROUP BY month;
+        """,
+        (full_start, full_end, range_start, full_start, full_end, range_end)
+    )
+    month_totals = {}
+    for month, income, expense, goal_savings, general_savings in cur.fetchall():
+        month_totals[month] = {
+            'income': float(income or 0),
+            'expense': float(expense or 0),
+            'goal_savings': float(goal_savings or 0),
+            'general_savings': float(general_savings or 0)
+        }
+    return month_totals
+
+def _summarize_in_database(cur, period, start_date, end_date, range_start, range_end):
+    """Report totals, income breakdown and monthly summaries computed by aggregate queries (see report_engine.summarize)."""
+    total_income = 0
+    total_expense = 0
+    total_goal_savings = 0
+    total_general_savings = 0
     income_breakdown_by_item = {}
-    for t in filtered_transactions:
-        if t['type'] == 'income':
-            item = t.get('item', 'Other')
-            income_breakdown_by_item[item] = income_breakdown_by_item.get(item, 0) + t['amount']
+    expense_by_category = {}
+    month_totals = {}
+
+    if period in ROLLUP_PERIODS:
+        # Long periods: totals come from the monthly rollups, only income items need raw rows
+        month_totals = _monthly_totals(cur, range_start, range_end)
+        for totals in month_totals.values():
+            total_income += totals['income']
+            total_expense += totals['expense']
+            total_goal_savings += totals['goal_savings']
+            total_general_savings += totals['general_savings']
+
+        cur.execute(
+            """
+            SELECT item, SUM(amount) FROM transactions
+            WHERE type = 'income' AND date >= %s AND date < %s
+            GROUP BY item
+            ORDER BY MAX(date) DESC;
+            """,
+            (range_start, range_end)
+        )
+        for item, amount in cur.fetchall():
+            income_breakdown_by_item[item] = float(amount)
+        expense_by_category = _expense_totals_by_category(cur, range_start, range_end)
+    else:
+        # One grouped pass; items are only kept apart for income rows
+        cur.execute(
+            """
+            SELECT t.type, COALESCE(ec.name, ic.name), t.income_item, t.amount
+            FROM (
+                SELECT type, expense_category_id, income_category_id,
+                       CASE WHEN type = 'income' THEN item END AS income_item,
+                       SUM(amount) AS amount, MAX(date) AS last_date
+                FROM transactions
+                WHERE date >= %s AND date < %s
+                GROUP BY 1, 2, 3, 4
+            ) AS t
+            LEFT JOIN expense_categories ec ON ec.id = t.expense_category_id
+            LEFT JOIN income_categories ic ON ic.id = t.income_category_id
+            ORDER BY t.last_date DESC;
+            """,
+            (range_start, range_end)
+        )
+        for type, category, income_item, amount in cur.fetchall():
+            amount = float(amount)
+            if type == 'income':
+                total_income += amount
+                income_breakdown_by_item[income_item] = income_breakdown_by_item.get(income_item, 0) + amount
+            elif type == 'expense':
+                total_expense += amount
+                expense_by_category[category] = expense_by_category.get(category, 0) + amount
+                if category == 'Goal Savings':
+                    total_goal_savings += amount
+                elif category == 'General Savings':
+                    total_general_savings += amount
 
     monthly_summaries = []
     if period == 'yearly':
         current_month_start = start_date.replace(day=1)
         while current_month_start < end_date:
-            next_month_start = (current_month_start.replace(day=28) + timedelta(days=4)).replace(day=1) # Advance to next month
-            if next_month_start > end_date: # Don't go past the year's end
-                next_month_start = end_date
-
-            month_transactions = [
-                t for t in filtered_transactions
-                if current_month_start <= datetime.strptime(t['date'], '%Y-%m-%d') < next_month_start
-            ]
-            
-            month_income = sum(t['amount'] for t in month_transactions if t['type'] == 'income')
-            month_expense = sum(t['amount'] for t in month_transactions if t['type'] == 'expense')
-            month_savings = sum(t['amount'] for t in month_transactions if t['type'] == 'expense' and (t['category'] == 'Goal Savings' or t['category'] == 'General Savings'))
-            month_balance = month_income - month_expense
-
-            if month_income > 0 or month_expense > 0 or month_savings > 0: # Only include months with data
-                monthly_summaries.append({
-                    'month': current_month_start.strftime('%Y-%m'),
-                    'total_income': month_income,
-                    'total_expense': month_expense,
-                    'total_savings': month_savings,
-                    'balance': month_balance
-                })
-            current_month_start = next_month_start
+            totals = month_totals.get(current_month_start.date())
+            if totals:
+                month_savings = totals['goal_savings'] + totals['general_savings']
+                if totals['income'] > 0 or totals['expense'] > 0 or month_savings > 0: # Only include months with data
+                    monthly_summaries.append({
+                        'month': current_month_start.strftime('%Y-%m'),
+                        'total_income': totals['income'],
+                        'total_expense': totals['expense'],
+                        'total_savings': month_savings,
+                        'balance': totals['income'] - totals['expense']
+                    })
+            current_month_start = _month_start(current_month_start, 1)
+
+    return {
+        'total_income': total_income,
+        'total_expense': total_expense,
+        'total_goal_savings': total_goal_savings,
+        'total_general_savings': total_general_savings,
+        'income_breakdown_by_item': income_breakdown_by_item,
+        'expense_by_category': expense_by_category,
+        'monthly_summaries': monthly_summaries
+    }
+
+def _cacheable_ledger_version():
+    """
+    The ledger version to cache a report under, or None when the current transaction has
+    uncommitted writes: a report built from them must not be cached, as they may be rolled back.
+    """
+    row = queries.fetch_one('ledger_version_if_clean')
+    if row is None:
+        return 0
+    version, clean = row
+    return version if clean else None
+
+def generate_report_data(period=None, start_date_str=None, end_date_str=None, engine=None, use_cache=True):
+    """
+    Generates budget report data for a given period or custom date range.
+    `engine` ('sql' or 'numpy', default REPORT_ENGINE) picks how the totals are computed:
+    aggregate queries, or report_engine over the rows already loaded for the listing.
+    'numpy' falls back to 'sql' when NumPy is not installed.
+
+    Results are cached (see report_cache) per resolved range and ledger version, so paging
+    through a report or reloading it does not recompute it. Each call returns its own
+    shallow copy: adding or replacing keys is fine, the lists inside are shared and must
+    not be modified.
+    """
+    period, start_date, end_date = resolve_report_range(period, start_date_str, end_date_str)
+    engine = 'numpy' if (engine or REPORT_ENGINE) == 'numpy' and report_engine.available() else 'sql'
+    if not (use_cache and report_cache.enabled()):
+        return _build_report_data(period, start_date, end_date, engine)
 
+    key = report_cache.make_key(period, start_date, end_date, engine)
+    # Read before the report: an entry may end up keyed older than its data, never newer
+    ledger_version = _cacheable_ledger_version()
+    report = report_cache.lookup(key, ledger_version) if ledger_version is not None else None
+    if report is None:
+        report = _build_report_data(period, start_date, end_date, engine)
+        if ledger_version is not None:
+            report_cache.store(key, ledger_version, report)
+    return dict(report)
+
+def _build_report_data(period, start_date, end_date, engine):
+    """Computes a report for an already resolved period and range (uncached)."""
+    range_start, range_end = _date_bounds(start_date, end_date)
+    use_numpy = engine == 'numpy'
+
+    conn = db.get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"""
+                SELECT {TRANSACTION_COLUMNS} FROM transactions_with_category
+                WHERE date >= %s AND date < %s
+                ORDER BY date DESC, id DESC;
+                """,
+                (range_start, range_end)
+            )
+            filtered_transactions = [_row_to_transaction(row) for row in cur.fetchall()]
+
+            if use_numpy:
+                summary = report_engine.summarize(filtered_transactions, monthly=(period == 'yearly'))
+            else:
+                summary = _summarize_in_database(cur, period, start_date, end_date, range_start, range_end)
+    finally:
+        db.release_db_connection(conn)
+
+    total_income = summary['total_income']
+    total_expense = summary['total_expense']
+    total_goal_savings = summary['total_goal_savings']
+    total_general_savings = summary['total_general_savings']
+    total_savings = total_goal_savings + total_general_savings
+    balance = total_income - total_expense
 
     return {
         "period": period,
@@ -221,6 +691,31 @@ def generate_report_data(period=None, start_date_str=None, end_date_str=None):
         "total_general_savings": total_general_savings,
         "balance": balance,
         "transactions": filtered_transactions,
-        "income_breakdown_by_item": income_breakdown_by_item,
-        "monthly_summaries": monthly_summaries if period == 'yearly' else []
-    }
\ No newline at end of file
+        "income_breakdown_by_item": summary['income_breakdown_by_item'],
+        # Pie chart data: top categories by amount plus "Other", so the page does not grow with the row count
+        "expense_breakdown_by_category": expense_breakdown(summary['expense_by_category']),
+        "monthly_summaries": summary['monthly_summaries']
+    }
+
+def rebuild_monthly_rollups():
+    """Rebuilds monthly_rollups from the transactions table. Returns the number of rollup rows written."""
+    conn = db.get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            # Block writers so no transaction lands between the wipe and the re-aggregation
+            cur.execute("LOCK TABLE transactions IN SHARE MODE;")
+            cur.execute("DELETE FROM monthly_rollups;")
+            cur.execute(
+                """
+                INSERT INTO monthly_rollups (month, type, category_id, total_amount, transaction_count)
+                SELECT date_trunc('month', date)::date, type, COALESCE(expense_category_id, income_category_id),
+                       SUM(amount), COUNT(*)
+                FROM transactions
+                GROUP BY 1, 2, 3;
+                """
+            )
+            written = cur.rowcount
+            db.commit(conn)
+            return written
+    finally:
+        db.release_db_connection(conn)
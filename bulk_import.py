@@ -0,0 +1,148 @@
+import time
+import psycopg2
+import db
+
+# Same column layout as transactions.csv
+CSV_COLUMNS = ['transaction_id', 'date', 'type', 'category', 'item', 'amount', 'description', 'savings_goal_id']
+
+# How many offending values to quote back per validation problem
+MAX_REPORTED_VALUES = 10
+
+VALIDATION_CHECKS = [
+    ("unknown type (expected income or expense)",
+     "SELECT DISTINCT type FROM import_staging WHERE type IS NULL OR type NOT IN ('income', 'expense')"),
+    ("invalid date (expected YYYY-MM-DD)",
+     r"SELECT DISTINCT date FROM import_staging WHERE date IS NULL OR date !~ '^\d{4}-\d{2}-\d{2}$'"),
+    # Like the add transaction form: a positive amount; the sign comes from the type
+    ("invalid amount (expected a positive number)",
+     r"""
+     SELECT DISTINCT amount FROM import_staging
+     WHERE CASE WHEN amount ~ '^\d+(\.\d+)?$' THEN amount::numeric <= 0 ELSE TRUE END
+     """),
+    ("missing item",
+     "SELECT DISTINCT transaction_id FROM import_staging WHERE item IS NULL OR item = ''"),
+    ("unknown category",
+     """
+     SELECT DISTINCT s.type || ': ' || coalesce(s.category, '') FROM import_staging s
+     WHERE NOT (s.type = 'expense' AND EXISTS (SELECT 1 FROM expense_categories c WHERE c.name = s.category))
+       AND NOT (s.type = 'income' AND EXISTS (SELECT 1 FROM income_categories c WHERE c.name = s.category))
+       AND s.type IN ('income', 'expense')
+     """),
+    ("unknown savings goal",
+     r"""
+     SELECT DISTINCT s.savings_goal_id FROM import_staging s
+     WHERE coalesce(s.savings_goal_id, '') <> ''
+       AND (s.savings_goal_id !~ '^\d+$'
+            OR NOT EXISTS (SELECT 1 FROM savings_goals g WHERE g.id::text = s.savings_goal_id))
+     """),
+]
+
+
+def _read_header(stream):
+    """Reads and checks the CSV header line, leaving `stream` positioned at the first data row."""
+    header = stream.readline()
+    if isinstance(header, bytes):
+        header = header.decode('utf-8-sig')
+    columns = [column.strip().lower() for column in header.strip().lstrip('\ufeff').split(',')]
+    if columns != CSV_COLUMNS:
+        raise ValueError(f"Unexpected CSV header. Expected: {','.join(CSV_COLUMNS)}")
+
+def import_transactions_csv(stream):
+    """
+    Bulk-imports transactions from a CSV file object laid out like transactions.csv.
+
+    The rows are streamed with COPY FROM STDIN into a temporary staging table, validated
+    (type, date, amount, item, category against expense_categories/income_categories,
+    savings goal) and merged into `transactions` in a single database transaction.
+    Rows whose transaction_id already exists are skipped; empty transaction_ids get a new UUID.
+    Goal Savings rows credit their goal, and the monthly rollups follow through their trigger.
+
+    Raises ValueError (nothing is imported) if the header or any row is invalid.
+    Returns a dict with 'staged', 'imported', 'skipped' and 'seconds'.
+    """
+    started = time.monotonic()
+    _read_header(stream)
+
+    conn = db.get_db_connection(request_scoped=False)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                CREATE TEMP TABLE import_staging (
+                    transaction_id TEXT,
+                    date TEXT,
+                    type TEXT,
+                    category TEXT,
+                    item TEXT,
+                    amount TEXT,
+                    description TEXT,
+                    savings_goal_id TEXT
+                ) ON COMMIT DROP;
+            """)
+            # Everything is staged as text so malformed values are reported instead of aborting COPY
+            cur.copy_expert(
+                f"COPY import_staging ({', '.join(CSV_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+                stream
+            )
+            cur.execute("SELECT COUNT(*) FROM import_staging;")
+            staged = cur.fetchone()[0]
+
+            problems = []
+            for description, query in VALIDATION_CHECKS:
+                cur.execute(f"{query} LIMIT {MAX_REPORTED_VALUES};")
+                values = [str(row[0]) for row in cur.fetchall()]
+                if values:
+                    problems.append(f"{description}: {', '.join(values)}")
+            if problems:
+                raise ValueError("Import rejected. " + "; ".join(problems))
+
+            cur.execute("""
+                WITH inserted AS (
+                    INSERT INTO transactions (transaction_id, type, expense_category_id, income_category_id,
+                                              item, amount, date, description, savings_goal_id)
+                    SELECT coalesce(nullif(s.transaction_id, ''), gen_random_uuid()::text),
+                           s.type, ec.id, ic.id, s.item, s.amount::numeric, s.date::date,
+                           coalesce(s.description, ''), nullif(s.savings_goal_id, '')::integer
+                    FROM import_staging s
+                    LEFT JOIN expense_categories ec ON s.type = 'expense' AND ec.name = s.category
+                    LEFT JOIN income_categories ic ON s.type = 'income' AND ic.name = s.category
+                    ON CONFLICT (transaction_id) DO NOTHING
+                    RETURNING type, expense_category_id, amount, savings_goal_id
+                ),
+                goal_totals AS (
+                    UPDATE savings_goals sg
+                    SET saved_amount = sg.saved_amount + sub.total_saved
+                    FROM (
+                        SELECT savings_goal_id, SUM(amount) AS total_saved
+                        FROM inserted
+                        WHERE expense_category_id = (SELECT id FROM expense_categories WHERE name = 'Goal Savings')
+                          AND savings_goal_id IS NOT NULL
+                        GROUP BY savings_goal_id
+                    ) AS sub
+                    WHERE sg.id = sub.savings_goal_id
+                    RETURNING sg.id
+                )
+                SELECT (SELECT COUNT(*) FROM inserted);
+            """)
+            imported = cur.fetchone()[0]
+            conn.commit()
+    except psycopg2.DataError as e:
+        # e.g. a date like 2025-02-30 that passes the format check but not the cast
+        conn.rollback()
+        raise ValueError(f"Import rejected. {e.diag.message_primary}") from e
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        db.release_db_connection(conn)
+
+    return {
+        'staged': staged,
+        'imported': imported,
+        'skipped': staged - imported,
+        'seconds': time.monotonic() - started
+    }
+
+def import_transactions_file(csv_path):
+    """Bulk-imports a CSV file from disk (see import_transactions_csv)."""
+    with open(csv_path, 'rb') as f:
+        return import_transactions_csv(f)
@@ -0,0 +1,198 @@
+import threading
+import time
+from collections import deque
+import psycopg2
+import psycopg2.extensions
+from psycopg2.pool import PoolError
+
+
+class PoolTimeout(PoolError):
+    """Raised when no connection became free within the checkout timeout."""
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    """psycopg2 connection that carries the bookkeeping the pool needs."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        # Names of the server-side prepared statements this session already holds (see queries.py)
+        self.prepared = set()
+
+
+class ConnectionPool:
+    """
+    Thread-safe psycopg2 connection pool.
+
+    - Keeps between `minconn` and `maxconn` connections open.
+    - getconn() blocks for up to `timeout` seconds when every connection is in use,
+      then raises PoolTimeout (a PoolError).
+    - Connections idle for more than `health_check_after` seconds are pinged with SELECT 1
+      before being handed out; broken ones are replaced transparently.
+    - Connections older than `max_lifetime` seconds (0 = no limit) are closed and replaced
+      when they next come back or go out.
+    - metrics() reports sizes, checkout counts and wait times.
+    """
+
+    def __init__(self, minconn, maxconn, timeout=30.0, max_lifetime=1800.0, health_check_after=30.0, **connect_kwargs):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError(f"Invalid pool size: min={minconn}, max={maxconn}")
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.health_check_after = health_check_after
+        self._connect_kwargs = connect_kwargs
+
+        self._cond = threading.Condition()
+        self._idle = deque() # Most recently returned connection is reused first
+        self._open = 0 # Open connections plus slots reserved for ones being opened
+        self._in_use = 0
+        self._waiting = 0
+        self._closed = False
+        self._stats = {
+            'checkouts': 0,
+            'timeouts': 0,
+            'connections_opened': 0,
+            'connections_discarded': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+        }
+
+        for _ in range(minconn):
+            self._idle.append(self._connect())
+            self._open += 1
+
+    def _connect(self):
+        conn = psycopg2.connect(connection_factory=PooledConnection, **self._connect_kwargs)
+        with self._cond:
+            self._stats['connections_opened'] += 1
+        return conn
+
+    def _expired(self, conn, now):
+        return bool(self.max_lifetime) and now - conn.created_at > self.max_lifetime
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+
+    def _close(self, conn):
+        """Closes a connection but keeps its slot. Call without holding the lock."""
+        try:
+            if not conn.closed:
+                conn.close()
+        except psycopg2.Error:
+            pass
+        with self._cond:
+            self._stats['connections_discarded'] += 1
+
+    def _discard(self, conn):
+        """Closes a connection and frees its slot. Call without holding the lock."""
+        self._close(conn)
+        with self._cond:
+            self._open -= 1
+            self._cond.notify()
+
+    def getconn(self, timeout=None):
+        """Checks out a connection, waiting up to `timeout` (default: the pool's) seconds for one."""
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        with self._cond:
+            if self._closed:
+                raise PoolError("connection pool is closed")
+            self._waiting += 1
+            try:
+                while not self._idle and self._open >= self.maxconn:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeout(f"no database connection became free within {timeout:g}s "
+                                          f"(pool max {self.maxconn})")
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+
+            conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                self._open += 1 # Reserve the slot; the connection is opened outside the lock
+            self._in_use += 1
+            waited = time.monotonic() - started
+            self._stats['checkouts'] += 1
+            self._stats['wait_time_total'] += waited
+            self._stats['wait_time_max'] = max(self._stats['wait_time_max'], waited)
+
+        try:
+            now = time.monotonic()
+            if conn is not None and (self._expired(conn, now) or (
+                    now - conn.last_used > self.health_check_after and not self._is_healthy(conn))):
+                self._close(conn) # Its slot is reused for the replacement
+                conn = None
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return conn
+
+    def putconn(self, conn, close=False):
+        """Returns a connection. Open transactions are rolled back; broken, expired or `close`d ones are discarded."""
+        with self._cond:
+            self._in_use -= 1
+
+        if not close and not conn.closed:
+            status = conn.info.transaction_status
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                close = True
+            elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    close = True
+        if close or conn.closed or self._closed or self._expired(conn, time.monotonic()):
+            self._discard(conn)
+            return
+
+        conn.last_used = time.monotonic()
+        with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def closeall(self):
+        """Closes idle connections and refuses new checkouts; checked-out ones are closed when returned."""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = list(self._idle), deque()
+        for conn in idle:
+            self._discard(conn)
+
+    def metrics(self):
+        with self._cond:
+            stats = dict(self._stats)
+            checkouts = stats['checkouts']
+            return {
+                'min': self.minconn,
+                'max': self.maxconn,
+                'open': self._open,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'waiting': self._waiting,
+                'checkouts': checkouts,
+                'timeouts': stats['timeouts'],
+                'connections_opened': stats['connections_opened'],
+                'connections_discarded': stats['connections_discarded'],
+                'wait_time_total_ms': round(stats['wait_time_total'] * 1000, 3),
+                'wait_time_avg_ms': round(stats['wait_time_total'] * 1000 / checkouts, 3) if checkouts else 0.0,
+                'wait_time_max_ms': round(stats['wait_time_max'] * 1000, 3),
+            }
@@ -1,39 +1,114 @@
 import os
-import psycopg2
-from psycopg2 import pool
+import threading
 import urllib.parse as urlparse
+from flask import g, has_request_context
+from connection_pool import ConnectionPool
 import settings_manager # Added import
+import migrate
+
+# Pool sizing and lifecycle, overridable per deployment
+POOL_MIN = int(os.environ.get('DB_POOL_MIN', 1))
+POOL_MAX = int(os.environ.get('DB_POOL_MAX', 10))
+# Seconds a checkout waits for a free connection before raising connection_pool.PoolTimeout
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+# Seconds after which a connection is replaced (0 = never)
+POOL_MAX_LIFETIME = float(os.environ.get('DB_POOL_MAX_LIFETIME', 1800))
+# Connections idle longer than this many seconds are pinged before reuse
+POOL_HEALTH_CHECK_AFTER = float(os.environ.get('DB_POOL_HEALTH_CHECK_AFTER', 30))
 
 # Create a connection pool
 db_pool = None
+_pool_lock = threading.Lock()
 
 def init_pool():
     global db_pool
-    if db_pool is None:
-        database_url = os.environ.get('DATABASE_URL')
-        if not database_url:
-            raise ValueError("DATABASE_URL environment variable is not set")
-
-        url = urlparse.urlparse(database_url)
-        db_pool = psycopg2.pool.SimpleConnectionPool(
-            minconn=1,
-            maxconn=10,
-            user=url.username,
-            password=url.password,
-            host=url.hostname,
-            port=url.port,
-            database=url.path[1:]
-        )
-
-def get_db_connection():
+    with _pool_lock: # Threaded servers may hit the first request on several threads at once
+        if db_pool is None:
+            database_url = os.environ.get('DATABASE_URL')
+            if not database_url:
+                raise ValueError("DATABASE_URL environment variable is not set")
+
+            url = urlparse.urlparse(database_url)
+            db_pool = ConnectionPool(
+                minconn=POOL_MIN,
+                maxconn=POOL_MAX,
+                timeout=POOL_TIMEOUT,
+                max_lifetime=POOL_MAX_LIFETIME,
+                health_check_after=POOL_HEALTH_CHECK_AFTER,
+                user=url.username,
+                password=url.password,
+                host=url.hostname,
+                port=url.port,
+                database=url.path[1:]
+            )
+
+def pool_metrics():
+    """Returns the pool's size, checkout and wait-time counters (empty before first use)."""
+    return db_pool.metrics() if db_pool is not None else {}
+
+def get_db_connection(request_scoped=True):
+    """
+    Returns a pooled connection.
+    Inside a Flask request every call returns the same connection: it is checked out once,
+    committed once by commit_request() and given back by teardown_request(), so a request
+    is a single unit of work. Outside a request, or with request_scoped=False (for code
+    that manages its own transactions), a connection is checked out for the caller alone.
+    Either way, pair it with release_db_connection() and commit with db.commit().
+    """
     if db_pool is None: # Corrected from '==='
         init_pool()
+    if request_scoped and has_request_context():
+        if g.get('db_conn') is None:
+            g.db_conn = db_pool.getconn()
+        return g.db_conn
     return db_pool.getconn()
 
+def _is_request_connection(conn):
+    return has_request_context() and g.get('db_conn') is conn
+
 def release_db_connection(conn):
-    if db_pool is not None:
+    # The request connection stays checked out until teardown_request()
+    if db_pool is not None and not _is_request_connection(conn):
         db_pool.putconn(conn)
 
+def commit(conn):
+    """Commits now, or at the end of the request when `conn` is the request connection."""
+    if not _is_request_connection(conn):
+        conn.commit()
+
+def on_commit(conn, callback):
+    """Runs `callback` once `conn`'s work is committed (immediately unless it is the request connection)."""
+    if _is_request_connection(conn):
+        g.setdefault('db_on_commit', []).append(callback)
+    else:
+        callback()
+
+def commit_request(response):
+    """after_request hook: commits the request's unit of work unless the request failed."""
+    conn = g.get('db_conn')
+    if conn is not None and response.status_code < 500:
+        conn.commit()
+        for callback in g.pop('db_on_commit', []):
+            callback()
+    return response
+
+def teardown_request(exc=None):
+    """teardown_request hook: rolls back anything left uncommitted and returns the connection to the pool."""
+    conn = g.pop('db_conn', None)
+    g.pop('db_on_commit', None)
+    if conn is None:
+        return
+    try:
+        if not conn.closed:
+            conn.rollback()
+    finally:
+        db_pool.putconn(conn, close=bool(conn.closed))
+
+def init_app(app):
+    """Binds the request-scoped connection to the Flask app's request lifecycle."""
+    app.after_request(commit_request)
+    app.teardown_request(teardown_request)
+
 def init_db():
     """Initializes the database and creates tables if they don't exist."""
     print("DEBUG: init_db() started.")
@@ -108,6 +183,8 @@ def init_db():
 
             conn.commit()
             print("DEBUG: All table creation committed. Initializing default settings...")
+            # Indexes and later schema changes are versioned in migrate.MIGRATIONS
+            migrate.apply_migrations(conn)
             # Initialize default settings after tables are created
             settings_manager.initialize_default_settings() # Added call
             print("DEBUG: Default settings initialization called.")
@@ -115,6 +192,8 @@ def init_db():
         print(f"DEBUG: An error occurred during init_db: {e}")
         if conn:
             conn.rollback()
+        # Do not start on a partly created or half-migrated schema
+        raise
     finally:
         release_db_connection(conn)
         print("DEBUG: init_db() finished.")
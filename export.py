@@ -0,0 +1,128 @@
+import csv
+import io
+import json
+import zlib
+from datetime import date
+from decimal import Decimal
+import db
+import bulk_import
+
+# Tables that can be exported, with their columns in output order. Transactions use the
+# transactions.csv layout so an export can be fed back to bulk_import / migrate_data.py.
+# Users are left out on purpose: their rows carry password hashes and TOTP secrets.
+EXPORT_TABLES = {
+    'transactions': bulk_import.CSV_COLUMNS,
+    'savings_goals': ['id', 'name', 'target_amount', 'saved_amount'],
+    'expense_categories': ['id', 'name', 'icon'],
+    'income_categories': ['id', 'name', 'icon'],
+    'settings': ['key', 'value'],
+}
+# Where a table's rows are read from when that is not the table itself. Transactions go
+# through the view so the category column carries the name rather than the category id.
+EXPORT_SOURCES = {
+    'transactions': 'transactions_with_category',
+}
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+}
+
+# Rows pulled from the server-side cursor per round trip
+FETCH_SIZE = 2000
+# Output is buffered up to roughly this many bytes before a chunk is handed to the client
+CHUNK_BYTES = 64 * 1024
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+def _check_request(table, fmt):
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"Unknown table '{table}'. Choose one of: {', '.join(EXPORT_TABLES)}")
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown format '{fmt}'. Choose one of: {', '.join(EXPORT_FORMATS)}")
+
+def export_filename(table, fmt, compress=False):
+    _check_request(table, fmt)
+    return f"{table}.{EXPORT_FORMATS[fmt][1]}" + ('.gz' if compress else '')
+
+def export_mimetype(fmt, compress=False):
+    return 'application/gzip' if compress else EXPORT_FORMATS[fmt][0]
+
+def _iter_rows(table):
+    """Yields the table's rows through a named (server-side) cursor, FETCH_SIZE at a time."""
+    columns = EXPORT_TABLES[table]
+    order_by = 'key' if table == 'settings' else 'id'
+    conn = db.get_db_connection(request_scoped=False)
+    try:
+        with conn.cursor() as cur:
+            # One consistent snapshot for the whole export, without blocking writers
+            cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY;")
+        with conn.cursor(name=f'export_{table}') as cur:
+            cur.itersize = FETCH_SIZE
+            source = EXPORT_SOURCES.get(table, table)
+            cur.execute(f"SELECT {', '.join(columns)} FROM {source} ORDER BY {order_by};")
+            for row in cur:
+                yield row
+    finally:
+        # Also reached when the client disconnects and the generator is closed early
+        conn.rollback()
+        db.release_db_connection(conn)
+
+def _iter_text(table, fmt):
+    """Yields the export as text chunks of about CHUNK_BYTES."""
+    columns = EXPORT_TABLES[table]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == 'csv' else None
+    if writer:
+        writer.writerow(columns)
+
+    for row in _iter_rows(table):
+        if writer:
+            writer.writerow(['' if value is None else value for value in row])
+        else:
+            buffer.write(json.dumps(dict(zip(columns, row)), default=_json_default))
+            buffer.write('\n')
+        if buffer.tell() >= CHUNK_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def iter_export(table, fmt='ndjson', compress=False):
+    """
+    Streams a table as newline-delimited JSON or CSV, optionally gzip-compressed.
+
+    Returns a generator of bytes chunks. Rows are read with a server-side cursor and
+    written out as they arrive, so memory use does not grow with the table. The database
+    connection is only taken once iteration starts and is released when it ends.
+    Raises ValueError for an unknown table or format.
+    """
+    _check_request(table, fmt)
+
+    def generate():
+        compressor = zlib.compressobj(wbits=31) if compress else None # wbits=31: gzip container
+        for text in _iter_text(table, fmt):
+            data = text.encode('utf-8')
+            if compressor:
+                data = compressor.compress(data)
+            if data:
+                yield data
+        if compressor:
+            yield compressor.flush()
+
+    return generate()
+
+def export_to_file(table, path, fmt='ndjson', compress=False):
+    """Writes an export to `path`. Returns the number of bytes written."""
+    written = 0
+    with open(path, 'wb') as f:
+        for chunk in iter_export(table, fmt, compress):
+            f.write(chunk)
+            written += len(chunk)
+    return written
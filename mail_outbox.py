@@ -0,0 +1,322 @@
+import os
+import random
+import smtplib
+import threading
+from email.message import EmailMessage
+from email.utils import make_msgid
+from psycopg2.extras import execute_values
+import db
+
+# Outgoing mail goes through the `outbox` table (migrate.py, migration 12) instead of being
+# sent inside the request.
+#
+# enqueue() inserts a row on the request's connection. The mail is therefore only queued if the
+# request commits, and the request never waits on SMTP. A sender then delivers pending rows:
+#   - claims up to MAIL_OUTBOX_BATCH_SIZE due rows in one short transaction: FOR UPDATE SKIP
+#     LOCKED picks them, and moving their next_attempt_at MAIL_OUTBOX_CLAIM_LEASE ahead keeps
+#     any other sender (one thread per app process, or `flask send-mail` workers) off them
+#   - sends the whole batch over one SMTP connection, holding no database connection or lock
+#   - marks rows sent, or reschedules them with exponential backoff, in a second short
+#     transaction; after MAIL_OUTBOX_MAX_ATTEMPTS a row is marked failed and kept for inspection
+# Delivery is at least once: if a sender dies after SMTP accepted a message but before the
+# result is recorded, the lease runs out and that message is sent again.
+#
+# MAIL_OUTBOX_SENDER='thread' (the default) runs a sender thread in each process that serves
+# requests, started by its first request (see init_app), so importing the app or running a
+# `flask` command never starts one. 'worker' leaves delivery to a separate `flask send-mail`
+# process. For local testing, point MAIL_SERVER and MAIL_PORT at an SMTP stub (e.g.
+# `python -m aiosmtpd -n -l localhost:8025`) with MAIL_USE_TLS=false, or pass send_pending()
+# a `connect` of your own.
+
+MAIL_OUTBOX_SENDER = os.environ.get('MAIL_OUTBOX_SENDER', 'thread')
+MAIL_OUTBOX_BATCH_SIZE = int(os.environ.get('MAIL_OUTBOX_BATCH_SIZE', 20))
+MAIL_OUTBOX_MAX_ATTEMPTS = int(os.environ.get('MAIL_OUTBOX_MAX_ATTEMPTS', 8))
+# Retry delays double from the base up to the cap (seconds), with up to 20% jitter
+MAIL_OUTBOX_BACKOFF_BASE = float(os.environ.get('MAIL_OUTBOX_BACKOFF_BASE', 30))
+MAIL_OUTBOX_BACKOFF_MAX = float(os.environ.get('MAIL_OUTBOX_BACKOFF_MAX', 3600))
+# How often an idle sender looks for due rows (enqueue() in this process wakes it at once)
+MAIL_OUTBOX_POLL_INTERVAL = float(os.environ.get('MAIL_OUTBOX_POLL_INTERVAL', 10))
+# Bounds how long one SMTP connect or command may hang
+MAIL_OUTBOX_SMTP_TIMEOUT = float(os.environ.get('MAIL_OUTBOX_SMTP_TIMEOUT', 30))
+# Seconds a claimed batch is left to its sender before others may retry it. The default covers
+# a batch where the connect and every message hit the SMTP timeout, so a slow batch is not
+# sent twice.
+MAIL_OUTBOX_CLAIM_LEASE = float(os.environ.get(
+    'MAIL_OUTBOX_CLAIM_LEASE', MAIL_OUTBOX_SMTP_TIMEOUT * (MAIL_OUTBOX_BATCH_SIZE + 2)))
+# Sent rows are deleted after this many days
+MAIL_OUTBOX_KEEP_DAYS = int(os.environ.get('MAIL_OUTBOX_KEEP_DAYS', 7))
+
+# Errors that concern one message; anything else is treated as the connection failing
+MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+_sender_lock = threading.Lock()
+_sender = None
+
+
+def enqueue(subject, recipients, body, sender=None):
+    """
+    Queues a plain-text mail. It is committed with the caller's unit of work (the request,
+    inside one) and picked up by a sender afterwards. Returns the outbox row id.
+    """
+    conn = db.get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO outbox (sender, recipients, subject, body)
+                VALUES (%s, %s, %s, %s)
+                RETURNING id;
+                """,
+                (sender, list(recipients), subject, body)
+            )
+            outbox_id = cur.fetchone()[0]
+            db.commit(conn)
+            db.on_commit(conn, wake)
+            return outbox_id
+    finally:
+        db.release_db_connection(conn)
+
+def smtp_connect(config):
+    """Opens an SMTP connection from Flask-Mail style settings (MAIL_SERVER, MAIL_PORT, MAIL_USE_TLS, ...)."""
+    host = config.get('MAIL_SERVER') or 'localhost'
+    port = int(config.get('MAIL_PORT') or 25)
+    if config.get('MAIL_USE_SSL'):
+        smtp = smtplib.SMTP_SSL(host, port, timeout=MAIL_OUTBOX_SMTP_TIMEOUT)
+    else:
+        smtp = smtplib.SMTP(host, port, timeout=MAIL_OUTBOX_SMTP_TIMEOUT)
+        if config.get('MAIL_USE_TLS'):
+            smtp.starttls()
+    if config.get('MAIL_USERNAME') and config.get('MAIL_PASSWORD'):
+        smtp.login(config['MAIL_USERNAME'], config['MAIL_PASSWORD'])
+    return smtp
+
+def _build_message(sender, recipients, subject, body, default_sender):
+    message = EmailMessage()
+    message['From'] = sender or default_sender
+    message['To'] = ', '.join(recipients)
+    message['Subject'] = subject
+    message['Message-ID'] = make_msgid()
+    message.set_content(body)
+    return message
+
+def _backoff(attempts):
+    """Seconds until the next try after `attempts` failed ones."""
+    delay = min(MAIL_OUTBOX_BACKOFF_BASE * 2 ** max(attempts - 1, 0), MAIL_OUTBOX_BACKOFF_MAX)
+    return delay * random.uniform(0.8, 1.0)
+
+def _deliver(rows, connect, default_sender):
+    """Sends the claimed rows over one connection. Returns {id: None if sent, else the error text}."""
+    results = {}
+    try:
+        smtp = connect()
+        try:
+            for outbox_id, sender, recipients, subject, body, _ in rows:
+                try:
+                    smtp.send_message(_build_message(sender, recipients, subject, body, default_sender))
+                    results[outbox_id] = None
+                except MESSAGE_ERRORS as e:
+                    results[outbox_id] = str(e)
+        finally:
+            try:
+                smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+    except (smtplib.SMTPException, OSError) as e:
+        # Connection-level failure: whatever was not sent yet is retried later
+        for row in rows:
+            results.setdefault(row[0], str(e))
+    return results
+
+def _claim(batch_size):
+    """
+    Leases up to `batch_size` due rows to this sender and commits at once, so no lock is held
+    while they are sent. Returns the rows (id, sender, recipients, subject, body, attempts).
+    """
+    conn = db.get_db_connection(request_scoped=False)
+    try:
+        with conn.cursor() as cur:
+            # SKIP LOCKED: senders claiming at the same moment each get their own rows
+            cur.execute(
+                """
+                UPDATE outbox SET next_attempt_at = now() + make_interval(secs => %s)
+                WHERE id IN (
+                    SELECT id FROM outbox
+                    WHERE status = 'pending' AND next_attempt_at <= now()
+                    ORDER BY next_attempt_at
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, sender, recipients, subject, body, attempts;
+                """,
+                (MAIL_OUTBOX_CLAIM_LEASE, batch_size)
+            )
+            rows = cur.fetchall()
+        conn.commit()
+        return rows
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        db.release_db_connection(conn)
+
+def _record(sent_ids, failures):
+    """Marks `sent_ids` sent and reschedules `failures` ((id, error, delay) tuples)."""
+    conn = db.get_db_connection(request_scoped=False)
+    try:
+        with conn.cursor() as cur:
+            if sent_ids:
+                cur.execute(
+                    """
+                    UPDATE outbox SET status = 'sent', sent_at = now(), attempts = attempts + 1, last_error = NULL
+                    WHERE id = ANY(%s);
+                    """,
+                    (sent_ids,)
+                )
+            if failures:
+                execute_values(
+                    cur,
+                    f"""
+                    UPDATE outbox AS o
+                    SET attempts = o.attempts + 1,
+                        last_error = v.error,
+                        status = CASE WHEN o.attempts + 1 >= {MAIL_OUTBOX_MAX_ATTEMPTS} THEN 'failed' ELSE 'pending' END,
+                        next_attempt_at = now() + make_interval(secs => v.delay::float8)
+                    FROM (VALUES %s) AS v (id, error, delay)
+                    WHERE o.id = v.id;
+                    """,
+                    failures
+                )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        db.release_db_connection(conn)
+
+def send_pending(config, connect=None, batch_size=None):
+    """
+    Delivers one batch of due outbox rows. `config` holds the Flask-Mail style settings;
+    `connect` (default smtp_connect(config)) returns an object with send_message() and quit().
+    Returns (sent, failed) counts for the batch; (0, 0) means nothing was due.
+    """
+    connect = connect or (lambda: smtp_connect(config))
+    rows = _claim(batch_size or MAIL_OUTBOX_BATCH_SIZE)
+    if not rows:
+        return 0, 0
+
+    results = _deliver(rows, connect, config.get('MAIL_DEFAULT_SENDER'))
+    sent_ids = [outbox_id for outbox_id, error in results.items() if error is None]
+    failures = [
+        (row[0], results[row[0]], _backoff(row[5] + 1))
+        for row in rows if results[row[0]] is not None
+    ]
+    _record(sent_ids, failures)
+    for outbox_id, error, _ in failures:
+        print(f"Outbox mail {outbox_id} not sent: {error}")
+    return len(sent_ids), len(failures)
+
+def purge_sent():
+    """Deletes sent rows older than MAIL_OUTBOX_KEEP_DAYS. Returns the number deleted."""
+    conn = db.get_db_connection(request_scoped=False)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "DELETE FROM outbox WHERE status = 'sent' AND sent_at < now() - make_interval(days => %s);",
+                (MAIL_OUTBOX_KEEP_DAYS,)
+            )
+            deleted = cur.rowcount
+        conn.commit()
+        return deleted
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        db.release_db_connection(conn)
+
+def run_sender(config, stop_event=None, wake_event=None, once=False):
+    """
+    Sends batches until nothing is due, then waits for MAIL_OUTBOX_POLL_INTERVAL (or `wake_event`)
+    and starts over. Runs until `stop_event` is set, or after one pass with once=True.
+    """
+    stop_event = stop_event or threading.Event()
+    wake_event = wake_event or threading.Event()
+    while not stop_event.is_set():
+        wake_event.clear()
+        try:
+            while not stop_event.is_set():
+                sent, failed = send_pending(config)
+                if sent + failed == 0:
+                    break
+            purge_sent()
+        except Exception as e:
+            # e.g. the database is unreachable; the rows stay pending and are retried
+            print(f"Outbox sender error: {e}")
+        if once:
+            return
+        wake_event.wait(MAIL_OUTBOX_POLL_INTERVAL)
+
+class _SenderThread:
+    """A daemon thread running run_sender() for this process."""
+
+    def __init__(self, config):
+        self.config = dict(config)
+        self.pid = os.getpid()
+        self.stop_event = threading.Event()
+        self.wake_event = threading.Event()
+        self.thread = threading.Thread(
+            target=run_sender, args=(self.config, self.stop_event, self.wake_event),
+            name='mail-outbox-sender', daemon=True
+        )
+        self.thread.start()
+
+    def alive(self):
+        return self.pid == os.getpid() and self.thread.is_alive()
+
+def start_sender(config):
+    """Starts this process's sender thread if MAIL_OUTBOX_SENDER is 'thread' and none is running."""
+    global _sender
+    if MAIL_OUTBOX_SENDER != 'thread':
+        return
+    sender = _sender
+    if sender is not None and sender.alive():
+        return
+    with _sender_lock:
+        if _sender is None or not _sender.alive():
+            # Also restarts it in a forked child (gunicorn --preload), where the thread does not exist
+            _sender = _SenderThread(config)
+
+def init_app(app):
+    """Starts the sender thread (see start_sender) when the app serves its first request in this process."""
+    app.before_request(lambda: start_sender(app.config))
+
+def wake():
+    """Tells this process's sender that a mail was just queued."""
+    with _sender_lock:
+        sender = _sender
+    if sender is None:
+        return
+    if not sender.alive():
+        start_sender(sender.config)
+        with _sender_lock:
+            sender = _sender
+    sender.wake_event.set()
+
+def stats():
+    """Outbox row counts by status, and the age in seconds of the oldest pending row."""
+    conn = db.get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT status, COUNT(*), EXTRACT(EPOCH FROM now() - MIN(created_at))
+                FROM outbox GROUP BY status;
+                """
+            )
+            result = {'sender': MAIL_OUTBOX_SENDER, 'pending': 0, 'sent': 0, 'failed': 0, 'oldest_pending_seconds': None}
+            for status, count, oldest in cur.fetchall():
+                result[status] = count
+                if status == 'pending':
+                    result['oldest_pending_seconds'] = float(oldest)
+            return result
+    finally:
+        db.release_db_connection(conn)
@@ -1,61 +1,582 @@
-import os
-import psycopg2
-import urllib.parse as urlparse
+import db
 
-def run_migration():
-    database_url = os.environ.get('DATABASE_URL')
-    if not database_url:
-        raise ValueError("DATABASE_URL environment variable is not set")
+# Versioned schema migrations.
+#
+# db.init_db() creates the baseline tables and then calls apply_migrations(), which runs every
+# entry of MIGRATIONS whose version is not yet recorded in `schema_migrations`, in order, each
+# in its own transaction. To change the schema, append a new (version, name, steps) entry;
+# never edit or renumber one that has shipped. A step is either a SQL string or a function
+# taking a cursor. Steps should tolerate objects that already exist (IF NOT EXISTS), because
+# databases created before this mechanism may already have some of them.
+
+# Arbitrary key for pg_advisory_xact_lock so only one gunicorn worker migrates at a time
+MIGRATION_LOCK_KEY = 4242001
+
+
+def _add_transactions_id_column(cur):
+    """Moves legacy `transactions` tables (keyed by transaction_id) onto a SERIAL id primary key."""
+    # Check if the 'id' column already exists to prevent errors on re-runs
+    cur.execute("SELECT column_name FROM information_schema.columns WHERE table_name='transactions' AND column_name='id';")
+    if cur.fetchone():
+        print("Column 'id' already exists in 'transactions' table. Skipping.")
+        return
+
+    # Drop existing PRIMARY KEY constraint on transaction_id if it exists
+    cur.execute("""
+        SELECT constraint_name
+        FROM information_schema.table_constraints
+        WHERE table_name = 'transactions' AND constraint_type = 'PRIMARY KEY';
+    """)
+    pk_constraint = cur.fetchone()
+    if pk_constraint:
+        print(f"Dropping existing primary key constraint '{pk_constraint[0]}' from 'transactions' table...")
+        cur.execute(f"ALTER TABLE transactions DROP CONSTRAINT {pk_constraint[0]};")
 
-    url = urlparse.urlparse(database_url)
-    conn = None
+    print("Adding 'id' column as SERIAL PRIMARY KEY to 'transactions' table...")
+    cur.execute("ALTER TABLE transactions ADD COLUMN id SERIAL PRIMARY KEY;")
+
+def _create_trigram_index(cur):
+    """Adds the pg_trgm substring-search index, skipping it where the extension can't be installed."""
+    cur.execute("SAVEPOINT trigram_index;")
     try:
-        conn = psycopg2.connect(
-            user=url.username,
-            password=url.password,
-            host=url.hostname,
-            port=url.port,
-            database=url.path[1:]
+        cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_transactions_search_trgm ON transactions USING GIN (search_text gin_trgm_ops);")
+        cur.execute("RELEASE SAVEPOINT trigram_index;")
+    except Exception as e:
+        # Search still works without the index, just slower
+        cur.execute("ROLLBACK TO SAVEPOINT trigram_index;")
+        print(f"Skipping trigram search index: {e}")
+
+def _make_transaction_id_unique(cur):
+    """Makes transactions.transaction_id a unique key, renaming any duplicates first."""
+    cur.execute("SELECT 1 FROM pg_constraint WHERE conname = 'transactions_transaction_id_key';")
+    if cur.fetchone():
+        return
+    # Older imports could repeat a transaction_id; keep the first row's value and suffix the rest with their id
+    cur.execute("""
+        UPDATE transactions t
+        SET transaction_id = t.transaction_id || '-' || t.id
+        FROM (
+            SELECT id, ROW_NUMBER() OVER (PARTITION BY transaction_id ORDER BY id) AS rn
+            FROM transactions
+        ) AS d
+        WHERE t.id = d.id AND d.rn > 1;
+    """)
+    if cur.rowcount:
+        print(f"Renamed {cur.rowcount} duplicate transaction_id value(s).")
+    cur.execute("ALTER TABLE transactions ADD CONSTRAINT transactions_transaction_id_key UNIQUE (transaction_id);")
+
+def _create_monthly_rollups(cur):
+    """Creates monthly_rollups, backfills it and keeps it current with triggers on transactions."""
+    # Hold off writers so nothing slips in between the backfill and the trigger taking over
+    cur.execute("LOCK TABLE transactions IN SHARE ROW EXCLUSIVE MODE;")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS monthly_rollups (
+            month DATE NOT NULL,
+            type TEXT NOT NULL,
+            category TEXT NOT NULL,
+            total_amount NUMERIC NOT NULL DEFAULT 0,
+            transaction_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (month, type, category)
+        );
+    """)
+    cur.execute("""
+        CREATE OR REPLACE FUNCTION maintain_monthly_rollups() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                UPDATE monthly_rollups
+                SET total_amount = total_amount - OLD.amount,
+                    transaction_count = transaction_count - 1
+                WHERE month = date_trunc('month', OLD.date)::date AND type = OLD.type AND category = OLD.category;
+                DELETE FROM monthly_rollups
+                WHERE month = date_trunc('month', OLD.date)::date AND type = OLD.type AND category = OLD.category
+                  AND transaction_count <= 0;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                INSERT INTO monthly_rollups (month, type, category, total_amount, transaction_count)
+                VALUES (date_trunc('month', NEW.date)::date, NEW.type, NEW.category, NEW.amount, 1)
+                ON CONFLICT (month, type, category) DO UPDATE
+                SET total_amount = monthly_rollups.total_amount + EXCLUDED.total_amount,
+                    transaction_count = monthly_rollups.transaction_count + 1;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+    cur.execute("""
+        CREATE OR REPLACE FUNCTION truncate_monthly_rollups() RETURNS trigger AS $$
+        BEGIN
+            DELETE FROM monthly_rollups;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+    cur.execute("DELETE FROM monthly_rollups;")
+    cur.execute("""
+        INSERT INTO monthly_rollups (month, type, category, total_amount, transaction_count)
+        SELECT date_trunc('month', date)::date, type, category, SUM(amount), COUNT(*)
+        FROM transactions
+        GROUP BY 1, 2, 3;
+    """)
+    cur.execute("DROP TRIGGER IF EXISTS trg_transactions_monthly_rollups ON transactions;")
+    cur.execute("""
+        CREATE TRIGGER trg_transactions_monthly_rollups
+        AFTER INSERT OR DELETE OR UPDATE OF date, type, category, amount ON transactions
+        FOR EACH ROW EXECUTE FUNCTION maintain_monthly_rollups();
+    """)
+    # TRUNCATE skips row triggers (migrate_data.py truncates before reloading)
+    cur.execute("DROP TRIGGER IF EXISTS trg_transactions_truncate_rollups ON transactions;")
+    cur.execute("""
+        CREATE TRIGGER trg_transactions_truncate_rollups
+        AFTER TRUNCATE ON transactions
+        FOR EACH STATEMENT EXECUTE FUNCTION truncate_monthly_rollups();
+    """)
+
+# Set (transaction-locally) by code that rewrites many transactions and fixes monthly_rollups
+# itself with one set-based statement, such as a category rename
+ROLLUP_TRIGGER_SKIP_SETTING = 'budget.skip_rollup_trigger'
+
+def _make_rollup_trigger_skippable(cur):
+    """Replaces maintain_monthly_rollups() with a version that does nothing while ROLLUP_TRIGGER_SKIP_SETTING is on."""
+    cur.execute(f"""
+        CREATE OR REPLACE FUNCTION maintain_monthly_rollups() RETURNS trigger AS $$
+        BEGIN
+            IF current_setting('{ROLLUP_TRIGGER_SKIP_SETTING}', true) = 'on' THEN
+                RETURN NULL;
+            END IF;
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                UPDATE monthly_rollups
+                SET total_amount = total_amount - OLD.amount,
+                    transaction_count = transaction_count - 1
+                WHERE month = date_trunc('month', OLD.date)::date AND type = OLD.type AND category = OLD.category;
+                DELETE FROM monthly_rollups
+                WHERE month = date_trunc('month', OLD.date)::date AND type = OLD.type AND category = OLD.category
+                  AND transaction_count <= 0;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                INSERT INTO monthly_rollups (month, type, category, total_amount, transaction_count)
+                VALUES (date_trunc('month', NEW.date)::date, NEW.type, NEW.category, NEW.amount, 1)
+                ON CONFLICT (month, type, category) DO UPDATE
+                SET total_amount = monthly_rollups.total_amount + EXCLUDED.total_amount,
+                    transaction_count = monthly_rollups.transaction_count + 1;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+def _normalize_transaction_categories(cur):
+    """
+    Replaces the transactions.category text with expense_category_id / income_category_id
+    foreign keys (whichever matches the row's type). Also rebuilds monthly_rollups and the
+    search columns on the ids, and adds the transactions_with_category view for reading names.
+    """
+    cur.execute("LOCK TABLE transactions IN ACCESS EXCLUSIVE MODE;")
+
+    # Legacy rows must fit the constraint added below: normalize the type's spelling, and set
+    # aside (not drop) rows that still have no usable type or category, so they cannot block startup
+    cur.execute("""
+        UPDATE transactions SET type = lower(trim(type))
+        WHERE type <> lower(trim(type)) AND lower(trim(type)) IN ('expense', 'income');
+    """)
+    cur.execute("CREATE TABLE IF NOT EXISTS transactions_unmigrated AS TABLE transactions WITH NO DATA;")
+    cur.execute("""
+        WITH moved AS (
+            DELETE FROM transactions
+            WHERE type IS NULL OR type NOT IN ('expense', 'income') OR coalesce(trim(category), '') = ''
+            RETURNING *
+        )
+        INSERT INTO transactions_unmigrated SELECT * FROM moved;
+    """)
+    if cur.rowcount:
+        print(f"  {cur.rowcount} transaction(s) with an unknown type or no category were moved to "
+              "transactions_unmigrated; run `flask reconcile-savings-goals` if any were Goal Savings.")
+
+    # Names still used by transactions but no longer listed (deleted categories) have to exist as
+    # categories for the foreign keys; they are recreated without an icon and listed here
+    for type, table_name in (('expense', 'expense_categories'), ('income', 'income_categories')):
+        cur.execute(
+            f"""
+            INSERT INTO {table_name} (name)
+            SELECT DISTINCT category FROM transactions WHERE type = %s
+            ON CONFLICT (name) DO NOTHING
+            RETURNING name;
+            """,
+            (type,)
         )
-        cur = conn.cursor()
-
-        # Check if the 'id' column already exists to prevent errors on re-runs
-        cur.execute("SELECT column_name FROM information_schema.columns WHERE table_name='transactions' AND column_name='id';")
-        if cur.fetchone():
-            print("Column 'id' already exists in 'transactions' table. Skipping migration.")
-            return
-
-        print("Starting migration for 'transactions' table...")
-
-        # 1. Drop existing PRIMARY KEY constraint on transaction_id if it exists
-        # We need to find the name of the constraint first
-        cur.execute("""
-            SELECT constraint_name
-            FROM information_schema.table_constraints
-            WHERE table_name = 'transactions' AND constraint_type = 'PRIMARY KEY';
+        recreated = sorted(row[0] for row in cur.fetchall())
+        if recreated:
+            print(f"  Recreated {type} categories still used by transactions: {', '.join(recreated)}")
+
+    cur.execute("""
+        ALTER TABLE transactions
+        ADD COLUMN IF NOT EXISTS expense_category_id INTEGER REFERENCES expense_categories(id),
+        ADD COLUMN IF NOT EXISTS income_category_id INTEGER REFERENCES income_categories(id);
+    """)
+    # Not an UPDATE OF category, so the per-row rollup trigger stays quiet; the rollups are rebuilt below
+    cur.execute("""
+        UPDATE transactions t SET
+            expense_category_id = CASE WHEN t.type = 'expense'
+                THEN (SELECT c.id FROM expense_categories c WHERE c.name = t.category) END,
+            income_category_id = CASE WHEN t.type = 'income'
+                THEN (SELECT c.id FROM income_categories c WHERE c.name = t.category) END;
+    """)
+    cur.execute("""
+        ALTER TABLE transactions ADD CONSTRAINT transactions_category_id_check CHECK (
+            (type = 'expense' AND expense_category_id IS NOT NULL AND income_category_id IS NULL)
+            OR (type = 'income' AND income_category_id IS NOT NULL AND expense_category_id IS NULL)
+        );
+    """)
+
+    # Rollups move from (month, type, category name) to (month, type, category id)
+    cur.execute("DROP TRIGGER IF EXISTS trg_transactions_monthly_rollups ON transactions;")
+    cur.execute("DROP TABLE IF EXISTS monthly_rollups;")
+    cur.execute("""
+        CREATE TABLE monthly_rollups (
+            month DATE NOT NULL,
+            type TEXT NOT NULL,
+            category_id INTEGER NOT NULL,
+            total_amount NUMERIC NOT NULL DEFAULT 0,
+            transaction_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (month, type, category_id)
+        );
+    """)
+    cur.execute(f"""
+        CREATE OR REPLACE FUNCTION maintain_monthly_rollups() RETURNS trigger AS $$
+        BEGIN
+            IF current_setting('{ROLLUP_TRIGGER_SKIP_SETTING}', true) = 'on' THEN
+                RETURN NULL;
+            END IF;
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                UPDATE monthly_rollups
+                SET total_amount = total_amount - OLD.amount,
+                    transaction_count = transaction_count - 1
+                WHERE month = date_trunc('month', OLD.date)::date AND type = OLD.type
+                  AND category_id = COALESCE(OLD.expense_category_id, OLD.income_category_id);
+                DELETE FROM monthly_rollups
+                WHERE month = date_trunc('month', OLD.date)::date AND type = OLD.type
+                  AND category_id = COALESCE(OLD.expense_category_id, OLD.income_category_id)
+                  AND transaction_count <= 0;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                INSERT INTO monthly_rollups (month, type, category_id, total_amount, transaction_count)
+                VALUES (date_trunc('month', NEW.date)::date, NEW.type,
+                        COALESCE(NEW.expense_category_id, NEW.income_category_id), NEW.amount, 1)
+                ON CONFLICT (month, type, category_id) DO UPDATE
+                SET total_amount = monthly_rollups.total_amount + EXCLUDED.total_amount,
+                    transaction_count = monthly_rollups.transaction_count + 1;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+    cur.execute("""
+        INSERT INTO monthly_rollups (month, type, category_id, total_amount, transaction_count)
+        SELECT date_trunc('month', date)::date, type, COALESCE(expense_category_id, income_category_id), SUM(amount), COUNT(*)
+        FROM transactions
+        GROUP BY 1, 2, 3;
+    """)
+    cur.execute("""
+        CREATE TRIGGER trg_transactions_monthly_rollups
+        AFTER INSERT OR DELETE OR UPDATE OF date, type, expense_category_id, income_category_id, amount ON transactions
+        FOR EACH ROW EXECUTE FUNCTION maintain_monthly_rollups();
+    """)
+
+    # The generated search columns can only see this row, so they no longer include the category;
+    # search.py matches category names through the category tables instead
+    cur.execute("ALTER TABLE transactions DROP COLUMN IF EXISTS search_vector, DROP COLUMN IF EXISTS search_text;")
+    cur.execute("""
+        ALTER TABLE transactions
+        ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+            to_tsvector('simple', item || ' ' || coalesce(description, ''))
+        ) STORED,
+        ADD COLUMN search_text TEXT GENERATED ALWAYS AS (
+            lower(item || ' ' || coalesce(description, '') || ' ' || type || ' ' || transaction_id)
+        ) STORED;
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_transactions_search_vector ON transactions USING GIN (search_vector);")
+    _create_trigram_index(cur)
+
+    cur.execute("DROP INDEX IF EXISTS idx_transactions_type_category_date;")
+    cur.execute("DROP INDEX IF EXISTS idx_transactions_goal_savings;")
+    cur.execute("ALTER TABLE transactions DROP COLUMN category;")
+    # Report/category filters by id and date; also what the foreign keys check on category deletes
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_transactions_expense_category_date
+        ON transactions (expense_category_id, date) WHERE expense_category_id IS NOT NULL;
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_transactions_income_category_date
+        ON transactions (income_category_id, date) WHERE income_category_id IS NOT NULL;
+    """)
+    # Only Goal Savings rows carry a savings_goal_id
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_transactions_goal_savings
+        ON transactions (savings_goal_id) INCLUDE (amount)
+        WHERE savings_goal_id IS NOT NULL;
+    """)
+
+    # Unused category joins are removed by the planner, so reads that do not need the name cost nothing extra
+    cur.execute("""
+        CREATE OR REPLACE VIEW transactions_with_category AS
+        SELECT t.id, t.transaction_id, t.date, t.type, COALESCE(ec.name, ic.name) AS category,
+               t.item, t.amount, t.description, t.savings_goal_id,
+               COALESCE(t.expense_category_id, t.income_category_id) AS category_id,
+               COALESCE(ec.icon, ic.icon) AS category_icon,
+               t.expense_category_id, t.income_category_id, t.search_vector, t.search_text
+        FROM transactions t
+        LEFT JOIN expense_categories ec ON ec.id = t.expense_category_id
+        LEFT JOIN income_categories ic ON ic.id = t.income_category_id;
+    """)
+
+# Tables whose writes change what the reports/API return, and so bump ledger_version
+LEDGER_TABLES = ('transactions', 'savings_goals', 'expense_categories', 'income_categories', 'settings')
+
+def _create_ledger_version(cur):
+    """Creates the single-row ledger_version counter, bumped by a statement trigger on every ledger write."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS ledger_version (
+            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+            version BIGINT NOT NULL DEFAULT 0
+        );
+    """)
+    cur.execute("INSERT INTO ledger_version (id, version) VALUES (TRUE, 0) ON CONFLICT (id) DO NOTHING;")
+    cur.execute("""
+        CREATE OR REPLACE FUNCTION bump_ledger_version() RETURNS trigger AS $$
+        BEGIN
+            UPDATE ledger_version SET version = version + 1;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+    for table_name in LEDGER_TABLES:
+        # Statement-level, so a bulk import or rollup rebuild bumps the version once, not per row
+        cur.execute(f"DROP TRIGGER IF EXISTS trg_{table_name}_ledger_version ON {table_name};")
+        cur.execute(f"""
+            CREATE TRIGGER trg_{table_name}_ledger_version
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table_name}
+            FOR EACH STATEMENT EXECUTE FUNCTION bump_ledger_version();
         """)
-        pk_constraint = cur.fetchone()
-        if pk_constraint:
-            print(f"Dropping existing primary key constraint '{pk_constraint[0]}' from 'transactions' table...")
-            cur.execute(f"ALTER TABLE transactions DROP CONSTRAINT {pk_constraint[0]};")
-            conn.commit() # Commit this change immediately
-            print("Existing primary key constraint dropped.")
-        else:
-            print("No existing primary key constraint found on 'transactions' table.")
 
-        # 2. Add the new 'id' column as SERIAL PRIMARY KEY
-        print("Adding 'id' column as SERIAL PRIMARY KEY to 'transactions' table...")
-        cur.execute("ALTER TABLE transactions ADD COLUMN id SERIAL PRIMARY KEY;")
-        conn.commit()
-        print("Successfully added 'id' column as SERIAL PRIMARY KEY to 'transactions' table.")
 
-    except Exception as e:
-        print(f"Error during migration: {e}")
-        if conn:
+def _create_commit_time_version_bumps(cur):
+    """
+    Creates the machinery that bumps a version counter table once per writing transaction,
+    at its commit, instead of on every statement: a statement trigger on a source table
+    runs queue_version_bump('<counter table>'), which queues one row per transaction and
+    counter in pending_version_bumps; a deferred constraint trigger on that table then does
+    the UPDATEs just before the commit. The counter row is therefore only locked for the
+    instant of the commit, and the new version becomes visible together with the writes.
+    """
+    # UNLOGGED: its rows never outlive the transaction that queued them
+    cur.execute("CREATE UNLOGGED TABLE IF NOT EXISTS pending_version_bumps (counter TEXT NOT NULL);")
+    cur.execute("""
+        CREATE OR REPLACE FUNCTION queue_version_bump() RETURNS trigger AS $$
+        BEGIN
+            -- The transaction-local flag keeps later statements from queueing the same bump again
+            IF current_setting('budget.version_bump_queued_' || TG_ARGV[0], true) IS DISTINCT FROM 'on' THEN
+                PERFORM set_config('budget.version_bump_queued_' || TG_ARGV[0], 'on', true);
+                INSERT INTO pending_version_bumps (counter) VALUES (TG_ARGV[0]);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+    cur.execute("""
+        CREATE OR REPLACE FUNCTION apply_version_bumps() RETURNS trigger AS $$
+        DECLARE
+            counter_table TEXT;
+        BEGIN
+            -- The first firing applies every bump this transaction queued, in name order so two
+            -- committing transactions always lock the counters in the same order
+            FOR counter_table IN SELECT DISTINCT counter FROM pending_version_bumps ORDER BY counter LOOP
+                EXECUTE format('UPDATE %I SET version = version + 1', counter_table);
+            END LOOP;
+            DELETE FROM pending_version_bumps;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+    cur.execute("DROP TRIGGER IF EXISTS trg_pending_version_bumps_apply ON pending_version_bumps;")
+    cur.execute("""
+        CREATE CONSTRAINT TRIGGER trg_pending_version_bumps_apply
+        AFTER INSERT ON pending_version_bumps
+        DEFERRABLE INITIALLY DEFERRED
+        FOR EACH ROW EXECUTE FUNCTION apply_version_bumps();
+    """)
+
+def _bump_ledger_version_at_commit(cur):
+    """Moves the ledger_version triggers (migration 8) onto the commit-time bump."""
+    _create_commit_time_version_bumps(cur)
+    for table_name in LEDGER_TABLES:
+        cur.execute(f"DROP TRIGGER IF EXISTS trg_{table_name}_ledger_version ON {table_name};")
+        cur.execute(f"""
+            CREATE TRIGGER trg_{table_name}_ledger_version
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table_name}
+            FOR EACH STATEMENT EXECUTE FUNCTION queue_version_bump('ledger_version');
+        """)
+    cur.execute("DROP FUNCTION IF EXISTS bump_ledger_version();")
+
+def _create_users_version(cur):
+    """Creates the single-row users_version counter, bumped at commit by every write to users."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS users_version (
+            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+            version BIGINT NOT NULL DEFAULT 0
+        );
+    """)
+    cur.execute("INSERT INTO users_version (id, version) VALUES (TRUE, 0) ON CONFLICT (id) DO NOTHING;")
+    cur.execute("DROP TRIGGER IF EXISTS trg_users_users_version ON users;")
+    cur.execute("""
+        CREATE TRIGGER trg_users_users_version
+        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON users
+        FOR EACH STATEMENT EXECUTE FUNCTION queue_version_bump('users_version');
+    """)
+
+
+MIGRATIONS = [
+    (1, "transactions: id primary key", [
+        _add_transactions_id_column,
+    ]),
+    (2, "transactions: (date, id) index for listing and keyset paging", [
+        "CREATE INDEX IF NOT EXISTS idx_transactions_date_id ON transactions (date DESC, id DESC);",
+    ]),
+    (3, "transactions: generated search columns and tsvector index", [
+        """
+        ALTER TABLE transactions
+        ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+            to_tsvector('simple', item || ' ' || category || ' ' || coalesce(description, ''))
+        ) STORED;
+        """,
+        """
+        ALTER TABLE transactions
+        ADD COLUMN IF NOT EXISTS search_text TEXT GENERATED ALWAYS AS (
+            lower(item || ' ' || category || ' ' || coalesce(description, '') || ' ' || type || ' ' || transaction_id)
+        ) STORED;
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_transactions_search_vector ON transactions USING GIN (search_vector);",
+    ]),
+    (4, "transactions: trigram search index", [
+        _create_trigram_index,
+    ]),
+    (5, "transactions: report and savings goal indexes", [
+        # Report/category filters: WHERE type = ... AND category = ... AND date range
+        "CREATE INDEX IF NOT EXISTS idx_transactions_type_category_date ON transactions (type, category, date);",
+        # Savings goal recompute and per-goal lookups only ever look at Goal Savings rows
+        """
+        CREATE INDEX IF NOT EXISTS idx_transactions_goal_savings
+        ON transactions (savings_goal_id) INCLUDE (amount)
+        WHERE category = 'Goal Savings';
+        """,
+    ]),
+    (6, "transactions: unique transaction_id", [
+        _make_transaction_id_unique,
+    ]),
+    (7, "monthly_rollups table kept current by triggers", [
+        _create_monthly_rollups,
+    ]),
+    (8, "ledger_version change counter for ETags", [
+        _create_ledger_version,
+    ]),
+    (9, "report_cache table shared by app workers", [
+        # UNLOGGED: cheap writes, and losing it on a crash only costs recomputing some reports
+        """
+        CREATE UNLOGGED TABLE IF NOT EXISTS report_cache (
+            cache_key TEXT PRIMARY KEY,
+            ledger_version BIGINT NOT NULL,
+            payload BYTEA NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        """,
+    ]),
+    (10, "monthly_rollups trigger can be skipped for set-based rewrites", [
+        _make_rollup_trigger_skippable,
+    ]),
+    (11, "transactions: category text replaced by category id foreign keys", [
+        _normalize_transaction_categories,
+    ]),
+    (12, "outbox table for queued outgoing mail", [
+        """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id BIGSERIAL PRIMARY KEY,
+            sender TEXT,
+            recipients TEXT[] NOT NULL,
+            subject TEXT NOT NULL,
+            body TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'sent', 'failed')),
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            last_error TEXT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            sent_at TIMESTAMPTZ
+        );
+        """,
+        # The sender's claim query only ever looks at pending rows that are due
+        """
+        CREATE INDEX IF NOT EXISTS idx_outbox_pending
+        ON outbox (next_attempt_at) WHERE status = 'pending';
+        """,
+    ]),
+    (13, "ledger_version bumped once per transaction at commit", [
+        _bump_ledger_version_at_commit,
+    ]),
+    (14, "users_version change counter for the load_user cache", [
+        _create_users_version,
+    ]),
+]
+
+
+def _ensure_migrations_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+    """)
+
+def apply_migrations(conn):
+    """Applies every pending migration in order, one transaction per migration. Returns the versions applied."""
+    applied_now = []
+    for version, name, steps in MIGRATIONS:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_xact_lock(%s);", (MIGRATION_LOCK_KEY,))
+                _ensure_migrations_table(cur)
+                # Re-check under the lock: another worker may have just applied it
+                cur.execute("SELECT 1 FROM schema_migrations WHERE version = %s;", (version,))
+                if cur.fetchone():
+                    conn.commit()
+                    continue
+
+                print(f"Applying migration {version}: {name}...")
+                for step in steps:
+                    if callable(step):
+                        step(cur)
+                    else:
+                        cur.execute(step)
+                cur.execute(
+                    "INSERT INTO schema_migrations (version, name) VALUES (%s, %s);",
+                    (version, name)
+                )
+            conn.commit()
+            applied_now.append(version)
+        except Exception:
             conn.rollback()
+            raise
+    return applied_now
+
+def run_migration():
+    """Applies pending migrations using a pooled connection (`python migrate.py`)."""
+    conn = db.get_db_connection()
+    try:
+        applied = apply_migrations(conn)
+        if applied:
+            print(f"Applied migrations: {', '.join(str(v) for v in applied)}")
+        else:
+            print("Database schema is up to date.")
     finally:
-        if conn:
-            conn.close()
+        db.release_db_connection(conn)
 
 if __name__ == '__main__':
-    run_migration()
\ No newline at end of file
+    run_migration()
@@ -0,0 +1,220 @@
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from flask import current_app, has_app_context
+from werkzeug.security import generate_password_hash, check_password_hash
+import cache
+
+# Password hashing off the request thread.
+#
+# Hashing and verifying are deliberately slow and CPU-bound, so they run in a small process
+# pool (one per app process) instead of inline. At most PASSWORD_HASH_MAX_PENDING calls are
+# queued or running at a time. A burst of logins therefore waits for a slot, or is turned
+# away with HashingBusy, instead of taking every core from the other requests.
+#
+# Hashes use PASSWORD_HASH_METHOD (Werkzeug format, e.g. pbkdf2:sha256:1000000). A stored hash
+# made with another algorithm or a lower cost is replaced on the user's next successful login
+# (verify_and_update); one with a higher cost is kept as it is.
+#
+# check_rate_limit() throttles password attempts per client IP and per account. Its buckets are
+# per process, like cache.TTLCache, so with several gunicorn workers the effective limit is
+# a multiple of the configured one.
+
+# The existing users' hashes use 1,000,000 iterations; a lower default would weaken them on rehash
+PASSWORD_HASH_ITERATIONS = int(os.environ.get('PASSWORD_HASH_ITERATIONS', 1000000))
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', f'pbkdf2:sha256:{PASSWORD_HASH_ITERATIONS}')
+# 0 hashes inline on the request thread (still bounded by PASSWORD_HASH_MAX_PENDING)
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', min(2, os.cpu_count() or 1)))
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', max(PASSWORD_HASH_WORKERS, 1) * 4))
+# How long a call waits for a free slot before HashingBusy, and for its result once submitted
+PASSWORD_HASH_QUEUE_TIMEOUT = float(os.environ.get('PASSWORD_HASH_QUEUE_TIMEOUT', 5))
+PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 30))
+
+# Attempts per minute, and how many may come at once, per client IP and per account
+RATE_LIMIT_IP_PER_MINUTE = float(os.environ.get('PASSWORD_RATE_LIMIT_IP_PER_MINUTE', 30))
+RATE_LIMIT_IP_BURST = int(os.environ.get('PASSWORD_RATE_LIMIT_IP_BURST', 10))
+RATE_LIMIT_USER_PER_MINUTE = float(os.environ.get('PASSWORD_RATE_LIMIT_USER_PER_MINUTE', 10))
+RATE_LIMIT_USER_BURST = int(os.environ.get('PASSWORD_RATE_LIMIT_USER_BURST', 5))
+
+
+class HashingBusy(RuntimeError):
+    """
+    Raised when no hashing slot became free within PASSWORD_HASH_QUEUE_TIMEOUT, the result
+    took longer than PASSWORD_HASH_TIMEOUT, or the pool broke.
+    """
+
+
+class RateLimiter:
+    """
+    Token bucket per key: up to `burst` attempts back to back, refilled at `per_minute`.
+    Buckets live in a TTLCache that expires them once they would be full again, so at most
+    `maxsize` keys are tracked and idle ones cost nothing.
+    """
+
+    def __init__(self, per_minute, burst, maxsize=10000):
+        if per_minute <= 0 or burst < 1:
+            raise ValueError("per_minute must be positive and burst at least 1")
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._buckets = cache.TTLCache(maxsize=maxsize, ttl=burst / self.rate)
+        self.limited = 0
+
+    def hit(self, key):
+        """Takes one attempt from `key`'s bucket. Returns 0 if allowed, else the seconds until one is."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            if tokens < 1:
+                self.limited += 1
+                self._buckets.set(key, (tokens, now))
+                return (1 - tokens) / self.rate
+            self._buckets.set(key, (tokens - 1, now))
+            return 0
+
+
+ip_limiter = RateLimiter(RATE_LIMIT_IP_PER_MINUTE, RATE_LIMIT_IP_BURST)
+user_limiter = RateLimiter(RATE_LIMIT_USER_PER_MINUTE, RATE_LIMIT_USER_BURST)
+
+_slots = threading.BoundedSemaphore(PASSWORD_HASH_MAX_PENDING)
+_pool_lock = threading.Lock()
+_pool = None
+_pool_pid = None
+_stats_lock = threading.Lock()
+_stats = {'hashed': 0, 'verified': 0, 'rehashed': 0, 'busy': 0, 'pool_restarts': 0}
+
+
+def _logger():
+    return current_app.logger if has_app_context() else logging.getLogger(__name__)
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+def _get_pool():
+    """This process's hashing pool, started on first use (and again in each forked gunicorn worker)."""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            # forkserver/spawn children start clean instead of inheriting the app's threads and connections
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            _pool = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, mp_context=multiprocessing.get_context(method))
+            _pool_pid = os.getpid()
+        return _pool
+
+def _discard_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+    _count('pool_restarts')
+
+def _run(fn, *args):
+    """Runs fn(*args) in the pool, holding one of the PASSWORD_HASH_MAX_PENDING slots meanwhile."""
+    if not _slots.acquire(timeout=PASSWORD_HASH_QUEUE_TIMEOUT):
+        _count('busy')
+        raise HashingBusy("Too many password operations in progress; try again shortly.")
+    release_slot = True
+    try:
+        if PASSWORD_HASH_WORKERS <= 0:
+            return fn(*args)
+        pool = _get_pool()
+        try:
+            future = pool.submit(fn, *args)
+            return future.result(timeout=PASSWORD_HASH_TIMEOUT)
+        except FutureTimeoutError as e:
+            if not future.cancel():
+                # Already running, so it cannot be stopped: it keeps its slot until it finishes,
+                # and the pool never holds more than PASSWORD_HASH_MAX_PENDING calls
+                future.add_done_callback(lambda _: _slots.release())
+                release_slot = False
+            _logger().warning("Password hashing took over %ss; answering busy", PASSWORD_HASH_TIMEOUT)
+            _count('busy')
+            raise HashingBusy("Password hashing is overloaded; try again shortly.") from e
+        except BrokenProcessPool as e:
+            # A worker died (e.g. OOM-killed): start a fresh pool next time. Hashing inline instead
+            # would stall this request thread exactly when the server is most loaded.
+            _logger().error("Password hashing pool broke; it will be restarted: %s", e)
+            _discard_pool(pool)
+            _count('busy')
+            raise HashingBusy("Password hashing is restarting; try again shortly.") from e
+    finally:
+        if release_slot:
+            _slots.release()
+
+def hash_password(password):
+    """Hashes a password with PASSWORD_HASH_METHOD. Raises HashingBusy when the pool is saturated."""
+    _count('hashed')
+    return _run(generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+def verify_password(password_hash, password):
+    """Checks a password against a stored hash. Raises HashingBusy when the pool is saturated."""
+    _count('verified')
+    return _run(check_password_hash, password_hash, password)
+
+def _parse_method(method):
+    """
+    Splits a Werkzeug method string into (algorithm, cost parameters), e.g.
+    'pbkdf2:sha256:1000000' -> ('pbkdf2:sha256', (1000000,)), 'scrypt:32768:8:1' -> ('scrypt', (32768, 8, 1)).
+    """
+    parts = method.split(':')
+    algorithm = [part for part in parts if not part.isdigit()]
+    cost = tuple(int(part) for part in parts if part.isdigit())
+    return ':'.join(algorithm), cost
+
+def needs_rehash(password_hash):
+    """
+    True if the hash uses another algorithm than PASSWORD_HASH_METHOD, or a lower cost in any
+    parameter (a missing parameter counts as lower). A higher stored cost is never lowered.
+    """
+    stored_algorithm, stored_cost = _parse_method(password_hash.split('$', 1)[0])
+    algorithm, cost = _parse_method(PASSWORD_HASH_METHOD)
+    if stored_algorithm != algorithm:
+        return True
+    if len(stored_cost) < len(cost):
+        return True
+    return any(stored < wanted for stored, wanted in zip(stored_cost, cost))
+
+def verify_and_update(password_hash, password):
+    """
+    Checks a password and, when it matches a hash with outdated parameters, hashes it again.
+    Returns (valid, new_hash); new_hash is None unless the caller should store it.
+    """
+    if not verify_password(password_hash, password):
+        return False, None
+    if not needs_rehash(password_hash):
+        return True, None
+    try:
+        new_hash = hash_password(password)
+    except HashingBusy:
+        return True, None # The login still succeeds; the rehash waits for the next one
+    _count('rehashed')
+    return True, new_hash
+
+def check_rate_limit(ip, username=None):
+    """
+    Counts one password attempt against the client IP and, if given, the account name.
+    Returns 0 if it may go ahead, else the seconds to wait before retrying.
+    """
+    wait = ip_limiter.hit(f"ip:{ip}")
+    if wait or not username:
+        return wait
+    return user_limiter.hit(f"user:{username.lower()}")
+
+def stats():
+    with _stats_lock:
+        result = dict(_stats)
+    result.update({
+        'method': PASSWORD_HASH_METHOD,
+        'workers': PASSWORD_HASH_WORKERS,
+        'max_pending': PASSWORD_HASH_MAX_PENDING,
+        'rate_limited_ip': ip_limiter.limited,
+        'rate_limited_user': user_limiter.limited
+    })
+    return result
@@ -0,0 +1,59 @@
+import db
+
+# Server-side prepared statements for hot single-row lookups.
+#
+# Modules register their statements once at import time with register(); the first time a
+# pooled connection runs one, it is sent as PREPARE and from then on only EXECUTE travels
+# to the server, skipping the parse/plan step. Prepared statements live as long as the
+# connection (they survive commits and rollbacks), and the pool's connections remember
+# which ones they already hold in `conn.prepared`. Statements should name their columns
+# instead of using SELECT *, so a later schema change cannot alter their result type.
+
+_statements = {}
+
+
+def register(name, sql, arg_count=1):
+    """
+    Declares a prepared statement. `sql` uses $1, $2, ... placeholders.
+    Re-registering a name with different SQL raises ValueError.
+    """
+    existing = _statements.get(name)
+    if existing and existing != (sql, arg_count):
+        raise ValueError(f"Prepared statement '{name}' is already registered with different SQL")
+    _statements[name] = (sql, arg_count)
+
+def execute(cur, name, params=()):
+    """Runs a registered statement on `cur`, preparing it on the connection first if needed."""
+    sql, arg_count = _statements[name]
+    if len(params) != arg_count:
+        raise ValueError(f"Prepared statement '{name}' takes {arg_count} argument(s), got {len(params)}")
+
+    prepared = getattr(cur.connection, 'prepared', None)
+    if prepared is None:
+        # Not a pooled connection: nowhere to remember the statement, so run it plainly
+        cur.execute(_as_format_sql(sql, arg_count), {str(i): value for i, value in enumerate(params, 1)})
+        return
+    if name not in prepared:
+        cur.execute(f"PREPARE {name} AS {sql}")
+        prepared.add(name)
+    if arg_count:
+        cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * arg_count)})", params)
+    else:
+        cur.execute(f"EXECUTE {name}")
+
+def fetch_one(name, *params):
+    """Runs a registered statement on a pooled connection and returns its first row (or None)."""
+    conn = db.get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            execute(cur, name, params)
+            return cur.fetchone()
+    finally:
+        db.release_db_connection(conn)
+
+def _as_format_sql(sql, arg_count):
+    """Turns $n placeholders into psycopg2 %(n)s ones (highest first, so $1 never eats part of $10)."""
+    sql = sql.replace('%', '%%')
+    for position in range(arg_count, 0, -1):
+        sql = sql.replace(f"${position}", f"%({position})s")
+    return sql
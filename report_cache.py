@@ -0,0 +1,123 @@
+import os
+import pickle
+import threading
+import db
+import cache
+
+# Cache of budget.generate_report_data results.
+#
+# Entries are keyed on the resolved report range (period, start, end, engine) together with
+# the ledger version (budget.get_ledger_version), which every write to the ledger bumps, so
+# a cached report is never returned once its data changed and nothing has to be invalidated.
+#
+# REPORT_CACHE_BACKEND picks where reports are kept:
+#   'memory'   - a per-process LRU (the default)
+#   'postgres' - the same LRU in front of the UNLOGGED report_cache table, so every gunicorn
+#                worker can use a report another one computed
+#   'none'     - no caching
+
+REPORT_CACHE_BACKEND = os.environ.get('REPORT_CACHE_BACKEND', 'memory')
+# Rows kept in the report_cache table; the oldest are dropped beyond this
+REPORT_CACHE_SHARED_SIZE = int(os.environ.get('REPORT_CACHE_SHARED_SIZE', 256))
+
+local_cache = cache.TTLCache(
+    maxsize=int(os.environ.get('REPORT_CACHE_SIZE', 64)),
+    # Only bounds how long a report sits in memory; correctness comes from the ledger version
+    ttl=float(os.environ.get('REPORT_CACHE_TTL', 900))
+)
+
+_shared_lock = threading.Lock()
+_shared_hits = 0
+_shared_misses = 0
+
+
+def enabled():
+    return REPORT_CACHE_BACKEND in ('memory', 'postgres')
+
+def make_key(period, start_date, end_date, engine):
+    return f"{period}|{start_date.isoformat()}|{end_date.isoformat()}|{engine}"
+
+def _count_shared(hit):
+    global _shared_hits, _shared_misses
+    with _shared_lock:
+        if hit:
+            _shared_hits += 1
+        else:
+            _shared_misses += 1
+
+def _get_shared(key, ledger_version):
+    conn = db.get_db_connection(request_scoped=False)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT payload FROM report_cache WHERE cache_key = %s AND ledger_version = %s;",
+                (key, ledger_version)
+            )
+            row = cur.fetchone()
+    finally:
+        conn.rollback()
+        db.release_db_connection(conn)
+    _count_shared(row is not None)
+    # Only this app writes the table, so its pickles are trusted
+    return pickle.loads(row[0]) if row else None
+
+def _set_shared(key, ledger_version, report):
+    payload = pickle.dumps(report, protocol=pickle.HIGHEST_PROTOCOL)
+    # Own connection and transaction: a cache write must not join (or fail) the request's unit of work
+    conn = db.get_db_connection(request_scoped=False)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO report_cache (cache_key, ledger_version, payload)
+                VALUES (%s, %s, %s)
+                ON CONFLICT (cache_key) DO UPDATE
+                SET ledger_version = EXCLUDED.ledger_version, payload = EXCLUDED.payload, created_at = now()
+                WHERE report_cache.ledger_version <= EXCLUDED.ledger_version;
+                """,
+                (key, ledger_version, payload)
+            )
+            # Versions only go up, so entries for older ones can never be hit again
+            cur.execute("DELETE FROM report_cache WHERE ledger_version < %s;", (ledger_version,))
+            cur.execute(
+                """
+                DELETE FROM report_cache WHERE cache_key IN (
+                    SELECT cache_key FROM report_cache ORDER BY created_at DESC OFFSET %s
+                );
+                """,
+                (REPORT_CACHE_SHARED_SIZE,)
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        db.release_db_connection(conn)
+
+def lookup(key, ledger_version):
+    """The cached report for `key` at `ledger_version`, or None. Callers must not modify it."""
+    report = local_cache.get((key, ledger_version), None)
+    if report is None and REPORT_CACHE_BACKEND == 'postgres':
+        try:
+            report = _get_shared(key, ledger_version)
+        except Exception as e:
+            print(f"Report cache read failed, computing the report instead: {e}")
+            return None
+        if report is not None:
+            local_cache.set((key, ledger_version), report)
+    return report
+
+def store(key, ledger_version, report):
+    local_cache.set((key, ledger_version), report)
+    if REPORT_CACHE_BACKEND == 'postgres':
+        try:
+            _set_shared(key, ledger_version, report)
+        except Exception as e:
+            print(f"Report cache write failed: {e}")
+
+def stats():
+    result = {'backend': REPORT_CACHE_BACKEND, 'local': local_cache.stats()}
+    if REPORT_CACHE_BACKEND == 'postgres':
+        with _shared_lock:
+            result['shared'] = {'hits': _shared_hits, 'misses': _shared_misses, 'maxsize': REPORT_CACHE_SHARED_SIZE}
+    return result
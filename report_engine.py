@@ -0,0 +1,98 @@
+try:
+    import numpy as np
+except ImportError: # NumPy is optional; budget.generate_report_data falls back to SQL aggregation
+    np = None
+
+# Columnar report computation.
+#
+# generate_report_data already loads every transaction of the report window to list it.
+# With REPORT_ENGINE=numpy that same list is turned into NumPy columns (dates, amounts,
+# type/category/item codes) and the totals, income breakdown and monthly summaries are
+# computed with vectorized group-bys instead of separate aggregate queries.
+
+
+def available():
+    return np is not None
+
+def _columns(transactions):
+    """Splits Transaction rows into parallel NumPy arrays."""
+    count = len(transactions)
+    dates = np.array([t.date for t in transactions], dtype='datetime64[D]')
+    amounts = np.fromiter((t.amount for t in transactions), dtype=np.float64, count=count)
+    types = np.array([t.type for t in transactions], dtype=object)
+    categories = np.array([t.category for t in transactions], dtype=object)
+    items = np.array([t.item for t in transactions], dtype=object)
+    return dates, amounts, types, categories, items
+
+def _income_breakdown(dates, amounts, items):
+    """Income per item, most recently seen item first (as the SQL path orders it)."""
+    if not len(items):
+        return {}
+    names, codes = np.unique(items, return_inverse=True)
+    sums = np.bincount(codes, weights=amounts, minlength=len(names))
+    latest = np.full(len(names), np.iinfo(np.int64).min, dtype=np.int64)
+    np.maximum.at(latest, codes, dates.astype(np.int64))
+    order = np.argsort(-latest, kind='stable')
+    return {names[i]: float(sums[i]) for i in order}
+
+def _totals_by(labels, amounts):
+    """Sums amounts per distinct label. Returns {label: total}."""
+    if not len(labels):
+        return {}
+    names, codes = np.unique(labels, return_inverse=True)
+    sums = np.bincount(codes, weights=amounts, minlength=len(names))
+    return {name: float(total) for name, total in zip(names, sums)}
+
+def _monthly_summaries(dates, amounts, is_income, is_expense, is_savings):
+    months, codes = np.unique(dates.astype('datetime64[M]'), return_inverse=True)
+    income = np.bincount(codes, weights=np.where(is_income, amounts, 0.0), minlength=len(months))
+    expense = np.bincount(codes, weights=np.where(is_expense, amounts, 0.0), minlength=len(months))
+    savings = np.bincount(codes, weights=np.where(is_savings, amounts, 0.0), minlength=len(months))
+
+    summaries = []
+    for i, month in enumerate(months):
+        if income[i] > 0 or expense[i] > 0 or savings[i] > 0: # Only include months with data
+            summaries.append({
+                'month': str(month), # datetime64[M] prints as YYYY-MM
+                'total_income': float(income[i]),
+                'total_expense': float(expense[i]),
+                'total_savings': float(savings[i]),
+                'balance': float(income[i] - expense[i])
+            })
+    return summaries
+
+def summarize(transactions, monthly=False):
+    """
+    Computes a report's totals from its Transaction rows. Returns a dict with total_income,
+    total_expense, total_goal_savings, total_general_savings, income_breakdown_by_item,
+    expense_by_category and monthly_summaries (only filled when `monthly` is true, as for yearly reports).
+    Requires NumPy (see available()).
+    """
+    if not transactions:
+        return {
+            'total_income': 0,
+            'total_expense': 0,
+            'total_goal_savings': 0,
+            'total_general_savings': 0,
+            'income_breakdown_by_item': {},
+            'expense_by_category': {},
+            'monthly_summaries': []
+        }
+
+    dates, amounts, types, categories, items = _columns(transactions)
+    is_income = types == 'income'
+    is_expense = types == 'expense'
+    is_goal_savings = is_expense & (categories == 'Goal Savings')
+    is_general_savings = is_expense & (categories == 'General Savings')
+
+    return {
+        'total_income': float(amounts[is_income].sum()),
+        'total_expense': float(amounts[is_expense].sum()),
+        'total_goal_savings': float(amounts[is_goal_savings].sum()),
+        'total_general_savings': float(amounts[is_general_savings].sum()),
+        'income_breakdown_by_item': _income_breakdown(dates[is_income], amounts[is_income], items[is_income]),
+        'expense_by_category': _totals_by(categories[is_expense], amounts[is_expense]),
+        'monthly_summaries': _monthly_summaries(
+            dates, amounts, is_income, is_expense, is_goal_savings | is_general_savings
+        ) if monthly else []
+    }
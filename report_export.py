@@ -0,0 +1,367 @@
+import csv
+import io
+import math
+import os
+import zlib
+from datetime import timedelta
+from itertools import chain
+import cache
+import export
+
+# Server-side report downloads (PDF and CSV) built from generate_report_data output.
+#
+# Both formats are produced as a generator of bytes chunks: the CSV in export.CHUNK_BYTES
+# pieces, the PDF one page at a time (summary pages first, then the transactions table),
+# so the response starts flowing before the last page is laid out. The PDF is written
+# directly (PDF 1.4, the built-in Helvetica fonts, vector pie chart); nothing is rendered
+# in the browser and no PDF library is needed.
+#
+# Finished artifacts are cached per process, keyed on the format, the requested period,
+# the resolved date range and the ledger version (budget.get_ledger_version). Any write to
+# the ledger bumps the version, so a cached file is never served once its data changed.
+
+REPORT_EXPORT_FORMATS = {
+    'pdf': 'application/pdf',
+    'csv': 'text/csv',
+}
+TRANSACTION_HEADERS = ['Date', 'Type', 'Category', 'Item', 'Description', 'Amount']
+
+# Artifacts larger than this are streamed but not kept
+MAX_CACHED_BYTES = int(os.environ.get('REPORT_EXPORT_CACHE_MAX_BYTES', 8 * 2**20))
+artifact_cache = cache.TTLCache(
+    maxsize=int(os.environ.get('REPORT_EXPORT_CACHE_SIZE', 32)),
+    ttl=float(os.environ.get('REPORT_EXPORT_CACHE_TTL', 3600))
+)
+
+# A4 in points
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842
+MARGIN = 40
+PAGE_TOP = PAGE_HEIGHT - MARGIN
+ROW_HEIGHT = 14
+# Transactions table: (header, width in points); the widths add up to PAGE_WIDTH - 2 * MARGIN
+TABLE_COLUMNS = list(zip(TRANSACTION_HEADERS, [60, 45, 80, 90, 180, 60]))
+TABLE_FONT_SIZE = 8
+
+BLACK = (0, 0, 0)
+GREY = (0.45, 0.45, 0.45)
+GREEN = (0, 0.5, 0)
+RED = (1, 0, 0)
+BLUE = (0, 0, 1)
+PURPLE = (0.5, 0, 0.5)
+ORANGE = (1, 0.65, 0)
+# Same palette as the report page's pie chart
+CHART_COLORS = [
+    '#0d6efd', '#6610f2', '#6f42c1', '#d63384', '#dc3545',
+    '#fd7e14', '#ffc107', '#198754', '#20c997', '#0dcaf0',
+    '#6c757d', '#adb5bd'
+]
+
+# Helvetica advance widths (per 1000 em) of the characters amounts are made of, to right-align them
+AMOUNT_CHAR_WIDTHS = {'.': 278, ',': 278, ' ': 278, '-': 333}
+
+
+def _check_format(fmt):
+    if fmt not in REPORT_EXPORT_FORMATS:
+        raise ValueError(f"Unknown format '{fmt}'. Choose one of: {', '.join(REPORT_EXPORT_FORMATS)}")
+
+def cache_key(fmt, period, range_start, range_end, ledger_version):
+    return (fmt, period, range_start, range_end, ledger_version)
+
+def cached_artifact(key):
+    """The cached bytes for `key`, or None."""
+    return artifact_cache.get(key, None)
+
+def export_filename(range_start, range_end, fmt):
+    """File name for a report over the half-open [range_start, range_end) date range."""
+    _check_format(fmt)
+    return f"budget_report_{range_start}_{range_end - timedelta(days=1)}.{fmt}"
+
+def _money(amount):
+    return f"$ {amount:,.2f}"
+
+# --- CSV ---
+
+def _iter_csv(report):
+    """Yields the report as CSV text: a summary block, then one row per transaction."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(['Budget Report', report['period'], report['start_date'], report['end_date']])
+    writer.writerow([])
+    for label, key in (('Total income', 'total_income'), ('Total expense', 'total_expense'),
+                       ('Balance', 'balance'), ('Goal savings', 'total_goal_savings'),
+                       ('General savings', 'total_general_savings'), ('Total budget', 'total_budget'),
+                       ('Savings goal', 'savings_goal'), ('Remaining to spend', 'remaining_spending')):
+        if key in report:
+            writer.writerow([label, f"{report[key]:.2f}"])
+    writer.writerow([])
+    writer.writerow(['Expense category', 'Amount'])
+    for entry in report['expense_breakdown_by_category']:
+        writer.writerow([entry['category'], f"{entry['amount']:.2f}"])
+    writer.writerow([])
+    writer.writerow(TRANSACTION_HEADERS)
+
+    for t in report['transactions']:
+        writer.writerow([t.date.isoformat(), t.type, t.category, t.item, t.description or '', f"{t.amount:.2f}"])
+        if buffer.tell() >= export.CHUNK_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+# --- PDF ---
+
+def _pdf_string(text):
+    """Encodes text as a PDF literal string body (WinAnsi, unknown characters replaced)."""
+    data = str(text).replace('\r', ' ').replace('\n', ' ').encode('cp1252', 'replace')
+    return data.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+
+def _fit(text, width, size):
+    """Cuts text so it fits roughly into `width` points (Helvetica averages about half an em per character)."""
+    text = str(text or '')
+    max_chars = int(width / (size * 0.5))
+    return text if len(text) <= max_chars else text[:max_chars - 3] + '...'
+
+def _amount_width(text, size):
+    return sum(AMOUNT_CHAR_WIDTHS.get(char, 556) for char in text) * size / 1000
+
+def _hex_color(value):
+    return tuple(int(value[i:i + 2], 16) / 255 for i in (1, 3, 5))
+
+
+class _Page:
+    """Drawing operations of one page, in PDF user space (origin bottom left)."""
+
+    def __init__(self):
+        self.ops = []
+
+    def text(self, x, y, text, size=10, bold=False, color=BLACK):
+        self.ops.append(b'BT /%s %g Tf %g %g %g rg %.2f %.2f Td (%s) Tj ET'
+                        % (b'F2' if bold else b'F1', size, *color, x, y, _pdf_string(text)))
+
+    def amount(self, right, y, text, size=10, bold=False, color=BLACK):
+        """Draws text right-aligned at `right` (for amounts)."""
+        self.text(right - _amount_width(text, size), y, text, size, bold, color)
+
+    def rect(self, x, y, width, height, color):
+        self.ops.append(b'%g %g %g rg %.2f %.2f %.2f %.2f re f' % (*color, x, y, width, height))
+
+    def line(self, x1, y1, x2, y2, color=GREY):
+        self.ops.append(b'%g %g %g RG 0.5 w %.2f %.2f m %.2f %.2f l S' % (*color, x1, y1, x2, y2))
+
+    def wedge(self, cx, cy, radius, start, end, color):
+        """A filled pie slice between two angles (radians, counter-clockwise), drawn with Bezier arcs."""
+        path = [b'%g %g %g rg %.2f %.2f m' % (*color, cx, cy),
+                b'%.2f %.2f l' % (cx + radius * math.cos(start), cy + radius * math.sin(start))]
+        segments = max(1, math.ceil((end - start) / (math.pi / 2)))
+        step = (end - start) / segments
+        k = 4 / 3 * math.tan(step / 4) * radius
+        for i in range(segments):
+            a0, a1 = start + i * step, start + (i + 1) * step
+            path.append(b'%.2f %.2f %.2f %.2f %.2f %.2f c' % (
+                cx + radius * math.cos(a0) - k * math.sin(a0), cy + radius * math.sin(a0) + k * math.cos(a0),
+                cx + radius * math.cos(a1) + k * math.sin(a1), cy + radius * math.sin(a1) - k * math.cos(a1),
+                cx + radius * math.cos(a1), cy + radius * math.sin(a1)))
+        path.append(b'h f')
+        self.ops.append(b' '.join(path))
+
+    def content(self, number):
+        self.text(PAGE_WIDTH - MARGIN - 40, MARGIN / 2, f"Page {number}", size=8, color=GREY)
+        return b'\n'.join(self.ops)
+
+
+def _summary_pages(report):
+    """Yields the summary: totals, monthly budget, expense pie chart, income breakdown, monthly summaries."""
+    page = _Page()
+    y = PAGE_TOP - 20
+    page.text(MARGIN, y, 'Budget Report', size=20, bold=True)
+    y -= 22
+    page.text(MARGIN, y, f"{report['period'].replace('_', ' ').capitalize()} report: "
+                         f"{report['start_date']} to {report['end_date']}", size=11, color=GREY)
+    y -= 34
+
+    totals = [('Period income', report['total_income'], GREEN),
+              ('Period expense', report['total_expense'], RED),
+              ('Period balance', report['balance'], BLUE),
+              ('Goal savings', report['total_goal_savings'], PURPLE),
+              ('General savings', report['total_general_savings'], ORANGE)]
+    if 'total_budget' in report:
+        totals += [('Total budget', report['total_budget'], BLACK),
+                   ('Savings goal', report['savings_goal'], BLACK),
+                   ('Remaining to spend', report['remaining_spending'],
+                    GREEN if report['remaining_spending'] >= 0 else RED)]
+    for label, amount, color in totals:
+        page.text(MARGIN, y, label, size=11)
+        page.amount(MARGIN + 250, y, _money(amount), size=11, bold=True, color=color)
+        y -= 18
+
+    breakdown = [entry for entry in report['expense_breakdown_by_category'] if entry['amount'] > 0]
+    total_expense = sum(entry['amount'] for entry in breakdown)
+    if total_expense > 0:
+        y -= 16
+        page.text(MARGIN, y, 'Expenses by category', size=13, bold=True)
+        radius = 90
+        cy = y - 20 - radius
+        cx = MARGIN + radius
+        angle = math.pi / 2
+        legend_y = y - 30
+        for i, entry in enumerate(breakdown):
+            color = _hex_color(CHART_COLORS[i % len(CHART_COLORS)])
+            share = entry['amount'] / total_expense
+            # Clockwise from 12 o'clock, like the chart on the report page
+            page.wedge(cx, cy, radius, angle - share * 2 * math.pi, angle, color)
+            angle -= share * 2 * math.pi
+            page.rect(MARGIN + 2 * radius + 30, legend_y - 1, 8, 8, color)
+            page.text(MARGIN + 2 * radius + 44, legend_y, _fit(entry['category'], 130, 9), size=9)
+            page.amount(PAGE_WIDTH - MARGIN - 45, legend_y, _money(entry['amount']), size=9)
+            page.amount(PAGE_WIDTH - MARGIN, legend_y, f"{share * 100:.1f}%", size=9, color=GREY)
+            legend_y -= ROW_HEIGHT
+        y = min(cy - radius, legend_y) - 10
+
+    sections = []
+    if report['income_breakdown_by_item']:
+        sections.append(('Income by item', [(item, _money(amount))
+                                            for item, amount in report['income_breakdown_by_item'].items()]))
+    if report['monthly_summaries']:
+        sections.append(('Monthly summary (income / expense / savings / balance)', [
+            (month['month'], '  '.join(_money(month[key]) for key in
+                                       ('total_income', 'total_expense', 'total_savings', 'balance')))
+            for month in report['monthly_summaries']]))
+
+    for title, rows in sections:
+        if y < MARGIN + 3 * ROW_HEIGHT:
+            yield page
+            page, y = _Page(), PAGE_TOP
+        y -= 16
+        page.text(MARGIN, y, title, size=13, bold=True)
+        y -= 20
+        for label, value in rows:
+            if y < MARGIN:
+                yield page
+                page, y = _Page(), PAGE_TOP
+            page.text(MARGIN, y, _fit(label, 200, 10), size=10)
+            page.amount(PAGE_WIDTH - MARGIN, y, value, size=10)
+            y -= ROW_HEIGHT
+    yield page
+
+def _table_header(page, y):
+    page.rect(MARGIN, y - 4, PAGE_WIDTH - 2 * MARGIN, ROW_HEIGHT, (0.78, 0.78, 0.78))
+    x = MARGIN
+    for header, width in TABLE_COLUMNS:
+        if header == 'Amount':
+            page.amount(x + width - 3, y, header, size=TABLE_FONT_SIZE, bold=True)
+        else:
+            page.text(x + 3, y, header, size=TABLE_FONT_SIZE, bold=True)
+        x += width
+
+def _transaction_pages(report):
+    """Yields the transactions table, as many rows per page as fit, with the header repeated on each page."""
+    transactions = report['transactions']
+    page = _Page()
+    y = PAGE_TOP - 14
+    page.text(MARGIN, y, 'All Transactions', size=14, bold=True)
+    y -= 24
+    _table_header(page, y)
+    y -= ROW_HEIGHT
+
+    for index, t in enumerate(transactions):
+        if y < MARGIN:
+            yield page
+            page, y = _Page(), PAGE_TOP - 10
+            _table_header(page, y)
+            y -= ROW_HEIGHT
+        if index % 2:
+            page.rect(MARGIN, y - 4, PAGE_WIDTH - 2 * MARGIN, ROW_HEIGHT, (0.95, 0.95, 0.95))
+        values = [t.date.isoformat(), t.type.capitalize(), t.category, t.item, t.description]
+        x = MARGIN
+        for value, (_, width) in zip(values, TABLE_COLUMNS):
+            page.text(x + 3, y, _fit(value, width - 6, TABLE_FONT_SIZE), size=TABLE_FONT_SIZE)
+            x += width
+        color = RED if t.type == 'expense' else GREEN if t.type == 'income' else BLACK
+        page.amount(PAGE_WIDTH - MARGIN - 3, y, _money(t.amount), size=TABLE_FONT_SIZE, color=color)
+        y -= ROW_HEIGHT
+    if not transactions:
+        page.text(MARGIN + 3, y, 'No transactions in this period.', size=TABLE_FONT_SIZE, color=GREY)
+    yield page
+
+
+class _PdfObjects:
+    """Hands out object numbers and records each object's byte offset as it is written out."""
+
+    def __init__(self, position, reserved):
+        self.position = position
+        self.offsets = [None] * (reserved + 1) # index 0 is the free-list head
+
+    def reserve(self):
+        self.offsets.append(None)
+        return len(self.offsets) - 1
+
+    def write(self, number, body):
+        data = b'%d 0 obj\n%s\nendobj\n' % (number, body)
+        self.offsets[number] = self.position
+        self.position += len(data)
+        return data
+
+    def trailer(self, root):
+        entries = [b'0000000000 65535 f '] + [b'%010d 00000 n ' % offset for offset in self.offsets[1:]]
+        return (b'xref\n0 %d\n' % len(self.offsets) + b'\n'.join(entries) + b'\n'
+                + b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n'
+                % (len(self.offsets), root, self.position))
+
+def _iter_pdf(report):
+    """
+    Yields the report as a PDF, one page per chunk. The page tree and catalog go last,
+    once the page count is known; readers find them through the trailer.
+    """
+    header = b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n'
+    # 1: catalog, 2: page tree, 3/4: regular/bold font
+    objects = _PdfObjects(len(header), reserved=4)
+    yield (header
+           + objects.write(3, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>')
+           + objects.write(4, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>'))
+
+    page_ids = []
+    for number, page in enumerate(chain(_summary_pages(report), _transaction_pages(report)), 1):
+        content = zlib.compress(page.content(number))
+        content_id, page_id = objects.reserve(), objects.reserve()
+        page_ids.append(page_id)
+        yield (objects.write(content_id, b'<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream'
+                             % (len(content), content))
+               + objects.write(page_id, b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] '
+                                        b'/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents %d 0 R >>'
+                               % (PAGE_WIDTH, PAGE_HEIGHT, content_id)))
+
+    kids = b' '.join(b'%d 0 R' % page_id for page_id in page_ids)
+    yield (objects.write(2, b'<< /Type /Pages /Kids [%s] /Count %d >>' % (kids, len(page_ids)))
+           + objects.write(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+           + objects.trailer(root=1))
+
+# --- Streaming and caching ---
+
+def _cache_when_complete(key, chunks):
+    """Passes chunks through, and caches the whole artifact once the last one was sent (if small enough)."""
+    kept, size = [], 0
+    for chunk in chunks:
+        if kept is not None:
+            size += len(chunk)
+            if size <= MAX_CACHED_BYTES:
+                kept.append(chunk)
+            else:
+                kept = None
+        yield chunk
+    # Not reached when the client disconnects early, so partial files are never cached
+    if kept is not None:
+        artifact_cache.set(key, b''.join(kept))
+
+def iter_report(report, fmt, key=None):
+    """
+    Streams a generate_report_data result as a PDF or CSV file. Returns a generator of
+    bytes chunks; with a `key` (see cache_key), the finished file is also cached under it.
+    Raises ValueError for an unknown format.
+    """
+    _check_format(fmt)
+    if fmt == 'pdf':
+        chunks = _iter_pdf(report)
+    else:
+        chunks = (text.encode('utf-8') for text in _iter_csv(report))
+    return _cache_when_complete(key, chunks) if key is not None else chunks
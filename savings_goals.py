@@ -3,6 +3,9 @@ import json
 import os
 from datetime import datetime
 import db
+import queries
+
+queries.register('savings_goal_by_id', "SELECT id, name, target_amount, saved_amount FROM savings_goals WHERE id = $1")
 
 
 
@@ -28,23 +31,14 @@ def get_savings_goals():
 
 def get_savings_goal(goal_id):
     """Retrieves a single savings goal by its ID from the database."""
-    conn = db.get_db_connection()
-    try:
-        with conn.cursor() as cur:
-            cur.execute(
-                "SELECT id, name, target_amount, saved_amount FROM savings_goals WHERE id = %s;",
-                (goal_id,)
-            )
-            row = cur.fetchone()
-            if row:
-                return {
-                    'id': str(row[0]),
-                    'name': row[1],
-                    'target_amount': float(row[2]),
-                    'saved_amount': float(row[3])
-                }
-    finally:
-        db.release_db_connection(conn)
+    row = queries.fetch_one('savings_goal_by_id', goal_id)
+    if row:
+        return {
+            'id': str(row[0]),
+            'name': row[1],
+            'target_amount': float(row[2]),
+            'saved_amount': float(row[3])
+        }
     return None
 
 def add_savings_goal(name, target_amount):
@@ -57,7 +51,7 @@ def add_savings_goal(name, target_amount):
                 (name, target_amount, 0.0)
             )
             new_id = cur.fetchone()[0]
-            conn.commit()
+            db.commit(conn)
             return {
                 'id': str(new_id),
                 'name': name,
@@ -76,7 +70,7 @@ def update_savings_goal(goal_id, name, target_amount):
                 "UPDATE savings_goals SET name = %s, target_amount = %s WHERE id = %s;",
                 (name, target_amount, goal_id)
             )
-            conn.commit()
+            db.commit(conn)
     finally:
         db.release_db_connection(conn)
 
@@ -86,7 +80,7 @@ def delete_savings_goal(goal_id):
     try:
         with conn.cursor() as cur:
             cur.execute("DELETE FROM savings_goals WHERE id = %s;", (goal_id,))
-            conn.commit()
+            db.commit(conn)
     finally:
         db.release_db_connection(conn)
 
@@ -99,34 +93,41 @@ def update_saved_amount(goal_id, amount):
                 "UPDATE savings_goals SET saved_amount = saved_amount + %s WHERE id = %s;",
                 (amount, goal_id)
             )
-            conn.commit()
+            db.commit(conn)
     finally:
         db.release_db_connection(conn)
 
-def recalculate_saved_amounts(transactions):
-    """Recalculates all saved amounts in the database based on transactions."""
+def recalculate_saved_amounts():
+    """
+    Recalculates all saved amounts in the database from the transactions table.
+    saved_amount is kept current incrementally by budget.add/update/delete_transaction,
+    so this is only a reconcile job (admin route / `flask reconcile-savings-goals`).
+    Returns the number of goals whose saved_amount was corrected.
+    """
     conn = db.get_db_connection()
     try:
         with conn.cursor() as cur:
-            # 1. Reset all saved_amounts to 0
-            cur.execute("UPDATE savings_goals SET saved_amount = 0.0;")
-
-            # 2. Recalculate based on transactions (only Goal Savings expenses)
-            # Group by savings_goal_id and sum amounts
+            # Rebuild every goal from the Goal Savings expenses linked to it,
+            # touching only the rows whose stored amount has drifted
             cur.execute(
                 """
                 UPDATE savings_goals sg
-                SET saved_amount = sg.saved_amount + sub.total_saved
-                FROM (
-                    SELECT CAST(savings_goal_id AS INTEGER) as goal_id, SUM(amount) AS total_saved
+                SET saved_amount = COALESCE(sub.total_saved, 0.0)
+                FROM savings_goals g
+                LEFT JOIN (
+                    SELECT savings_goal_id AS goal_id, SUM(amount) AS total_saved
                     FROM transactions
-                    WHERE type = 'expense' AND category = 'Goal Savings' AND savings_goal_id IS NOT NULL
+                    WHERE expense_category_id = (SELECT id FROM expense_categories WHERE name = 'Goal Savings')
+                      AND savings_goal_id IS NOT NULL
                     GROUP BY savings_goal_id
-                ) AS sub
-                WHERE sg.id = sub.goal_id;
+                ) AS sub ON sub.goal_id = g.id
+                WHERE sg.id = g.id
+                  AND sg.saved_amount IS DISTINCT FROM COALESCE(sub.total_saved, 0.0);
                 """
             )
-            conn.commit()
+            corrected = cur.rowcount
+            db.commit(conn)
+            return corrected
     finally:
         db.release_db_connection(conn)
 
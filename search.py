@@ -0,0 +1,147 @@
+import re
+import shlex
+from datetime import datetime, timedelta
+
+# Search is answered by the database using two generated columns on `transactions`
+# (created in migrate.py, migrations 3 and 4): `search_vector`, a 'simple' tsvector over
+# item/description behind a GIN index, and `search_text`, the lowercased
+# item/description/type/transaction_id text behind a pg_trgm GIN index for substring matches. Categories are stored as ids (see
+# migrate.py, migration 11), so category names are matched in the category tables and
+# the resulting ids compared against expense_category_id / income_category_id.
+#
+# Besides free text, a query may contain structured filters:
+#   amount>50  amount<=20  amount=9.99  amount:9.99
+#   category:Food  type:income  item:coffee  description:"team lunch"
+#   date:2025-01  date:2025-01-31  date>=2025-01-01  date<2025-02-01
+
+FILTER_PATTERN = re.compile(r'^(amount|date|category|type|item|description)(>=|<=|>|<|=|:)(.+)$', re.IGNORECASE)
+DATE_PREFIX_PATTERN = re.compile(r'^\d{4}(-\d{2}){0,2}$')
+NUMBER_PATTERN = re.compile(r'^-?\d+(\.\d+)?$')
+
+COMPARISON_OPERATORS = {'>': '>', '<': '<', '>=': '>=', '<=': '<=', '=': '=', ':': '='}
+
+# Matches rows whose category name satisfies `{condition}` (one %s for each category table)
+CATEGORY_MATCH_SQL = (
+    "(expense_category_id = ANY(ARRAY(SELECT id FROM expense_categories WHERE {condition}))"
+    " OR income_category_id = ANY(ARRAY(SELECT id FROM income_categories WHERE {condition})))"
+)
+
+
+def _like_pattern(text):
+    """Wraps text in % wildcards for a LIKE substring match, escaping LIKE metacharacters."""
+    escaped = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"%{escaped}%"
+
+def _date_prefix_range(value):
+    """Turns 'YYYY', 'YYYY-MM' or 'YYYY-MM-DD' into a half-open (start, end) date range, or None."""
+    if not DATE_PREFIX_PATTERN.match(value):
+        return None
+    parts = [int(part) for part in value.split('-')]
+    try:
+        if len(parts) == 1:
+            return datetime(parts[0], 1, 1).date(), datetime(parts[0] + 1, 1, 1).date()
+        if len(parts) == 2:
+            start = datetime(parts[0], parts[1], 1).date()
+            next_month = (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+            return start, next_month
+        start = datetime(parts[0], parts[1], parts[2]).date()
+        return start, start + timedelta(days=1)
+    except ValueError:
+        return None
+
+def _tokenize(search_query):
+    try:
+        return shlex.split(search_query)
+    except ValueError: # Unbalanced quotes; fall back to plain whitespace splitting
+        return search_query.split()
+
+def parse_search_query(search_query):
+    """
+    Splits a search string into structured filters and free-text terms.
+    Returns (filters, terms) where filters is a list of (field, operator, value).
+    Tokens that look like filters but carry an unusable value are treated as free text.
+    """
+    filters = []
+    terms = []
+    for token in _tokenize(search_query or ''):
+        match = FILTER_PATTERN.match(token)
+        if not match:
+            terms.append(token)
+            continue
+
+        field, operator, value = match.group(1).lower(), match.group(2), match.group(3).strip()
+        if field == 'amount' and NUMBER_PATTERN.match(value):
+            filters.append((field, COMPARISON_OPERATORS[operator], value))
+        elif field == 'date' and operator in (':', '=') and _date_prefix_range(value):
+            filters.append((field, '=', value))
+        elif field == 'date' and operator not in (':', '='):
+            try:
+                filters.append((field, operator, datetime.strptime(value, '%Y-%m-%d').date()))
+            except ValueError:
+                terms.append(token)
+        elif field in ('category', 'type', 'item', 'description') and operator == ':':
+            filters.append((field, operator, value))
+        else:
+            terms.append(token)
+    return filters, terms
+
+def build_search_filter(search_query):
+    """
+    Compiles a search string into SQL for the transactions table (or the transactions_with_category view).
+    Returns (where_sql, where_params, rank_sql, rank_params). where_sql is a
+    parenthesised boolean expression ('TRUE' for an empty query) and rank_sql an
+    expression to sort by (higher is more relevant).
+    """
+    filters, terms = parse_search_query(search_query)
+    clauses = []
+    params = []
+
+    for field, operator, value in filters:
+        if field == 'amount':
+            clauses.append(f"amount {operator} %s")
+            params.append(value)
+        elif field == 'date' and operator == '=':
+            start, end = _date_prefix_range(value)
+            clauses.append("(date >= %s AND date < %s)")
+            params.extend([start, end])
+        elif field == 'date':
+            clauses.append(f"date {operator} %s")
+            params.append(value)
+        elif field == 'category':
+            # Exact, case-insensitive match on the whole value
+            clauses.append(CATEGORY_MATCH_SQL.format(condition="lower(name) = lower(%s)"))
+            params.extend([value, value])
+        elif field == 'type':
+            clauses.append("lower(type) = lower(%s)")
+            params.append(value)
+        else:
+            clauses.append(f"{field} ILIKE %s")
+            params.append(_like_pattern(value))
+
+    for term in terms:
+        # Word match through the tsvector index or substring match through the trigram index
+        term_clauses = [
+            "search_vector @@ plainto_tsquery('simple', %s)",
+            "search_text LIKE %s",
+            CATEGORY_MATCH_SQL.format(condition="lower(name) LIKE %s")
+        ]
+        term_pattern = _like_pattern(term.lower())
+        term_params = [term, term_pattern, term_pattern, term_pattern]
+        if NUMBER_PATTERN.match(term):
+            term_clauses.append("amount = %s")
+            term_params.append(term)
+        date_range = _date_prefix_range(term)
+        if date_range:
+            term_clauses.append("(date >= %s AND date < %s)")
+            term_params.extend(date_range)
+        clauses.append(f"({' OR '.join(term_clauses)})")
+        params.extend(term_params)
+
+    where_sql = f"({' AND '.join(clauses)})" if clauses else "TRUE"
+    if terms:
+        rank_sql = "ts_rank(search_vector, plainto_tsquery('simple', %s))"
+        rank_params = [' '.join(terms)]
+    else:
+        rank_sql = "0::real" # An expression: a bare 0 would read as an ORDER BY column position
+        rank_params = []
+    return where_sql, params, rank_sql, rank_params
@@ -1,97 +1,287 @@
-import json
+import copy
 import os
+import threading
+import time
 import db
+from psycopg2.extras import execute_values
 
 DEFAULT_MONTHLY_SAVINGS_GOAL = 100.0
 
-def _get_db_categories(table_name):
+# Bumped on every settings/category write so each gunicorn worker can tell its cache is stale
+SETTINGS_VERSION_KEY = 'settings_version'
+# Seconds a worker serves cached settings before re-checking the shared version stamp
+SETTINGS_VERSION_CHECK_INTERVAL = float(os.environ.get('SETTINGS_VERSION_CHECK_INTERVAL', 5))
+
+_cache_lock = threading.Lock()
+_cached_settings = None
+_cached_version = None
+_last_version_check = 0.0
+
+# Category kind (the transactions.type it applies to) -> table, for add/rename/delete
+CATEGORY_TABLES = {
+    'expense': 'expense_categories',
+    'income': 'income_categories',
+}
+# Category table -> the transactions column referencing it (see migrate.py, migration 11)
+CATEGORY_ID_COLUMNS = {
+    'expense_categories': 'expense_category_id',
+    'income_categories': 'income_category_id',
+}
+# Categories the app relies on by name (savings goal tracking); they cannot be renamed
+BUILT_IN_CATEGORIES = ('Goal Savings', 'General Savings')
+
+def _fetch_categories(cur, table_name):
     categories = []
     category_icons = {}
+    cur.execute(f"SELECT name, icon FROM {table_name} ORDER BY name;")
+    for row in cur.fetchall():
+        categories.append(row[0])
+        category_icons[row[0]] = row[1]
+    return categories, category_icons
+
+def _get_db_categories(table_name):
     conn = db.get_db_connection()
     try:
         with conn.cursor() as cur:
-            cur.execute(f"SELECT name, icon FROM {table_name} ORDER BY name;")
-            for row in cur.fetchall():
-                categories.append(row[0])
-                category_icons[row[0]] = row[1]
+            return _fetch_categories(cur, table_name)
     finally:
         db.release_db_connection(conn)
-    return categories, category_icons
 
-def _save_db_categories(table_name, categories_data):
+def _bump_settings_version(cur):
+    """Increments the shared settings version stamp inside the caller's transaction."""
+    cur.execute(
+        """
+        INSERT INTO settings (key, value) VALUES (%s, '1')
+        ON CONFLICT (key) DO UPDATE SET value = (settings.value::bigint + 1)::text;
+        """,
+        (SETTINGS_VERSION_KEY,)
+    )
+
+def invalidate_settings_cache():
+    """Drops this process's cached settings so the next get_settings() reloads them."""
+    global _cached_settings, _cached_version
+    with _cache_lock:
+        _cached_settings = None
+        _cached_version = None
+
+def _diff_categories(current, desired):
+    """Compares two {name: icon} maps. Returns (inserts, icon updates, deleted names)."""
+    inserts = [(name, icon) for name, icon in desired.items() if name not in current]
+    updates = [(name, icon) for name, icon in desired.items() if name in current and current[name] != icon]
+    deletes = [name for name in current if name not in desired]
+    return inserts, updates, deletes
+
+def _categories_in_use(cur, table_name, names):
+    """
+    Those of `names` that still have transactions filed under them. The caller must hold the
+    category rows FOR UPDATE, which keeps new transactions from referencing them meanwhile.
+    """
+    cur.execute(
+        f"""
+        SELECT c.name FROM {table_name} c
+        WHERE c.name = ANY(%s)
+          AND EXISTS (SELECT 1 FROM transactions t WHERE t.{CATEGORY_ID_COLUMNS[table_name]} = c.id)
+        ORDER BY c.name;
+        """,
+        (list(names),)
+    )
+    return [row[0] for row in cur.fetchall()]
+
+def _save_db_categories(cur, table_name, categories_data):
+    """
+    Makes `table_name` hold exactly `categories_data` ({name: icon}), writing only the rows
+    that differ: at most one INSERT, one UPDATE and one DELETE. Returns True if anything changed.
+    Raises ValueError if a category to be removed still has transactions.
+    """
+    cur.execute(f"SELECT name, icon FROM {table_name} FOR UPDATE;")
+    inserts, updates, deletes = _diff_categories(dict(cur.fetchall()), categories_data)
+
+    if deletes:
+        in_use = _categories_in_use(cur, table_name, deletes)
+        if in_use:
+            raise ValueError(f"Categories still used by transactions cannot be removed: {', '.join(in_use)}")
+        cur.execute(f"DELETE FROM {table_name} WHERE name = ANY(%s);", (deletes,))
+    if updates:
+        execute_values(
+            cur,
+            f"""
+            UPDATE {table_name} AS c SET icon = v.icon
+            FROM (VALUES %s) AS v (name, icon)
+            WHERE c.name = v.name;
+            """,
+            updates
+        )
+    if inserts:
+        execute_values(cur, f"INSERT INTO {table_name} (name, icon) VALUES %s;", inserts)
+    return bool(inserts or updates or deletes)
+
+def _write_categories(kind, statement, params):
+    """Runs one category statement and, if it changed a row, bumps the settings version. Returns the row count."""
     conn = db.get_db_connection()
     try:
         with conn.cursor() as cur:
-            # Clear existing categories for simplicity before re-inserting
-            # In a real app, you might do a diff and update/insert/delete more granularly
-            cur.execute(f"DELETE FROM {table_name};")
-            
-            for name, icon in categories_data.items():
-                cur.execute(
-                    f"INSERT INTO {table_name} (name, icon) VALUES (%s, %s);",
-                    (name, icon)
-                )
-            conn.commit()
+            cur.execute(statement.format(table=CATEGORY_TABLES[kind]), params)
+            changed = cur.rowcount
+            if changed:
+                _bump_settings_version(cur)
+            db.commit(conn)
+            if changed:
+                db.on_commit(conn, invalidate_settings_cache)
+            return changed
     finally:
         db.release_db_connection(conn)
 
+def add_category(kind, name, icon):
+    """Adds an 'expense' or 'income' category. Returns False if one with that name already exists."""
+    return _write_categories(
+        kind, "INSERT INTO {table} (name, icon) VALUES (%s, %s) ON CONFLICT (name) DO NOTHING;", (name, icon)
+    ) > 0
 
+def rename_category(kind, old_name, new_name, icon):
+    """
+    Renames a category and sets its icon. Transactions and monthly rollups refer to the category
+    by id, so only the category row changes. Returns False if `old_name` does not exist.
+    Raises ValueError when renaming to or from one of BUILT_IN_CATEGORIES.
+    """
+    if old_name != new_name:
+        for name in (old_name, new_name):
+            if name in BUILT_IN_CATEGORIES:
+                raise ValueError(f'"{name}" is a built-in category and cannot be renamed.')
 
-def get_settings():
+    conn = db.get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"UPDATE {CATEGORY_TABLES[kind]} SET name = %s, icon = %s WHERE name = %s;",
+                (new_name, icon, old_name)
+            )
+            if cur.rowcount == 0:
+                return False
+            _bump_settings_version(cur)
+            db.commit(conn)
+            # Report caches follow on their own: category writes bump the ledger version
+            db.on_commit(conn, invalidate_settings_cache)
+            return True
+    finally:
+        db.release_db_connection(conn)
+
+def delete_category(kind, name):
     """
-    Reads settings from the PostgreSQL database.
-    If no settings exist, it returns a default value.
+    Deletes a category. Returns False if it does not exist.
+    Raises ValueError if transactions are still filed under it.
     """
-    settings = {}
+    table_name = CATEGORY_TABLES[kind]
     conn = db.get_db_connection()
     try:
         with conn.cursor() as cur:
-            # Get monthly_savings_goal
-            cur.execute("SELECT value FROM settings WHERE key = 'monthly_savings_goal';")
-            result = cur.fetchone()
-            settings['monthly_savings_goal'] = float(result[0]) if result else DEFAULT_MONTHLY_SAVINGS_GOAL
+            cur.execute(f"SELECT id FROM {table_name} WHERE name = %s FOR UPDATE;", (name,))
+            if cur.fetchone() is None:
+                return False
+            if _categories_in_use(cur, table_name, [name]):
+                raise ValueError(f'"{name}" still has transactions; move or delete them first.')
+            cur.execute(f"DELETE FROM {table_name} WHERE name = %s;", (name,))
+            _bump_settings_version(cur)
+            db.commit(conn)
+            db.on_commit(conn, invalidate_settings_cache)
+            return True
     finally:
         db.release_db_connection(conn)
 
+def _load_settings(cur):
+    """Reads settings and both category tables with the given cursor. Returns (settings, version)."""
+    settings = {}
+    cur.execute(
+        "SELECT key, value FROM settings WHERE key IN ('monthly_savings_goal', %s);",
+        (SETTINGS_VERSION_KEY,)
+    )
+    values = dict(cur.fetchall())
+    settings['monthly_savings_goal'] = float(values['monthly_savings_goal']) if 'monthly_savings_goal' in values else DEFAULT_MONTHLY_SAVINGS_GOAL
+
     # Get expense categories and icons
-    expense_categories, category_icons = _get_db_categories('expense_categories')
+    expense_categories, category_icons = _fetch_categories(cur, 'expense_categories')
     settings['expense_categories'] = expense_categories
     settings['category_icons'] = category_icons
 
     # Get income categories and icons
-    income_categories, income_category_icons = _get_db_categories('income_categories')
+    income_categories, income_category_icons = _fetch_categories(cur, 'income_categories')
     settings['income_categories'] = income_categories
     settings['income_category_icons'] = income_category_icons
-    
-    return settings
+
+    return settings, values.get(SETTINGS_VERSION_KEY)
+
+def get_settings():
+    """
+    Reads settings from the PostgreSQL database.
+    If no settings exist, it returns a default value.
+    Results are cached in process; the shared version stamp is re-checked at most
+    every SETTINGS_VERSION_CHECK_INTERVAL seconds, so most calls cost no round trip.
+    Callers get their own copy and may modify it freely.
+    """
+    global _cached_settings, _cached_version, _last_version_check
+    with _cache_lock:
+        cached, cached_version, last_check = _cached_settings, _cached_version, _last_version_check
+    now = time.monotonic()
+    if cached is not None and now - last_check < SETTINGS_VERSION_CHECK_INTERVAL:
+        return copy.deepcopy(cached)
+
+    conn = db.get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            if cached is not None:
+                cur.execute("SELECT value FROM settings WHERE key = %s;", (SETTINGS_VERSION_KEY,))
+                result = cur.fetchone()
+                if (result[0] if result else None) == cached_version:
+                    with _cache_lock:
+                        _last_version_check = now
+                    return copy.deepcopy(cached)
+            settings, version = _load_settings(cur)
+    finally:
+        db.release_db_connection(conn)
+
+    with _cache_lock:
+        _cached_settings = settings
+        _cached_version = version
+        _last_version_check = now
+    return copy.deepcopy(settings)
 
 def save_settings(data):
     """
     Saves the provided settings data to the PostgreSQL database.
+    Only what differs from the stored values is written; category lists are left alone
+    when `data` does not include them. Nothing is written when nothing changed.
     """
     conn = db.get_db_connection()
     try:
         with conn.cursor() as cur:
+            changed = False
             # Save monthly_savings_goal
-            monthly_goal = data.get('monthly_savings_goal', DEFAULT_MONTHLY_SAVINGS_GOAL)
-            cur.execute(
-                "INSERT INTO settings (key, value) VALUES (%s, %s) ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value;",
-                ('monthly_savings_goal', str(monthly_goal))
-            )
-            conn.commit()
-    finally:
-        db.release_db_connection(conn)
+            monthly_goal = str(data.get('monthly_savings_goal', DEFAULT_MONTHLY_SAVINGS_GOAL))
+            cur.execute("SELECT value FROM settings WHERE key = 'monthly_savings_goal' FOR UPDATE;")
+            row = cur.fetchone()
+            if row is None or row[0] != monthly_goal:
+                cur.execute(
+                    "INSERT INTO settings (key, value) VALUES (%s, %s) ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value;",
+                    ('monthly_savings_goal', monthly_goal)
+                )
+                changed = True
 
-    # Prepare data for _save_db_categories
-    expense_category_map = {}
-    for cat_name in data.get('expense_categories', []):
-        expense_category_map[cat_name] = data.get('category_icons', {}).get(cat_name, "fa-tags")
-    _save_db_categories('expense_categories', expense_category_map)
+            if 'expense_categories' in data:
+                icons = data.get('category_icons', {})
+                expense_category_map = {name: icons.get(name, "fa-tags") for name in data['expense_categories']}
+                changed = _save_db_categories(cur, 'expense_categories', expense_category_map) or changed
 
-    income_category_map = {}
-    for cat_name in data.get('income_categories', []):
-        income_category_map[cat_name] = data.get('income_category_icons', {}).get(cat_name, "fa-briefcase")
-    _save_db_categories('income_categories', income_category_map)
+            if 'income_categories' in data:
+                icons = data.get('income_category_icons', {})
+                income_category_map = {name: icons.get(name, "fa-briefcase") for name in data['income_categories']}
+                changed = _save_db_categories(cur, 'income_categories', income_category_map) or changed
+
+            if changed:
+                _bump_settings_version(cur)
+            db.commit(conn)
+            if changed:
+                db.on_commit(conn, invalidate_settings_cache)
+    finally:
+        db.release_db_connection(conn)
 
 def initialize_default_settings():
     """
@@ -108,7 +298,7 @@ def initialize_default_settings():
                     "INSERT INTO settings (key, value) VALUES (%s, %s);",
                     ('monthly_savings_goal', str(DEFAULT_MONTHLY_SAVINGS_GOAL))
                 )
-                conn.commit()
+                db.commit(conn)
 
             # Check and populate expense categories
             cur.execute("SELECT COUNT(*) FROM expense_categories;")
@@ -136,7 +326,7 @@ def initialize_default_settings():
                         "INSERT INTO expense_categories (name, icon) VALUES (%s, %s);",
                         (name, icon)
                     )
-                conn.commit()
+                db.commit(conn)
                 
             # Check and populate income categories
             cur.execute("SELECT COUNT(*) FROM income_categories;")
@@ -152,7 +342,7 @@ def initialize_default_settings():
                         "INSERT INTO income_categories (name, icon) VALUES (%s, %s);",
                         (name, icon)
                     )
-                conn.commit()
+                db.commit(conn)
 
     finally:
         db.release_db_connection(conn)
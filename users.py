@@ -0,0 +1,69 @@
+import os
+import threading
+import time
+from flask_login import UserMixin
+import queries
+
+# User accounts. Kept out of app.py so the lookups (and their prepared statements) can be
+# used without creating the Flask app, e.g. by benchmarks/prepared_statements.py.
+
+
+class User(UserMixin):
+    def __init__(self, id, username, email, password_hash, role='user', totp_secret=None):
+        self.id = id
+        self.username = username
+        self.email = email
+        self.password_hash = password_hash
+        self.role = role
+        self.totp_secret = totp_secret
+
+# Looked up on every authenticated request (user_loader) and at login, so they are prepared once per connection
+USER_COLUMNS = "id, username, email, password_hash, role, totp_secret"
+queries.register('user_by_id', f"SELECT {USER_COLUMNS} FROM users WHERE id = $1")
+queries.register('user_by_username', f"SELECT {USER_COLUMNS} FROM users WHERE username = $1")
+queries.register('user_by_email', f"SELECT {USER_COLUMNS} FROM users WHERE email = $1")
+
+# Bumped at commit by every write to users (migrate.py, migration 14), so each process can
+# tell that the users it has cached are stale
+queries.register('users_version', "SELECT version FROM users_version", arg_count=0)
+# Seconds a process keeps using the users_version it last read before reading it again
+USER_VERSION_CHECK_INTERVAL = float(os.environ.get('USER_VERSION_CHECK_INTERVAL', 1))
+
+_version_lock = threading.Lock()
+_users_version = None
+_last_version_check = 0.0
+
+def current_users_version():
+    """
+    The shared users change counter. It is read again at most every
+    USER_VERSION_CHECK_INTERVAL seconds, so most calls cost no round trip.
+    """
+    global _users_version, _last_version_check
+    now = time.monotonic()
+    with _version_lock:
+        if _users_version is not None and now - _last_version_check < USER_VERSION_CHECK_INTERVAL:
+            return _users_version
+    row = queries.fetch_one('users_version')
+    version = row[0] if row else 0
+    with _version_lock:
+        _users_version = version
+        _last_version_check = now
+    return version
+
+def get_user_by_username(username):
+    user_data = queries.fetch_one('user_by_username', username)
+    if user_data:
+        return User(id=user_data[0], username=user_data[1], email=user_data[2], password_hash=user_data[3], role=user_data[4], totp_secret=user_data[5])
+    return None
+
+def get_user_by_id(user_id):
+    user_data = queries.fetch_one('user_by_id', user_id)
+    if user_data:
+        return User(id=user_data[0], username=user_data[1], email=user_data[2], password_hash=user_data[3], role=user_data[4], totp_secret=user_data[5])
+    return None
+
+def get_user_by_email(email):
+    user_data = queries.fetch_one('user_by_email', email)
+    if user_data:
+        return User(id=user_data[0], username=user_data[1], email=user_data[2], password_hash=user_data[3], role=user_data[4], totp_secret=user_data[5])
+    return None